@@ -1,10 +1,23 @@
 ### To Do
 # - Nothing
 
+import bisect
+import collections
+import contextlib
 import copy
+import itertools
+import os
+import re
 import time
+import weakref
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # numpy is optional. It is only needed for the "numpy" image backend.
 
 class cckkAction:
+    __slots__ = ("_action_id", "_action", "_target_id", "_target_name", "_context")
     _next_action_id = 1
 
     def last_action_id() -> int:
@@ -46,13 +59,41 @@ class cckkCondition:
         self,
         unless_overlap: list[str] = None,
         only_if_overlap: list[str] = None,
-        keep_rect: "cckkShape" = None,
+        keep_rect: "cckkShape | cckkRect" = None,
         keep_within_assoc: bool = False
     ):
         self._unless_overlap = unless_overlap
         self._only_if_overlap = only_if_overlap
         self._keep_rect = keep_rect
         self._keep_within_assoc = keep_within_assoc
+        self._compiled = False  # True once the layer names have been resolved by compile()
+        self._unless_mask = None  # cckkCombinedMask of the unless_overlap shapes, once compiled
+        self._only_if_mask = None  # cckkCombinedMask of the only_if_overlap shapes, once compiled
+
+    def compile(self) -> "cckkCondition":
+        """Resolve the layer names once, and combine the opacity of each list of shapes into a cckkCombinedMask.
+        The masks are worked out again only when one of the shapes changes, so a condition that is used for
+        every move does no name lookups. Compile the condition again if shapes with these names are created later.
+
+        Returns:
+        cckkCondition object
+        """
+        self._unless_mask = cckkCombinedMask.from_names(self._unless_overlap)
+        self._only_if_mask = cckkCombinedMask.from_names(self._only_if_overlap)
+        self._compiled = True
+        return self
+
+    @property
+    def compiled(self) -> bool:
+        return self._compiled
+
+    @property
+    def unless_mask(self) -> "cckkCombinedMask":
+        return self._unless_mask
+
+    @property
+    def only_if_mask(self) -> "cckkCombinedMask":
+        return self._only_if_mask
 
     @property
     def unless_overlap(self) -> list[str]:
@@ -63,22 +104,294 @@ class cckkCondition:
         return self._only_if_overlap
 
     @property
-    def keep_rect(self) -> "cckkShape":
+    def keep_rect(self) -> "cckkShape | cckkRect":
         return self._keep_rect
     
     @keep_rect.setter
-    def keep_rect(self, value: "cckkShape"):
+    def keep_rect(self, value: "cckkShape | cckkRect"):
         self._keep_rect = value
 
     @property
     def keep_within_assoc(self) -> bool:
         return self._keep_within_assoc
-    
+
+
+class cckkCombinedMask:
+    """Opacity of a list of images combined into one bitmask per row, like a single image.
+    It has the same xcols, yrows, xpos, ypos and mask_at() as a cckkImage, so it can be used in their place
+    when counting overlaps. The masks are worked out when first needed and again after any of the images change.
+    """
+
+    def __init__(self, shapes: list["cckkShape"] = []):
+        """Contructs a cckkCombinedMask object
+
+        Args:
+        shapes: List of cckkImage objects
+        """
+        self._shapes = list(shapes)
+        self._rect = None  # Minimum enclosing rectangle of the shapes, or None if the masks must be worked out again
+        self._masks = {}  # Combined bitmask by y-position. Bit 0 is at the x-position of _rect.
+        for shape in self._shapes:
+            shape.add_observer(self)
+
+    def from_names(names: list[str]) -> "cckkCombinedMask":
+        """Create a combined mask of the shapes with these names. Names that are not found are ignored.
+
+        Args:
+        names: List of shape names
+
+        Returns:
+        cckkCombinedMask object, or None if there are no names
+        """
+        if names is None or len(names) == 0:
+            return None
+        shapes = [cckkShape.find(name=name) for name in names]
+        return cckkCombinedMask([shape for shape in shapes if shape is not None])
+
+    @property
+    def shapes(self) -> list["cckkShape"]:
+        return self._shapes
+
+    def shape_changed(self, shape: "cckkShape", rect):
+        """Forget the masks when one of the shapes changes"""
+        self._rect = None
+
+    @property
+    def rect(self) -> "cckkRect":
+        """Minimum enclosing rectangle of the shapes"""
+        if self._rect is None:
+            rect = cckkShape.calculate_mer(self._shapes)
+            self._masks = {}
+            for ypos in range(rect.ypos, rect.ypos + rect.yrows):
+                mask = 0
+                for shape in self._shapes:
+                    mask |= shape.mask_at(ypos, rect.xpos, rect.xcols)
+                self._masks[ypos] = mask
+            self._rect = rect
+        return self._rect
+
+    @property
+    def xcols(self) -> int:
+        return self.rect.xcols
+
+    @property
+    def yrows(self) -> int:
+        return self.rect.yrows
+
+    @property
+    def xpos(self) -> int:
+        return self.rect.xpos
+
+    @property
+    def ypos(self) -> int:
+        return self.rect.ypos
+
+    def mask_at(self, ypos: int, xpos: int, xcols: int) -> int:
+        """Combined opacity bitmask of part of a row. See cckkImage.mask_at()."""
+        rect = self.rect
+        mask = self._masks.get(ypos, 0)
+        shift = xpos - rect.xpos
+        mask = mask >> shift if shift >= 0 else mask << -shift
+        return mask & ((1 << xcols) - 1)
+
+
+class cckkRect(tuple):
+    """Immutable, unregistered rectangle used by the geometry functions.
+    It has the same xcols, yrows, xpos and ypos properties as cckkShape, but is only a tuple of four integers.
+    """
+    __slots__ = ()
+
+    def __new__(cls, xcols: int = 0, yrows: int = 0, xpos: int = 0, ypos: int = 0):
+        return tuple.__new__(cls, (xcols, yrows, xpos, ypos))
+
+    @property
+    def xcols(self) -> int:
+        """No. of columns in the rectangle"""
+        return self[0]
+
+    @property
+    def yrows(self) -> int:
+        """No. of rows in the rectangle"""
+        return self[1]
+
+    @property
+    def xpos(self) -> int:
+        return self[2]
+
+    @property
+    def ypos(self) -> int:
+        return self[3]
+
+    @property
+    def pos(self) -> tuple[int, int]:
+        return (self[2], self[3])
+
+    def overlap(self, other_rect) -> "cckkRect":
+        """Calculate the intersection of this rectangle with another rectangle or shape
+
+        Args:
+        other_rect: cckkRect or cckkShape object representing the other rectangle
+
+        Returns:
+        cckkRect object representing the intersection, or None if there is no intersection
+        """
+        inter_xpos = max(self.xpos, other_rect.xpos)
+        inter_ypos = max(self.ypos, other_rect.ypos)
+        inter_xend = min(self.xpos + self.xcols,
+                         other_rect.xpos + other_rect.xcols)
+        inter_yend = min(self.ypos + self.yrows,
+                         other_rect.ypos + other_rect.yrows)
+
+        if inter_xend > inter_xpos and inter_yend > inter_ypos:
+            return cckkRect(inter_xend - inter_xpos, inter_yend - inter_ypos, inter_xpos, inter_ypos)
+        else:
+            return None
+
+    def to_shape(self, name: str = None) -> "cckkShape":
+        """Promote the rectangle to a registered cckkShape object
+
+        Args:
+        name: Name of the new shape
+
+        Returns:
+        cckkShape object
+        """
+        return cckkShape(xcols=self.xcols, yrows=self.yrows, xpos=self.xpos, ypos=self.ypos, name=name)
+
+    def str(self) -> str:
+        return ("cckkRect: " + str(self.xcols) + " x " + str(self.yrows) +
+                " at (" + str(self.xpos) + "," + str(self.ypos) + ")\n")
+
+    def __repr__(self):
+        return f"cckkRect(xcols={self[0]}, yrows={self[1]}, xpos={self[2]}, ypos={self[3]})"
+
+
+class cckkShapeColumns:
+    """Sizes and positions of shapes held as numpy arrays, one element (slot) per shape, so that the
+    geometry of many shapes can be tested in a single vectorised expression.
+    Created by cckkShape.use_columns(). Shapes write their size and position through to it whenever they change.
+    """
+    min_shapes = 8  # Fewer shapes than this are quicker to test one at a time
+
+    def __init__(self, capacity: int = 256):
+        """Contructs a cckkShapeColumns object
+
+        Args:
+        capacity: Initial no. of slots. More are added when needed.
+
+        Raises:
+        Exception: If numpy is not installed
+        """
+        if np is None:
+            raise Exception("numpy module not found. Please install numpy to use this feature.")
+        self._xcols = np.zeros(capacity, dtype=np.int64)
+        self._yrows = np.zeros(capacity, dtype=np.int64)
+        self._xpos = np.zeros(capacity, dtype=np.int64)
+        self._ypos = np.zeros(capacity, dtype=np.int64)
+        self._free = []  # Slots of shapes that have been freed
+        self._finalizers = {}  # weakref.finalize objects that free the slots, by slot
+        self._next_slot = 0  # Next slot that has never been used
+        self._count = 0  # No. of shapes in the columns
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, shape: "cckkShape") -> int:
+        """Give a shape a slot in the columns. The slot is freed when the shape is freed.
+
+        Args:
+        shape: cckkShape object
+
+        Returns:
+        Slot of the shape
+        """
+        if len(self._free) > 0:
+            slot = self._free.pop()
+        else:
+            slot = self._next_slot
+            self._next_slot += 1
+            if slot >= len(self._xcols):
+                size = 2 * len(self._xcols) if len(self._xcols) > 0 else 64
+                self._xcols, self._yrows, self._xpos, self._ypos = (
+                    np.concatenate((column, np.zeros(size - len(column), dtype=np.int64)))
+                    for column in (self._xcols, self._yrows, self._xpos, self._ypos))
+        shape._column_store = self
+        shape._column_slot = slot
+        self._count += 1
+        self.update(shape)
+        self._finalizers[slot] = weakref.finalize(shape, self._release, slot)
+        return slot
+
+    def _release(self, slot: int):
+        # Free the slot of a shape. A zero size never overlaps anything.
+        self._finalizers.pop(slot, None)
+        self._xcols[slot] = self._yrows[slot] = 0
+        self._free.append(slot)
+        self._count -= 1
+
+    def close(self):
+        """Stop using the columns. The shapes no longer write through to them, and no longer keep them alive."""
+        for finalizer in list(self._finalizers.values()):
+            info = finalizer.detach()
+            if info is not None and info[0]._column_store is self:
+                info[0]._column_store = info[0]._column_slot = None
+        self._finalizers = {}
+        self._free = []
+        self._count = 0
+
+    def update(self, shape: "cckkShape"):
+        """Copy the size and position of a shape into its slot"""
+        slot = shape._column_slot
+        self._xcols[slot] = shape._xcols
+        self._yrows[slot] = shape._yrows
+        self._xpos[slot] = shape._xpos
+        self._ypos[slot] = shape._ypos
+
+    def slots(self, shapes: list["cckkShape"]):
+        """Slots of a list of shapes, or None if any of them are not in the columns.
+        Shapes that keep the same list of shapes, such as a viewer with its images, cache the result."""
+        try:
+            if any(shape._column_store is not self for shape in shapes):
+                return None
+            return np.fromiter((shape._column_slot for shape in shapes), dtype=np.intp, count=len(shapes))
+        except AttributeError:  # cckkRect objects have no slots
+            return None
+
+    def mer(self, slots) -> cckkRect:
+        """Minimum enclosing rectangle of the shapes in a (non-empty) array of slots"""
+        xpos, ypos = self._xpos[slots], self._ypos[slots]
+        min_xpos, min_ypos = int(xpos.min()), int(ypos.min())
+        max_xpos = int((xpos + self._xcols[slots]).max())
+        max_ypos = int((ypos + self._yrows[slots]).max())
+        return cckkRect(max_xpos - min_xpos, max_ypos - min_ypos, min_xpos, min_ypos)
+
+    def overlapping(self, rect, slots):
+        """Test which shapes overlap a rectangle, in the same way as cckkRect.overlap()
+
+        Args:
+        rect: cckkShape or cckkRect object
+        slots: Array of slots
+
+        Returns:
+        numpy array of booleans, True where the shape overlaps the rectangle
+        """
+        xpos, ypos = self._xpos[slots], self._ypos[slots]
+        inter_xpos = np.maximum(xpos, rect.xpos)
+        inter_ypos = np.maximum(ypos, rect.ypos)
+        inter_xend = np.minimum(xpos + self._xcols[slots], rect.xpos + rect.xcols)
+        inter_yend = np.minimum(ypos + self._yrows[slots], rect.ypos + rect.yrows)
+        return (inter_xend > inter_xpos) & (inter_yend > inter_ypos)
+
 
 class cckkShape:
     _next_id = 1
-    _all_by_id = {}
-    _all_by_name = {}
+    _all_by_id = weakref.WeakValueDictionary()  # Registry only holds weak references, so unused shapes are freed
+    _all_by_name = weakref.WeakValueDictionary()
+    _scopes = []  # Stack of open cckkShape.scope() blocks
+    _columns = None  # Optional cckkShapeColumns holding the size and position of every shape
+    _columns_version = 0  # Changed whenever use_columns() replaces _columns
+    max_actions = 1000  # No. of actions kept for undo() by new shapes. Use set_history() to change it for a shape.
+    _default_max_actions = object()  # Default for set_history(), standing for the current max_actions
 
     def find(id: int = None, name: str = None) -> "cckkShape":
         """Find a cckkShape object by its ID and/or name
@@ -113,6 +426,24 @@ class cckkShape:
                     shape_list.append(shape)
         return shape_list
 
+    @contextlib.contextmanager
+    def scope():
+        """Context manager that unregisters every shape created within it when the block exits
+
+        Returns:
+        List of weak references to the shapes created within the block
+        """
+        shape_refs = []
+        cckkShape._scopes.append(shape_refs)
+        try:
+            yield shape_refs
+        finally:
+            cckkShape._scopes.remove(shape_refs)
+            for shape_ref in shape_refs:
+                shape = shape_ref()
+                if shape is not None:
+                    shape.unregister()
+
     def __init__(self, xcols: int = 0, yrows: int = 0, xpos: int = 0, ypos: int = 0, name: str = None):
         """Contructs a cckkShape object.
 
@@ -134,25 +465,151 @@ class cckkShape:
         self._name = name if name is not None else f"{self._id:>04}"
         self._assocs = []    # Stack of associated objects, such as the images linked to a viewer.
         # Each entry is a dictionary that includes the id and/or name of the object.
-        self._mer_rect = None  # Minimum enclosing rectangle of the associated shapes
-        self._actions = [] # Stack of cckkAction objects representing actions carried out on this and associated objects
+        self._mer_rect = None  # Minimum enclosing rectangle of the associated shapes, or None if it must be worked out again
+        self._actions = collections.deque(maxlen=cckkShape.max_actions) # Stack of cckkAction objects representing actions carried out on this and associated objects. The oldest are dropped when it is full.
+        self._coalesce_moves = False  # If True, consecutive moves of the same shape are recorded as one action
+        self._assoc_objs = {}  # Strong references to the associated objects, keyed by ID, so they outlive the weak registry
+        self._assoc_values = []  # Associated objects, in the same order as _assocs (None if not found yet)
+        self._assoc_ids = []  # IDs of the associated objects, in the same order as _assocs
+        self._assoc_names = []  # Names of the associated objects, in the same order as _assocs
+        self._assoc_by_id = {}  # (rank, associated object dictionary) by ID. Position in _assocs is rank - _assoc_first
+        self._assoc_by_name = {}  # (rank, associated object dictionary) by name
+        self._assoc_first = 0  # Rank of the first entry in _assocs
+        self._assoc_unresolved = 0  # Number of associated objects not found when they were added
+        self._assoc_shapes_cache = None  # (columns version, associated objects found, their slots), or None if they must be worked out again
+        self._observers = None  # Objects to tell when the shape changes (weak references), created when first needed
+        self._column_store = None  # cckkShapeColumns that the size and position are written through to
+        self._column_slot = None  # Slot of the shape in _column_store
 
         self.set(xcols, yrows, xpos, ypos)
+        if cckkShape._columns is not None:
+            cckkShape._columns.add(self)
+        self.register()
+
+    def use_columns(capacity: int = 256) -> "cckkShapeColumns":
+        """Keep the size and position of every registered shape, and every new shape, in numpy arrays.
+        calculate_mer() and overlapping() then test large lists of shapes as vectorised expressions.
+
+        Args:
+        capacity: Initial no. of shapes to make room for. If None, the arrays are no longer used.
+
+        Returns:
+        cckkShapeColumns object, or None
+
+        Raises:
+        Exception: If numpy is not installed
+        """
+        if cckkShape._columns is not None:
+            cckkShape._columns.close()
+        cckkShape._columns_version += 1
+
+        if capacity is None:
+            cckkShape._columns = None
+        else:
+            cckkShape._columns = cckkShapeColumns(capacity)
+            for shape in list(cckkShape._all_by_id.values()):
+                cckkShape._columns.add(shape)
+        return cckkShape._columns
 
-        if self._id in cckkShape._all_by_id:
+    def register(self) -> "cckkShape":
+        """Add the shape to the registry so that it can be found by ID or name.
+        The registry only holds weak references, so the shape is removed automatically once it is no longer used.
+
+        Returns:
+        cckkShape object
+
+        Raises:
+        Exception: If another shape with the same ID or name is already registered
+        """
+        if cckkShape._all_by_id.get(self._id, self) is not self:
             raise Exception("cckkShape ID already exists")
-        if self._name in cckkShape._all_by_name:
+        if cckkShape._all_by_name.get(self._name, self) is not self:
             raise Exception("cckkShape name already exists")
         cckkShape._all_by_id[self._id] = self
         cckkShape._all_by_name[self._name] = self
 
+        if len(cckkShape._scopes) > 0:
+            cckkShape._scopes[-1].append(weakref.ref(self))
+        return self
+
+    def unregister(self) -> "cckkShape":
+        """Remove the shape from the registry. It can no longer be found by ID or name.
+
+        Returns:
+        cckkShape object
+        """
+        if cckkShape._all_by_id.get(self._id, None) is self:
+            del cckkShape._all_by_id[self._id]
+        if cckkShape._all_by_name.get(self._name, None) is self:
+            del cckkShape._all_by_name[self._name]
+        return self
+
+    @property
+    def registered(self) -> bool:
+        """True if the shape can be found in the registry"""
+        return cckkShape._all_by_id.get(self._id, None) is self
+
     def set(self, xcols: int = 0, yrows: int = 0, xpos: int = 0, ypos: int = 0) -> "cckkShape":
+        old_rect = self.rect if self._observers else None
         self._xcols = xcols  # No. of columns in the shape
         self._yrows = yrows  # No. of rows in the shape
         self._xpos = xpos  # X-position of the shape
         self._ypos = ypos  # Y-position of the shape
+        self._update_columns()
+        if old_rect is not None and old_rect != self.rect:
+            self.changed(old_rect).changed()
+        return self
+
+    def add_observer(self, observer) -> "cckkShape":
+        """Tell an object whenever the shape moves, changes size or has its contents changed.
+        The object's shape_changed(shape, rect) method is called with the area that has changed.
+        Only a weak reference to the object is held.
+
+        Args:
+        observer: Object with a shape_changed() method, such as a cckkViewer
+
+        Returns:
+        cckkShape object
+        """
+        if self._observers is None:
+            self._observers = weakref.WeakValueDictionary()
+        self._observers[id(observer)] = observer
+        return self
+
+    def remove_observer(self, observer) -> "cckkShape":
+        """Stop telling an object about changes to the shape"""
+        if self._observers is not None:
+            self._observers.pop(id(observer), None)
+        return self
+
+    def changed(self, rect=None) -> "cckkShape":
+        """Tell the observers that an area has changed
+
+        Args:
+        rect: cckkShape or cckkRect object representing the area that has changed. If None, the whole shape has changed.
+
+        Returns:
+        cckkShape object
+        """
+        if self._observers:
+            rect = self.rect if rect is None else rect
+            for observer in list(self._observers.values()):
+                observer.shape_changed(self, rect)
         return self
 
+    def _update_columns(self):
+        # Write the size and position through to the cckkShapeColumns holding the shape, if any
+        if self._column_store is not None:
+            self._column_store.update(self)
+
+    def _set_geometry(self, attribute: str, value: int):
+        # Set a size or position attribute. If it changes, tell the observers about both the old and the new area.
+        old_rect = self.rect if self._observers and value != getattr(self, attribute) else None
+        setattr(self, attribute, value)
+        self._update_columns()
+        if old_rect is not None:
+            self.changed(old_rect).changed()
+
     @property
     def xcols(self) -> int:
         """No. of columns in the shape"""
@@ -160,7 +617,7 @@ class cckkShape:
 
     @xcols.setter
     def xcols(self, value: int):
-        self._xcols = value
+        self._set_geometry("_xcols", value)
 
     @property
     def yrows(self) -> int:
@@ -169,7 +626,7 @@ class cckkShape:
 
     @yrows.setter
     def yrows(self, value: int):
-        self._yrows = value
+        self._set_geometry("_yrows", value)
 
     @property
     def xpos(self) -> int:
@@ -177,7 +634,7 @@ class cckkShape:
 
     @xpos.setter
     def xpos(self, value):
-        self._xpos = value
+        self._set_geometry("_xpos", value)
 
     @property
     def ypos(self) -> int:
@@ -185,7 +642,7 @@ class cckkShape:
 
     @ypos.setter
     def ypos(self, value):
-        self._ypos = value
+        self._set_geometry("_ypos", value)
 
     @property
     def pos(self) -> tuple[int,int]:
@@ -193,8 +650,25 @@ class cckkShape:
 
     @pos.setter
     def pos(self, value: tuple[int, int]):
-        self.xpos = value[0]
-        self.ypos = value[1]
+        self._set_pos(value[0], value[1])
+
+    def _set_pos(self, xpos: int, ypos: int):
+        # Set both parts of the position, telling the observers about the old and new areas only once
+        if self._observers and (xpos != self._xpos or ypos != self._ypos):
+            old_rect = self.rect
+            self._xpos = xpos
+            self._ypos = ypos
+            self._update_columns()
+            self.changed(old_rect).changed()
+        else:
+            self._xpos = xpos
+            self._ypos = ypos
+            self._update_columns()
+
+    @property
+    def rect(self) -> cckkRect:
+        """Size and position of the shape as a cckkRect object"""
+        return cckkRect(self.xcols, self.yrows, self.xpos, self.ypos)
 
     @property
     def name(self) -> str:
@@ -212,6 +686,8 @@ class cckkShape:
             return 0
 
     def __eq__(self, other : object):
+        if isinstance(other, cckkRect):
+            return self.rect == other
         if not isinstance(other, cckkShape):
             # Don't attempt to compare against unrelated types
             return NotImplemented
@@ -228,18 +704,17 @@ class cckkShape:
         Returns:
         Associated object dictionary, or None if not found
         """
-        ret_dic = None
-        if id is not None:
-            for assoc in self.assocs:
-                if assoc.get("id", None) == id:
-                    ret_dic = assoc
-
-        if ret_dic is None and name is not None:
-            for assoc in self.assocs:
-                if assoc.get("name", None) == name:
-                    ret_dic = assoc
-
-        return ret_dic
+        entry = self._assoc_by_id.get(id, None) if id is not None else None
+        if entry is None and name is not None:
+            entry = self._assoc_by_name.get(name, None)
+        return entry[1] if entry is not None else None
+
+    def _assoc_position(self, id: int = None, name: str = None) -> int:
+        """Position of an associated object in the stack (0 is the first entry), or None if not found"""
+        entry = self._assoc_by_id.get(id, None) if id is not None else None
+        if entry is None and name is not None:
+            entry = self._assoc_by_name.get(name, None)
+        return entry[0] - self._assoc_first if entry is not None else None
 
     def _add_assoc(self, assoc: dict, add_to_start: bool = True) -> "cckkShape":
         """Add an associated object dictionary to the shape
@@ -251,30 +726,170 @@ class cckkShape:
         Returns:
         cckkShape object
         """
-        if assoc.get("id", None) is None and assoc.get("name", None) is None:
+        id = assoc.get("id", None)
+        name = assoc.get("name", None)
+        if id is None and name is None:
             raise Exception("Either ID or name must be provided for an associated object")
 
+        obj = cckkShape.find(id=id, name=name)
+        if obj is not None:
+            self._assoc_objs[obj.id] = obj  # Keep associated objects alive while they are associated
+            obj.add_observer(self)  # Keep the MER up to date as the shape moves
+        else:
+            self._assoc_unresolved += 1
+
+        # Ranks only grow outwards from the existing entries, so the other entries keep their ranks.
+        # Where IDs or names are repeated, the lookups find the last matching entry.
         if add_to_start:
+            self._assoc_first -= 1
+            rank = self._assoc_first
             self._assocs.insert(0, assoc)
+            self._assoc_values.insert(0, obj)
+            self._assoc_ids.insert(0, id)
+            self._assoc_names.insert(0, name)
+            if id is not None:
+                self._assoc_by_id.setdefault(id, (rank, assoc))
+            if name is not None:
+                self._assoc_by_name.setdefault(name, (rank, assoc))
         else:
+            rank = self._assoc_first + len(self._assocs)
             self._assocs.append(assoc)
-
-        self._mer_rect = cckkShape.calculate_mer(self.assoc_values)
+            self._assoc_values.append(obj)
+            self._assoc_ids.append(id)
+            self._assoc_names.append(name)
+            if id is not None:
+                self._assoc_by_id[id] = (rank, assoc)
+            if name is not None:
+                self._assoc_by_name[name] = (rank, assoc)
+
+        self._assoc_shapes_cache = None
+        if obj is not None:
+            if self._mer_rect is not None and len(self._assoc_values) - self._assoc_unresolved > 1:
+                self._mer_rect = cckkShape.calculate_mer([self._mer_rect, obj])
+            else:
+                self._mer_rect = None
 
         return self
 
+    def _remove_assoc(self, id: int = None, name: str = None) -> dict:
+        """Remove an associated object dictionary from the shape
+
+        Args:
+        id: ID of the associated object
+        name: Name of the associated object
+
+        Returns:
+        Associated object dictionary that was removed, or None if not found
+        """
+        position = self._assoc_position(id, name)
+        if position is None:
+            return None
+
+        assoc = self._assocs.pop(position)
+        obj = self._assoc_values.pop(position)
+        if obj is not None and not any(value is obj for value in self._assoc_values):
+            # Only let go of the object once no other entry refers to it
+            self._assoc_objs.pop(obj.id, None)
+            obj.remove_observer(self)
+        self._reindex_assocs()
+        self._assoc_shapes_cache = None
+        self._mer_rect = None
+        return assoc
+
+    def _reindex_assocs(self):
+        # Rebuild the lookups after an entry has been removed from the stack
+        self._assoc_values = []
+        self._assoc_ids = []
+        self._assoc_names = []
+        self._assoc_by_id = {}
+        self._assoc_by_name = {}
+        self._assoc_first = 0
+        self._assoc_unresolved = 0
+        for rank, assoc in enumerate(self._assocs):
+            assoc_id = assoc.get("id", None)
+            assoc_name = assoc.get("name", None)
+            obj = self._assoc_objs.get(assoc_id, None)
+            if obj is None:
+                obj = cckkShape.find(id=assoc_id, name=assoc_name)
+            if obj is None:
+                self._assoc_unresolved += 1
+            self._assoc_values.append(obj)
+            self._assoc_ids.append(assoc_id)
+            self._assoc_names.append(assoc_name)
+            if assoc_id is not None:
+                self._assoc_by_id[assoc_id] = (rank, assoc)
+            if assoc_name is not None:
+                self._assoc_by_name[assoc_name] = (rank, assoc)
+
     @property
     def assocs(self) -> list[dict]:
         return self._assocs
 
     @property
     def assoc_values(self) -> list["cckkShape"]:
-        assoc_objs = []
-        for assoc in self._assocs:
-            obj = cckkShape.find(id=assoc.get("id", None), name=assoc.get("name", None))
-            assoc_objs.append(obj)
-        return assoc_objs
-        # return [cckkShape.find(id=assoc.id, name=assoc.name) for assoc in self._assocs]
+        return list(self._assoc_list())
+
+    def _assoc_list(self) -> list["cckkShape"]:
+        # Associated objects, in the same order as the stack. The list is not copied, so must not be modified.
+        if self._assoc_unresolved > 0:
+            # Look again for associated objects that did not exist when they were added
+            self._assoc_unresolved = 0
+            for i, assoc in enumerate(self._assocs):
+                if self._assoc_values[i] is None:
+                    obj = cckkShape.find(id=assoc.get("id", None), name=assoc.get("name", None))
+                    if obj is None:
+                        self._assoc_unresolved += 1
+                    else:
+                        self._assoc_objs[obj.id] = obj
+                        self._assoc_values[i] = obj
+                        obj.add_observer(self)
+                        self._assoc_shapes_cache = None
+                        self._mer_rect = None
+        return self._assoc_values
+
+    def _assoc_shapes(self) -> tuple[list["cckkShape"], object]:
+        # Associated objects that have been found, and their slots in cckkShape._columns (None if not usable).
+        # Both are kept until the associated objects change or different columns are used.
+        shapes = self._assoc_list()
+        cache = self._assoc_shapes_cache
+        if cache is None or cache[0] != cckkShape._columns_version:
+            found = [shape for shape in shapes if shape is not None]
+            slots = None
+            columns = cckkShape._columns
+            if columns is not None and len(found) >= cckkShapeColumns.min_shapes:
+                slots = columns.slots(found)
+            cache = self._assoc_shapes_cache = (cckkShape._columns_version, found, slots)
+        return cache[1], cache[2]
+
+    @property
+    def mer(self) -> cckkRect:
+        """Minimum enclosing rectangle of the associated shapes.
+        It grows as shapes are added or move outwards, and is only worked out again from all the shapes
+        when a shape that was on one of its edges moves inwards or is removed."""
+        if self._mer_rect is None:
+            self._mer_rect = cckkShape.calculate_mer(*self._assoc_shapes())
+        return self._mer_rect
+
+    def shape_changed(self, shape: "cckkShape", rect):
+        """Update the MER when an associated shape changes
+
+        Args:
+        shape: cckkShape object that has changed
+        rect: cckkShape or cckkRect object representing the area that has changed, such as the old position of the shape
+        """
+        mer = self._mer_rect
+        if mer is None or shape.id not in self._assoc_objs:
+            return
+
+        new_rect = shape.rect
+        if ((rect.xpos <= mer.xpos and new_rect.xpos > mer.xpos) or
+                (rect.ypos <= mer.ypos and new_rect.ypos > mer.ypos) or
+                (rect.xpos + rect.xcols >= mer.xpos + mer.xcols and new_rect.xpos + new_rect.xcols < mer.xpos + mer.xcols) or
+                (rect.ypos + rect.yrows >= mer.ypos + mer.yrows and new_rect.ypos + new_rect.yrows < mer.ypos + mer.yrows)):
+            self._mer_rect = None  # The shape was on an edge and has moved inwards
+        elif (new_rect.xpos < mer.xpos or new_rect.ypos < mer.ypos or
+                new_rect.xpos + new_rect.xcols > mer.xpos + mer.xcols or new_rect.ypos + new_rect.yrows > mer.ypos + mer.yrows):
+            self._mer_rect = cckkShape.calculate_mer([mer, new_rect])
 
     def _update_assoc(self, id: int = None, name: str = None, attribute:str = None, value = None) -> dict:
         """Update an attribute of an associated object dictionary
@@ -293,39 +908,54 @@ class cckkShape:
             assoc[attribute] = value
         return self
 
-    def get_assoc_ids(self, below_id: int = None, below_name: str = None) -> list[int]:
-        assoc_ids = []
-        found = False
+    def _below_position(self, below_id: int = None, below_name: str = None) -> int:
+        # Position of the first entry below the named one, or None if there is no such entry
         if below_id is None and below_name is None:
-            found = True
-
-        for assoc in self._assocs:
-            if found:
-                assoc_ids.append(assoc.get("id", None))
-            elif assoc.get("id", None) == below_id or assoc.get("name", None) == below_name:
-                found = True
+            return 0
+        positions = [pos for pos in (self._assoc_position(id=below_id), self._assoc_position(name=below_name)) if pos is not None]
+        return min(positions) + 1 if positions else None
 
-        return assoc_ids
+    def get_assoc_ids(self, below_id: int = None, below_name: str = None) -> list[int]:
+        start = self._below_position(below_id, below_name)
+        return self._assoc_ids[start:] if start is not None else []
 
     def get_assoc_names(self, below_id: int = None, below_name: str = None) -> list[int]:
-        assoc_names = []
-        found = False
-        if below_id is None and below_name is None:
-            found = True
+        start = self._below_position(below_id, below_name)
+        return self._assoc_names[start:] if start is not None else []
 
-        for assoc in self._assocs:
-            if found:
-                assoc_names.append(assoc.get("name", None))
-            elif assoc.get("id", None) == below_id or assoc.get("name", None) == below_name:
-                found = True
+    def set_history(self, max_actions: int = _default_max_actions, coalesce_moves: bool = False) -> "cckkShape":
+        """Set how many actions are kept for undo()
+
+        Args:
+        max_actions: Maximum no. of actions to keep. The oldest actions are dropped first. If None, all actions are kept.
+        If not given, cckkShape.max_actions is used.
+        coalesce_moves: If True, consecutive moves of the same shape are recorded as one action, so undo() returns it
+        to where it was before the first of the moves
+
+        Returns:
+        cckkShape object
+        """
+        if max_actions is cckkShape._default_max_actions:
+            max_actions = cckkShape.max_actions
+        self._actions = collections.deque(self._actions, maxlen=max_actions)
+        self._coalesce_moves = coalesce_moves
+        return self
 
-        return assoc_names
+    def _coalesce(self, action: str, target_id: int, target_name: str) -> bool:
+        # True if the action can be merged into the last action recorded
+        if not self._coalesce_moves or action != "move" or len(self._actions) == 0:
+            return False
+        last = self._actions[-1]
+        return last.action == "move" and last.target_id == target_id and last.target_name == target_name
 
     def add_action(self, action: str = "move", target_id: int = None, target_name: str = None, context: dict = None):
         if target_id is None and target_name is None:
             target_id = self.id
             target_name = self.name
 
+        if self._coalesce(action, target_id, target_name):
+            return self
+
         if action == "move" and context is None:
             context = {"before": (self.xpos, self.ypos)}
 
@@ -339,7 +969,10 @@ class cckkShape:
         assoc_id = assoc.get("id", None)
         assoc_name = assoc.get("name", None)
 
-        shape = cckkShape.find(id=assoc_id, name=assoc_name)
+        shape = self._assoc_objs.get(assoc_id, None) or cckkShape.find(id=assoc_id, name=assoc_name)
+
+        if self._coalesce(action, assoc_id, assoc_name):
+            return shape
 
         if action == "move" and context is None:
             context = {"before": (shape.xpos, shape.ypos)}
@@ -347,29 +980,88 @@ class cckkShape:
         self._actions.append(cckkAction(action=action, target_id=assoc_id, target_name=assoc_name, context=context))
         return shape
 
-    def overlap_multi_count(self, other_shapes):
+    def overlap_multi_count(self, other_shapes, pos: tuple[int, int] = None):
         """Count the overlap a stack of other shapes. Placeholder in cckkShape.
 
         Args:
         other_shapes: Stack (list) of cckkShape objects
+        pos: Position to test the shape at, instead of its current position
 
         Returns: 0
         """
         return 0
 
+    def can_move_to(self, xpos: int | tuple[int, int], ypos: int = None, condition: cckkCondition = None) -> bool:
+        """Check whether move_to() would accept a move, without moving the shape or recording an action
+
+        Args:
+        xpos: New x-position. if a tuple with the format (x,y), use this as the position
+        ypos: New y-position
+        condition: cckkCondition object specifying conditions for the move
+
+        Returns:
+        True if the overlap conditions allow the move
+        """
+        if condition is None:
+            return True
+
+        if isinstance(xpos, tuple) and len(xpos) == 2:
+            xpos, ypos = xpos
+        pos = (xpos if xpos is not None else self.xpos, ypos if ypos is not None else self.ypos)
+
+        return self._allowed_at(pos, *self._condition_shapes(condition, cckkRect(self.xcols, self.yrows, pos[0], pos[1])))
+
+    def _condition_shapes(self, condition: cckkCondition, area=None) -> tuple[list["cckkShape"], list["cckkShape"]]:
+        # Shapes named in the unless_overlap and only_if_overlap conditions (None if there is no such condition).
+        # If the shape is in a viewer with a spatial index, named shapes in the viewer that cannot touch the area are left out.
+        unless_shapes = only_if_shapes = None
+        if condition is not None and condition.compiled:
+            if condition.unless_mask is not None:
+                unless_shapes = [condition.unless_mask]
+            if condition.only_if_mask is not None:
+                only_if_shapes = [condition.only_if_mask]
+        elif condition is not None:
+            if condition.unless_overlap is not None and len(condition.unless_overlap) > 0:
+                unless_shapes = self._named_shapes(condition.unless_overlap, area)
+            if condition.only_if_overlap is not None and len(condition.only_if_overlap) > 0:
+                only_if_shapes = self._named_shapes(condition.only_if_overlap, area)
+        return unless_shapes, only_if_shapes
+
+    def _named_shapes(self, names: list[str], area=None) -> list["cckkShape"]:
+        # Shapes with the names. With an area and a viewer holding this shape in its spatial index,
+        # indexed shapes that cannot touch the area are left out, so they are never overlap-checked.
+        shapes = self.find_multi(name_list=names)
+        if area is None or not self._observers:
+            return shapes
+
+        for observer in list(self._observers.values()):
+            if isinstance(observer, cckkViewer) and observer._index is not None and self.id in observer._index:
+                index = observer._index
+                candidates = index.query(area)
+                return [shape for shape in shapes if shape.id in candidates or shape.id not in index]
+        return shapes
+
+    def _allowed_at(self, pos: tuple[int, int], unless_shapes: list["cckkShape"], only_if_shapes: list["cckkShape"]) -> bool:
+        # True if the shape would meet the overlap conditions at the position
+        if unless_shapes is not None and self.overlap_multi_count(unless_shapes, pos) > 0:
+            return False
+        if only_if_shapes is not None and self.overlap_multi_count(only_if_shapes, pos) == 0:
+            return False
+        return True
+
     def undo(self):
         dealt_with = False
+        if len(self._actions) == 0:
+            return dealt_with
         action = self._actions[-1] 
 
         match action.action:
             case "move":
-                shape = cckkShape.find(id=action.target_id, name=action.target_name)
-                shape.move_to(action.context["before"])
+                self._actions.pop()
+                shape = self._assoc_objs.get(action.target_id, None) or cckkShape.find(id=action.target_id, name=action.target_name)
+                shape._set_pos(*action.context["before"])  # Not recorded as a new action
                 dealt_with = True
 
-        if dealt_with:
-            self._actions.pop() 
-
         return dealt_with
 
     def move_to(self, xpos: int | tuple[int, int], ypos: int = None, condition: cckkCondition = None):
@@ -383,30 +1075,24 @@ class cckkShape:
         Returns:
         cckkShape object
         """
-        self.add_action()
-
         if isinstance(xpos, tuple) and len(xpos) == 2:
             xpos, ypos = xpos
 
-        if xpos is not None:
-            self.xpos = xpos
-        if ypos is not None:
-            self.ypos = ypos
-
-        if condition is not None:
-            if condition.unless_overlap is not None and len(condition.unless_overlap) > 0:
-                shapes = self.find_multi(name_list=condition.unless_overlap)
-                if self.overlap_multi_count(shapes) > 0:
-                    self.undo()
+        before = (self.xpos, self.ypos)
+        xpos = xpos if xpos is not None else self.xpos
+        ypos = ypos if ypos is not None else self.ypos
 
-            if condition.only_if_overlap is not None and len(condition.only_if_overlap) > 0:
-                shapes = self.find_multi(name_list=condition.only_if_overlap)
-                if self.overlap_multi_count(shapes) == 0:
-                    self.undo()
+        # Check the conditions first, so that a rejected move leaves the shape alone
+        accepted = self.can_move_to(xpos, ypos, condition)
+        if accepted:
+            self._set_pos(xpos, ypos)
 
         if condition is not None and (condition.keep_rect is not None or condition.keep_within_assoc):
             self.keep_within(condition.keep_rect, condition.keep_within_assoc)
 
+        if accepted or (self.xpos, self.ypos) != before:
+            self.add_action(context={"before": before})
+
         return self
 
     def move(self, dx: int | tuple[int, int], dy: int = None, condition: cckkCondition = None):
@@ -429,6 +1115,51 @@ class cckkShape:
         self.move_to(xpos, ypos, condition=condition)
         return self
 
+    def sweep(self, dx: int | tuple[int, int], dy: int = None, condition: cckkCondition = None):
+        """Move the shape along a straight line, stopping at the last position before the overlap conditions fail,
+        such as just before it hits a wall named in unless_overlap. The whole path is checked in one pass.
+
+        Args:
+        dx: Change in x-position. if a tuple with the format (ddx,dy), use this as the position delta
+        dy: Change in y-position
+        condition: cckkCondition object specifying conditions for the move
+
+        Returns:
+        cckkShape object
+        """
+        if isinstance(dx, tuple) and len(dx) == 2:
+            dx, dy = dx
+        dx = dx if dx is not None else 0
+        dy = dy if dy is not None else 0
+
+        # Positions along the line, one step at a time, ending at (xpos + dx, ypos + dy)
+        steps = max(abs(dx), abs(dy))
+        path = [(self.xpos + (2 * dx * i + steps) // (2 * steps), self.ypos + (2 * dy * i + steps) // (2 * steps))
+                for i in range(1, steps + 1)]
+
+        # The path is a straight line, so the area it sweeps is covered by the start and end positions
+        end_xpos, end_ypos = path[-1] if steps > 0 else (self.xpos, self.ypos)
+        swept_rect = cckkShape.calculate_mer([self.rect, cckkRect(self.xcols, self.yrows, end_xpos, end_ypos)])
+        free_steps = self._free_steps(path, *self._condition_shapes(condition, swept_rect))
+        before = (self.xpos, self.ypos)
+        if free_steps > 0:
+            self._set_pos(*path[free_steps - 1])
+
+        if condition is not None and (condition.keep_rect is not None or condition.keep_within_assoc):
+            self.keep_within(condition.keep_rect, condition.keep_within_assoc)
+
+        if (self.xpos, self.ypos) != before:
+            self.add_action(context={"before": before})
+
+        return self
+
+    def _free_steps(self, path: list[tuple[int, int]], unless_shapes: list["cckkShape"], only_if_shapes: list["cckkShape"]) -> int:
+        # No. of positions at the start of the path where the shape meets the overlap conditions
+        for i, pos in enumerate(path):
+            if not self._allowed_at(pos, unless_shapes, only_if_shapes):
+                return i
+        return len(path)
+
     def move_to_assoc(self, xpos: int | tuple[int, int], ypos: int = None, condition: cckkCondition = None,
                       assoc_id: int = None, assoc_name: str = None):
         """Move the associated shape to the specified position
@@ -459,25 +1190,43 @@ class cckkShape:
                 cond2 = copy.copy(condition)
 
             if cond2.keep_rect is None:
-                cond2.keep_rect = self._mer_rect
+                cond2.keep_rect = self.mer
 
             assoc_shape.move(dx, dy, condition=cond2)
 
         return assoc_shape
 
-    def align(self, align_rect: "cckkShape", horiz: str = "C", vert: str = "C", condition: cckkCondition = None):
-        """Align the shape relative to another shape
-        
-        Args:
-        align_rect: cckkShape object representing the shape to align to
-        horiz: Shape horizontal alignment relative to selected shape.  Contains "L", "C" or "R" (left, centre, right)
-        vert: Shape vertical alignment relative to selected shape. Contains "T", "C" or "B" (top, centre, bottom)
-        condition: cckkCondition object specifying conditions for the move
+    def sweep_assoc(self, dx: int | tuple[int, int], dy: int = None, condition: cckkCondition = None,
+                    assoc_id: int = None, assoc_name: str = None):
+        """Move the associated shape along a straight line until the conditions stop it. See sweep().
 
         Returns:
-        cckkShape object
+        Associated cckkShape object
         """
-        new_xpos = self.xpos
+        assoc_shape = self.add_assoc_action(assoc_id=assoc_id, assoc_name=assoc_name)
+
+        if assoc_shape is not None:
+            cond2 = cckkCondition() if condition is None else copy.copy(condition)
+            if cond2.keep_rect is None:
+                cond2.keep_rect = self.mer
+
+            assoc_shape.sweep(dx, dy, condition=cond2)
+
+        return assoc_shape
+
+    def align(self, align_rect: "cckkShape", horiz: str = "C", vert: str = "C", condition: cckkCondition = None):
+        """Align the shape relative to another shape
+        
+        Args:
+        align_rect: cckkShape object representing the shape to align to
+        horiz: Shape horizontal alignment relative to selected shape.  Contains "L", "C" or "R" (left, centre, right)
+        vert: Shape vertical alignment relative to selected shape. Contains "T", "C" or "B" (top, centre, bottom)
+        condition: cckkCondition object specifying conditions for the move
+
+        Returns:
+        cckkShape object
+        """
+        new_xpos = self.xpos
         new_ypos = self.ypos
 
         if horiz.upper() == "L":
@@ -503,72 +1252,101 @@ class cckkShape:
         Test bottom-right first so that top-left correction is not overridden
 
         Args:
-        outer_rect: cckkShape object representing the outer shape
+        keep_rect: cckkShape or cckkRect object representing the outer shape
         keep_within: If True, keeps the shape fully within the MER of the associated shapes
 
         Returns:
         cckkShape object
         """
         if keep_rect is None and keep_within:
-            keep_rect = self._mer_rect
+            keep_rect = self.mer
 
         if keep_rect is not None:
-            if self.xpos + self.xcols > keep_rect.xpos + keep_rect.xcols:
-                self.xpos = keep_rect.xpos + keep_rect.xcols - self.xcols
-            if self.ypos + self.yrows > keep_rect.ypos + keep_rect.yrows:
-                self.ypos = keep_rect.ypos + keep_rect.yrows - self.yrows
-            if self.xpos < keep_rect.xpos:
-                self.xpos = keep_rect.xpos
-            if self.ypos < keep_rect.ypos:
-                self.ypos = keep_rect.ypos
+            self._set_pos(*self._pos_within(self.xpos, self.ypos, keep_rect))
 
         return self
 
+    def _pos_within(self, xpos: int, ypos: int, keep_rect) -> tuple[int, int]:
+        # Position closest to (xpos, ypos) that keeps the shape within keep_rect
+        if xpos + self.xcols > keep_rect.xpos + keep_rect.xcols:
+            xpos = keep_rect.xpos + keep_rect.xcols - self.xcols
+        if ypos + self.yrows > keep_rect.ypos + keep_rect.yrows:
+            ypos = keep_rect.ypos + keep_rect.yrows - self.yrows
+        if xpos < keep_rect.xpos:
+            xpos = keep_rect.xpos
+        if ypos < keep_rect.ypos:
+            ypos = keep_rect.ypos
+        return (xpos, ypos)
+
+    def _store_origin(self, rect) -> tuple[int, int]:
+        # Column and row of the top-left corner of a rectangle, counted from the top-left corner of this shape.
+        # This is where the rectangle starts in the pixel storage of an image or view.
+        return (rect.xpos - self.xpos, self.yrows - (rect.ypos - self.ypos) - rect.yrows)
+
     def str(self) -> str:
         return ("cckkShape: " + str(self.xcols) + " x " + str(self.yrows) +
                 " at (" + str(self.xpos) + "," + str(self.ypos) + ")\n")
 
-    def overlap(self, other_rect) -> "cckkShape":
+    def overlap(self, other_rect) -> cckkRect:
         """Calculate the intersection of this shape with another shape
 
         Args:
-        other_rect: cckkShape object representing the other shape
+        other_rect: cckkShape or cckkRect object representing the other shape
 
         Returns:
-        cckkShape object representing the intersection shape, or None if there is no intersection
+        cckkRect object representing the intersection shape, or None if there is no intersection
         """
-        inter_xpos = max(self.xpos, other_rect.xpos)
-        inter_ypos = max(self.ypos, other_rect.ypos)
-        inter_xend = min(self.xpos + self.xcols,
-                         other_rect.xpos + other_rect.xcols)
-        inter_yend = min(self.ypos + self.yrows,
-                         other_rect.ypos + other_rect.yrows)
+        return cckkRect.overlap(self, other_rect)
 
-        if inter_xend > inter_xpos and inter_yend > inter_ypos:
-            return cckkShape(
-                xcols=inter_xend - inter_xpos,
-                yrows=inter_yend - inter_ypos,
-                xpos=inter_xpos,
-                ypos=inter_ypos,
-            )
-        else:
-            return None
+    def calculate_mer(shapes=[], slots=None) -> cckkRect:
+        """Calculate the minimum enclosing rectangle of a list of shapes
 
-    def calculate_mer(shapes=[]) -> "cckkShape":
-        """Calculate the minimum enclosing rectangle of a list of shapes"""
-        mer = cckkShape()
-        if len(shapes) > 0:
-            min_xpos = min([shape.xpos for shape in shapes])
-            min_ypos = min([shape.ypos for shape in shapes])
-            max_xpos = max([shape.xpos + shape.xcols for shape in shapes])
-            max_ypos = max([shape.ypos + shape.yrows for shape in shapes])
-            mer.set(
-                xcols=max_xpos - min_xpos,
-                yrows=max_ypos - min_ypos,
-                xpos=min_xpos,
-                ypos=min_ypos,
-            )
-        return mer
+        Args:
+        shapes: List of cckkShape or cckkRect objects
+        slots: Slots of the shapes in cckkShape._columns, if already known
+
+        Returns:
+        cckkRect object. An empty list gives an empty rectangle at (0,0).
+        """
+        if len(shapes) == 0:
+            return cckkRect()
+
+        columns = cckkShape._columns
+        if columns is not None and len(shapes) >= cckkShapeColumns.min_shapes:
+            slots = columns.slots(shapes) if slots is None else slots
+            if slots is not None:
+                return columns.mer(slots)
+
+        min_xpos = min_ypos = max_xpos = max_ypos = None
+        for shape in shapes:
+            xpos, ypos = shape.xpos, shape.ypos
+            xend, yend = xpos + shape.xcols, ypos + shape.yrows
+            if min_xpos is None:
+                min_xpos, min_ypos, max_xpos, max_ypos = xpos, ypos, xend, yend
+            else:
+                min_xpos = xpos if xpos < min_xpos else min_xpos
+                min_ypos = ypos if ypos < min_ypos else min_ypos
+                max_xpos = xend if xend > max_xpos else max_xpos
+                max_ypos = yend if yend > max_ypos else max_ypos
+        return cckkRect(max_xpos - min_xpos, max_ypos - min_ypos, min_xpos, min_ypos)
+
+    def overlapping(rect, shapes=[], slots=None) -> list["cckkShape"]:
+        """Find the shapes in a list whose bounding box overlaps a rectangle
+
+        Args:
+        rect: cckkShape or cckkRect object
+        shapes: List of cckkShape or cckkRect objects
+        slots: Slots of the shapes in cckkShape._columns, if already known
+
+        Returns:
+        List of the shapes that overlap the rectangle, in the same order as the list
+        """
+        columns = cckkShape._columns
+        if columns is not None and len(shapes) >= cckkShapeColumns.min_shapes:
+            slots = columns.slots(shapes) if slots is None else slots
+            if slots is not None:
+                return [shapes[i] for i in np.flatnonzero(columns.overlapping(rect, slots))]
+        return [shape for shape in shapes if cckkRect.overlap(rect, shape) is not None]
 
 class cckkLayerFactory:
     # Create a dictionary that represents an image layer
@@ -579,6 +1357,102 @@ class cckkLayerFactory:
             "visible": visible
         }
 
+class cckkSpatialGrid:
+    # Uniform grid over the bounding boxes of shapes, used by a cckkViewer to find the images that can touch an area
+    # without testing every image. Each grid cell holds the IDs of the shapes that cover part of it.
+    # Shapes covering more than max_cells cells are kept in a separate list that every query checks.
+    ##############################################################################################
+
+    """Uniform grid spatial index over shape bounding boxes"""
+    max_cells = 64
+
+    def __init__(self, cell_size: int = 8):
+        """Contructs a cckkSpatialGrid object
+
+        Args:
+        cell_size: Width and height of each grid cell
+        """
+        self._cell_size = cell_size
+        self._cells = {}  # Shape IDs in each cell, by (column, row) of the cell
+        self._rects = {}  # Bounding box (cckkRect) of each shape, by shape ID
+        self._large = set()  # IDs of shapes covering too many cells to index
+
+    @property
+    def cell_size(self) -> int:
+        return self._cell_size
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, id: int):
+        return id in self._rects
+
+    def _cell_ranges(self, rect):
+        # Ranges of grid columns and rows covered by a rectangle
+        size = self._cell_size
+        return (range(rect.xpos // size, (rect.xpos + rect.xcols - 1) // size + 1),
+                range(rect.ypos // size, (rect.ypos + rect.yrows - 1) // size + 1))
+
+    def insert(self, id: int, rect) -> "cckkSpatialGrid":
+        """Add a shape to the index, or update its bounding box if already added
+
+        Args:
+        id: ID of the shape
+        rect: cckkShape or cckkRect object representing the bounding box
+
+        Returns:
+        cckkSpatialGrid object
+        """
+        rect = cckkRect(rect.xcols, rect.yrows, rect.xpos, rect.ypos)
+        if self._rects.get(id, None) == rect:
+            return self
+        self.remove(id)
+        self._rects[id] = rect
+
+        cols, rows = self._cell_ranges(rect)
+        if len(cols) * len(rows) > cckkSpatialGrid.max_cells:
+            self._large.add(id)
+        else:
+            for col in cols:
+                for row in rows:
+                    self._cells.setdefault((col, row), set()).add(id)
+        return self
+
+    def remove(self, id: int) -> "cckkSpatialGrid":
+        """Remove a shape from the index"""
+        rect = self._rects.pop(id, None)
+        if rect is not None and id in self._large:
+            self._large.discard(id)
+        elif rect is not None:
+            cols, rows = self._cell_ranges(rect)
+            for col in cols:
+                for row in rows:
+                    cell = self._cells.get((col, row), None)
+                    if cell is not None:
+                        cell.discard(id)
+                        if len(cell) == 0:
+                            del self._cells[(col, row)]
+        return self
+
+    def query(self, rect) -> set[int]:
+        """Find the shapes whose bounding box overlaps a rectangle
+
+        Args:
+        rect: cckkShape or cckkRect object representing the area to search
+
+        Returns:
+        Set of shape IDs
+        """
+        candidates = set(self._large)
+        cols, rows = self._cell_ranges(rect)
+        for col in cols:
+            for row in rows:
+                cell = self._cells.get((col, row), None)
+                if cell is not None:
+                    candidates |= cell
+        return {id for id in candidates if cckkRect.overlap(self._rects[id], rect) is not None}
+
+
 class cckkViewer(cckkShape):
     # Class representation of a viewer of images for display on a SenseHat
     # The viewer represents the view area through which an image is seen. This view can be displayed on a SenseHat LED matrix.
@@ -588,7 +1462,8 @@ class cckkViewer(cckkShape):
 
     """Class representation of a viewer of images for display on a SenseHat"""
 
-    def __init__(self, xcols=8, yrows=8, xpos=0, ypos=0, fill=(0, 0, 0), images=[], horiz=None, vert=None, name: str = None):
+    def __init__(self, xcols=8, yrows=8, xpos=0, ypos=0, fill=(0, 0, 0), images=[], horiz=None, vert=None, name: str = None,
+                 backend: str = "list"):
         """Contructs a cckkViewer object.
         The viewer represents the view area through which an image is seen. This view can be displayed on a SenseHat LED matrix.
 
@@ -600,16 +1475,26 @@ class cckkViewer(cckkShape):
         fill: Fill colour if the image does not fill the viewer
         images: List of cckkImage objects that are viewed through the viewer, First image in the list is at the *back*.
         name: Name of the viewer
+        backend: Pixel storage used to composite the view: "list", "numpy", "palette" or "runs"
 
         Returns:
         cckkViewer object
 
         Raises:
-        Exception: Never
+        Exception: If invalid backend specified
         """
         super().__init__(xcols=xcols, yrows=yrows, xpos=xpos, ypos=ypos, name=name)  # Initialize cckkShape base class
+        if backend not in cckkImage.backends:
+            raise Exception("Invalid viewer backend '" + str(backend) + "'")
 
         self._fill = fill  # Fill colour if the image does not fill the viewer
+        self._backend = backend  # Pixel storage backend used to composite the view
+        self._front = None  # Frame buffer holding the current view, returned by pixels and view()
+        self._back = None  # Frame buffer that refresh() renders into before swapping it with the front buffer
+        self._frame_rect = None  # Position and size of the viewer when the front buffer was rendered
+        self._dirty = []  # Areas of the viewer (cckkRect objects) that have changed since the last refresh
+        self._dirty_all = True  # If True, the whole frame must be rendered again
+        self._index = None  # Optional cckkSpatialGrid of the images' bounding boxes
 
         self.add_images(images)
 
@@ -618,8 +1503,12 @@ class cckkViewer(cckkShape):
 
     @property
     def background(self):
+        """The viewer with no images, as a one-dimensional array of the fill colour.
+        view() and pixels show the fill colour wherever no image covers the viewer."""
         return [self._fill] * (self.xcols * self.yrows)
 
+    max_dirty_rects = 32  # Above this number of changed areas, the whole frame is rendered again
+
     def _add_action(self, action: str, target_name: str = None, context = None):
         self._actions.append(cckkAction(action=action, target_name=target_name, context=context))
 
@@ -639,8 +1528,116 @@ class cckkViewer(cckkShape):
                 cckkLayerFactory.create(id=img.id, name=img.name, visible=True),
                 add_to_start=True,
             )  # Add new layers at the front
+            img.add_observer(self)
+            if self._index is not None:
+                self._index.insert(img.id, img)
+        self._dirty_all = True
+        return self
+
+    def use_spatial_index(self, cell_size: int = 8) -> "cckkViewer":
+        """Keep a spatial index of the images' bounding boxes, so that overlap tests only look at
+        the images that can touch the image being tested. The index is updated as the images move.
+
+        Args:
+        cell_size: Size of each grid cell. If None, the spatial index is removed.
+
+        Returns:
+        cckkViewer object
+        """
+        if cell_size is None:
+            self._index = None
+        else:
+            self._index = cckkSpatialGrid(cell_size)
+            for img in self._assoc_list():
+                if img is not None:
+                    self._index.insert(img.id, img)
         return self
 
+    def layers_touching(self, rect) -> list[str]:
+        """Find the images whose bounding box overlaps a rectangle
+
+        Args:
+        rect: cckkShape or cckkRect object representing the area to search
+
+        Returns:
+        List of image names, starting with the top layer
+        """
+        if self._index is not None:
+            ids = sorted(self._index.query(rect), key=self._assoc_position)
+            return [self._assoc_objs[id].name for id in ids]
+        return [img.name for img in cckkShape.overlapping(rect, *self._assoc_shapes())]
+
+    def _other_images(self, img: "cckkImage", other_names: list[str] = None) -> list["cckkImage"]:
+        """Images to test an image against: the named images, or the images below it in the viewer.
+        With a spatial index, images in the viewer that cannot touch the image are left out.
+        """
+        if self._index is None:
+            if other_names is None:
+                other_names = self._find_below(img.name)
+            return self.find_multi(name_list=other_names)
+
+        candidates = self._index.query(img)
+        if other_names is None:
+            position = self._assoc_position(id=img.id)
+            if position is None:
+                return []
+            ids = sorted((id for id in candidates if (self._assoc_position(id=id) or 0) > position), key=self._assoc_position)
+            return [self._assoc_objs[id] for id in ids]
+
+        other_imgs = self.find_multi(name_list=other_names)
+        return [other_img for other_img in other_imgs if other_img.id in candidates or other_img.id not in self._index]
+
+    def shape_changed(self, shape: cckkShape, rect):
+        """Mark an area of the viewer as needing to be rendered again. Called when an associated image changes.
+
+        Args:
+        shape: cckkShape object that has changed
+        rect: cckkShape or cckkRect object representing the area that has changed
+        """
+        super().shape_changed(shape, rect)
+        if self._index is not None and shape.id in self._index:
+            self._index.insert(shape.id, shape)
+
+        if not self._dirty_all:
+            dirty_rect = cckkRect.overlap(self, rect)
+            if dirty_rect is not None:
+                if len(self._dirty) < cckkViewer.max_dirty_rects:
+                    self._dirty.append(dirty_rect)
+                else:
+                    self._dirty_all = True
+                    self._dirty.clear()
+
+    def refresh(self) -> bool:
+        """Render the areas of the viewer that have changed since the last refresh into the back buffer,
+        then swap it with the front buffer. The whole frame is only rendered when the viewer itself moves,
+        changes size or has images added. Otherwise the front buffer is copied and only the changed areas are rendered.
+
+        Returns:
+        True if the front buffer changed
+        """
+        rect = self.rect
+        render_all = self._dirty_all or self._front is None or rect != self._frame_rect
+        if not render_all and len(self._dirty) == 0:
+            return False
+
+        if self._back is None or self._back.xcols != self.xcols or self._back.yrows != self.yrows:
+            # The "list" backend renders into a flat list that can be sent to the SenseHat as it is
+            frame_type = cckkFrameBuffer if self._backend == "list" else cckkImage.backends[self._backend]
+            self._back = frame_type.blank(self.xcols, self.yrows)
+
+        if render_all:
+            self.render_into(self._back)
+        else:
+            self._back.copy_from(self._front)
+            for dirty_rect in dict.fromkeys(self._dirty):  # Remove duplicates, keeping the order
+                self.render_into(self._back, dirty_rect)
+
+        self._front, self._back = self._back, self._front
+        self._frame_rect = rect
+        self._dirty_all = False
+        self._dirty.clear()
+        return True
+
     def align_to_img(self, img_name: str = "", horiz: str = "C", vert: str = "C", keep_img_name: str = None):
         """Align the viewer relative to an image
 
@@ -662,41 +1659,65 @@ class cckkViewer(cckkShape):
 
         return self
 
+    def _visible_images(self) -> list["cckkImage"]:
+        """Visible images in the viewer, starting with the bottom layer"""
+        images = []
+        for layer, img in zip(reversed(self.assocs), reversed(self._assoc_list())):
+            if layer.get("visible", False):
+                if img is not None and not isinstance(img, cckkImage):
+                    raise Exception("Invalid image associated with viewer")
+                if img is not None and img.store is not None:
+                    images.append(img)
+        return images
+
+    def render_into(self, store: "cckkPixelStore", rect=None) -> "cckkPixelStore":
+        """Composite the visible images into pixel storage the size of the viewer, such as a cckkFrameBuffer.
+        No new pixel storage is allocated.
+        The visible part of each image is worked out once and painted as a block, so the cost depends
+        on the area where the images overlap the viewer rather than the size of the viewer.
+
+        Args:
+        store: Pixel storage to render into, with the same size as the viewer
+        rect: cckkShape or cckkRect object representing the area of the viewer to render. If None, renders the whole viewer.
+
+        Returns:
+        Pixel storage object
+        """
+        rect = self.rect if rect is None else cckkRect.overlap(self, rect)
+        if rect is None:
+            return store
+
+        col, row = self._store_origin(rect)
+        store.fill(col, row, rect.xcols, rect.yrows, self._fill)
+        for img in self._visible_images():  # Start with the bottom layer and paint each one on top
+            inter_rect = cckkRect.overlap(rect, img)
+            if inter_rect is not None:
+                col, row = self._store_origin(inter_rect)
+                img_col, img_row = img._store_origin(inter_rect)
+                img_store, img_col, img_row = img.store.region(img_col, img_row, inter_rect.xcols, inter_rect.yrows)
+                store.paint(col, row, img_store, img_col, img_row, inter_rect.xcols, inter_rect.yrows)
+        return store
+
     def view(self):
         """View of the images through the viewer
 
         Returns:
         cckkImage object representing the view of the images through the viewer
         """
-        view_img = cckkImage(imgA=self.background, img_cols=self.xcols)
-
-
-        for layer in reversed(self.assocs): # Start with the bottom layer and paint each one on top
-            if layer.get("visible", False):
-                _id = layer.get("id", None)
-                _name = layer.get("name", None)
-                img = cckkShape.find(id=_id, name=_name)
-                if img is not None and not isinstance(img, cckkImage):
-                    raise Exception("Invalid image associated with viewer")
-                for yrow in range(self.yrows):
-                    for xcol in range(self.xcols):
-                        xcol_img = self.xpos + xcol - img.xpos
-                        yrow_img = self.ypos + yrow - img.ypos
-                        if (
-                            xcol_img >= 0
-                            and xcol_img < img.xcols
-                            and yrow_img >= 0
-                            and yrow_img < img.yrows
-                        ):
-                            img_pixel = img.get_pixel(xcol_img, yrow_img)
-                            if img_pixel is not None:
-                                view_img.set_pixel(xcol, yrow, pixel=img_pixel)
-        return view_img
+        self.refresh()
+        return cckkImage().create_from_store(self._front.copy())
 
     @property
     def pixels(self):
         """View of the image through the viewer as a one-dimensional array of colour elements, ready to be sent to the SenseHat"""
-        return self.view().pixels
+        return list(self.borrow_pixels())
+
+    def borrow_pixels(self):
+        """View of the image through the viewer as a one-dimensional array, without copying it.
+        With the "list" backend this is the front buffer itself, so it must not be modified, and it is reused
+        for a later frame once the view changes twice."""
+        self.refresh()
+        return self._front.pixels()
 
     def move_to(self, xpos: int | tuple[int, int], ypos: int = None, condition: cckkCondition = None):
         """Move the viewer to the specified position
@@ -728,12 +1749,20 @@ class cckkViewer(cckkShape):
     def _find_below(self, name):
         return self.get_assoc_names(below_name=name)
 
+    def _image_changed(self, name):
+        # Mark the area of an image as needing to be rendered again
+        img = self.find_image(name)
+        if img is not None:
+            self.shape_changed(img, img)
+
     def hide_image(self, name):
         self._update_assoc(name=name, attribute="visible", value=False)
+        self._image_changed(name)
         return self
 
     def show_image(self, name):
         self._update_assoc(name=name, attribute="visible", value=True)
+        self._image_changed(name)
         return self
 
     def move_to_img(self, name, xpos, ypos=None, condition: cckkCondition = None):
@@ -744,6 +1773,54 @@ class cckkViewer(cckkShape):
         self.move_assoc(dx=dx, dy=dy, condition=condition, assoc_name=name)
         return self
 
+    def sweep_img(self, name: str, dx: int | tuple[int, int], dy: int = None, condition: cckkCondition = None):
+        self.sweep_assoc(dx=dx, dy=dy, condition=condition, assoc_name=name)
+        return self
+
+    def move_many(self, moves: list[tuple[str, int, int]], condition: cckkCondition = None) -> bool:
+        """Move several images as one transaction. Each image is checked against the scene as it was
+        before any of them moved. Either all the images move or none of them do.
+        The moves are recorded as a single action, so one undo() puts all the images back.
+
+        Args:
+        moves: List of (name, dx, dy) tuples
+        condition: cckkCondition object specifying conditions for every move. The images are kept within the condition's
+        keep_rect. If it has no keep_rect, or keep_within_assoc is set, they are also kept within the MER of the images,
+        as with move_img(). The overlap conditions are checked where each image would end up.
+
+        Returns:
+        True if the images moved, False if any move was rejected
+
+        Raises:
+        Exception: If an image is not in the viewer
+        """
+        keep_rect = condition.keep_rect if condition is not None else None
+        mer = self.mer if keep_rect is None or condition.keep_within_assoc else None
+
+        # Check every move before moving anything
+        new_positions = []
+        for name, dx, dy in moves:
+            assoc = self._get_assoc(name=name)
+            img = None
+            if assoc is not None:
+                img = self._assoc_objs.get(assoc.get("id", None), None) or cckkShape.find(name=name)
+            if img is None:
+                raise Exception("Associated object not found")
+            pos = (img.xpos + dx, img.ypos + dy)
+            if keep_rect is not None:
+                pos = img._pos_within(pos[0], pos[1], keep_rect)
+            if mer is not None:
+                pos = img._pos_within(pos[0], pos[1], mer)
+            if not img._allowed_at(pos, *img._condition_shapes(condition, cckkRect(img.xcols, img.yrows, pos[0], pos[1]))):
+                return False
+            new_positions.append((img, pos))
+
+        before = [(img, img.pos) for img, pos in new_positions]
+        self.add_action(action="MoveMany", context={"before": before})
+        for img, pos in new_positions:
+            img._set_pos(*pos)
+        return True
+
     def align_image(self, name, horiz="C", vert="C"):
         img = self.find_image(name)
         if img is not None:
@@ -751,7 +1828,7 @@ class cckkViewer(cckkShape):
         return self
 
     def align_images(self, horiz="C", vert="C"):
-        for img in self.assoc_values:
+        for img in self._assoc_list():
             img.align(self, horiz, vert)
         return self
 
@@ -820,10 +1897,7 @@ class cckkViewer(cckkShape):
         if img is None:
             return None
 
-        if other_names is None:
-            other_names = self._find_below(name)
-        other_imgs = self.find_multi(name_list=other_names)
-        return img.overlap_multi(other_imgs)
+        return img.overlap_multi(self._other_images(img, other_names))
 
     def overlap_multi_count_img(self, name, other_names = None):
         """Count the number of pixels that overlap with a stack of other images, ignoring transparent pixels
@@ -839,10 +1913,7 @@ class cckkViewer(cckkShape):
         if img is None:
             return None
 
-        if other_names is None:
-            other_names = self._find_below(name)
-        other_imgs = self.find_multi(name_list=other_names)
-        return img.overlap_multi_count(other_imgs)
+        return img.overlap_multi_count(self._other_images(img, other_names))
 
     def overlap_with(self, name, other_names = None):
         """For an image, find the name of the first image in a stack of other images that intersects
@@ -858,27 +1929,26 @@ class cckkViewer(cckkShape):
         if img is None:
             return None
 
-        if other_names is None:
-            other_names = self._find_below(name)
-        other_imgs = self.find_multi(name_list=other_names)
-
-        found = None
-        for i, other_img in enumerate(other_imgs):
-            if found is None and img.overlap_count(other_img) > 0:
-                found = other_names[i]
+        for other_img in self._other_images(img, other_names):
+            if img.overlap_count(other_img) > 0:
+                return other_img.name
 
-        return found
+        return None
 
     def undo(self):
         dealt_with = False
 
-        if not super().undo():
+        if not super().undo() and len(self._actions) > 0:
             action = self._actions[-1] 
 
             match action.action:
                 case "MoveImage":
                     self.move_to_img(name=action.target_name, xpos=action.context["before"], ypos=None)
                     dealt_with = True
+                case "MoveMany":
+                    for img, before in action.context["before"]:
+                        img._set_pos(*before)
+                    dealt_with = True
                 case _:
                     # Unknown action
                     pass
@@ -901,8 +1971,8 @@ class cckkViewer(cckkShape):
         as_str = "cckkViewer:\n"
         as_str += "  " + super().str() + "\n"
         as_str += "  Fill: " + str(self._fill) + "\n"
-        as_str += "  MER: " + self._mer_rect.str() + "\n"
-        as_str += "  Images: " + str(len(self.assoc_values)) + "\n"
+        as_str += "  MER: " + self.mer.str() + "\n"
+        as_str += "  Images: " + str(len(self._assoc_list())) + "\n"
         return as_str
 
 class cckkColourDict:
@@ -931,55 +2001,1724 @@ class cckkColourDict:
         "t": (0, 128, 255),  # Turquoise
         "v": (128, 0, 255),  # Violet
     }
+    _tables = collections.OrderedDict()  # (palette, index table) by the contents of a dictionary, so equal dictionaries share them. Least recently used first.
+    max_tables = 16  # No. of (palette, index table) pairs to keep
+
+    def __init__(
+        self,
+        colour_dict: dict[str, tuple[int, int, int]] = None,
+        update_dict: dict[str, tuple[int, int, int]] = None,
+    ):
+        self._colour_dict = (colour_dict if colour_dict is not None else cckkColourDict.def_colour_dict.copy())
+        if update_dict is not None:
+            self._colour_dict.update(update_dict)
+
+        self._reverse_colour_dict = {v: k for k, v in self._colour_dict.items()}
+        self._chars = None  # Characters of the dictionary, for checking strings, created when first needed
+
+    @property
+    def dict(self) -> dict[str, tuple[int, int, int]]:
+        return self._colour_dict
+
+    @property
+    def reverse_dict(self) -> dict:
+        return self._reverse_colour_dict
+
+    def get(self, colour_string: str) -> tuple:
+        """Convert a string to its pixel (RGB) equivalent
+
+        Args:
+        colour_string Pixel value as a character
+
+        Returns:
+        Pixel value as a list containing [R, G, B] (red, green, blue)
+        """
+        return self.dict.get(colour_string, None)
+
+    def get_rgb(self, pixel: tuple[int, int, int]) -> str:
+        """Convert a pixel to its string equivalent
+
+        Args:
+        pixel: Pixel value as a list containing [R, G, B] (red, green, blue)
+
+        Returns:
+        Pixel value as a character
+        """
+        return self.reverse_dict.get(pixel, "?")
+
+    def decode(self, lines: list[str]) -> list[list[tuple[int, int, int]]]:
+        """Convert lines of colour characters to rows of pixels. Each line is converted in a single pass.
+
+        Args:
+        lines: Lines of the image, with one character per pixel
+
+        Returns:
+        Rows of pixels
+
+        Raises:
+        Exception: If a line contains a character that is not in the colour dictionary
+        """
+        if self._chars is None:
+            self._chars = frozenset(self._colour_dict)
+        chars = self._chars
+        get = self._colour_dict.__getitem__
+        rows = []
+        for line in lines:
+            if not chars.issuperset(line):
+                ch = next(ch for ch in line if ch not in chars)
+                raise Exception("Invalid colour character '" + ch + "' in image string")
+            rows.append(list(map(get, line)))
+        return rows
+
+    def encode(self, rows) -> str:
+        """Convert rows of pixels to lines of colour characters, joining each row in a single pass.
+        Pixels that are not in the colour dictionary are converted to "?".
+
+        Args:
+        rows: Rows of pixels
+
+        Returns:
+        Lines of the image, separated by newlines
+        """
+        get = self._reverse_colour_dict.get
+        return "\n".join("".join(map(get, row, itertools.repeat("?"))) for row in rows)
+
+    @property
+    def palette(self) -> list[tuple[int, int, int]]:
+        """Colours of the dictionary as a palette for cckkPixelPalette. Index 0 is transparent (None).
+
+        Raises:
+        Exception: If the dictionary has too many colours for a palette
+        """
+        return self._palette_tables()[0]
+
+    @property
+    def index_table(self) -> "dict[int, str]":
+        """Translation table for str.translate() from each character to its palette index, as a character"""
+        return self._palette_tables()[1]
+
+    def _palette_tables(self):
+        # Palette and index table for the current contents of the dictionary. Neither is ever modified,
+        # so they are shared by all dictionaries with the same contents.
+        key = tuple(self._colour_dict.items())
+        tables = cckkColourDict._tables.get(key, None)
+        if tables is None:
+            palette = [None] + [colour for colour in dict.fromkeys(self._colour_dict.values()) if colour is not None]
+            if len(palette) > cckkPixelPalette.max_colours:
+                raise Exception("Too many colours for a palette image (maximum " + str(cckkPixelPalette.max_colours - 1) + ")")
+            index = {colour: i for i, colour in enumerate(palette)}
+            tables = (palette, str.maketrans({ch: chr(index[colour]) for ch, colour in self._colour_dict.items()}))
+            cckkColourDict._tables[key] = tables
+            if len(cckkColourDict._tables) > cckkColourDict.max_tables:
+                cckkColourDict._tables.popitem(last=False)
+        else:
+            cckkColourDict._tables.move_to_end(key)
+        return tables
+
+
+class cckkPixelStore:
+    # Base class for the pixel storage of a cckkImage. Row 0 is the top row of the image.
+    # Each pixel is a tuple containing (R, G, B), or None if the pixel is transparent.
+    # Subclasses hold the pixels and provide get(), set(), row_slice() and the other storage operations.
+    ##############################################################################################
+
+    """Base class for the pixel storage of an image"""
+    backend = None
+    rolls_in_place = True  # False if roll() cannot move the pixels, so the storage must stay wrapped in a cckkPixelWrap
+
+    def __init__(self):
+        self._runs = {}  # Cache of the opaque runs in each row, by row
+        self._masks = {}  # Cache of the opacity bitmask of each row, by row
+        self._views = None  # Views sharing the pixels (weak references), created when first needed
+
+    def view(self, col: int, row: int, xcols: int, yrows: int) -> "cckkPixelStore":
+        """Window onto a rectangular area that shares the pixels of this storage, without copying them.
+        The pixels are only copied when the view or this storage is changed. Areas that are not fully inside
+        the storage are copied straight away, as with crop().
+
+        Returns:
+        cckkPixelView object, or a copy of the area
+        """
+        if col < 0 or row < 0 or col + xcols > self.xcols or row + yrows > self.yrows:
+            return self.crop(col, row, xcols, yrows)
+        return cckkPixelView(self, col, row, xcols, yrows)
+
+    def _add_view(self, view: "cckkPixelView"):
+        if self._views is None:
+            self._views = weakref.WeakValueDictionary()
+        self._views[id(view)] = view
+
+    def _before_write(self):
+        # Called by every method that changes the pixels, before changing them
+        if self._views:
+            self._write()
+
+    def _write(self):
+        # The views sharing the pixels take their own copy first
+        views = list(self._views.values())
+        self._views = None
+        for view in views:
+            view._detach()
+
+    def invalidate(self, row: int = None) -> "cckkPixelStore":
+        """Discard information cached about a row, or all rows, after its pixels have changed
+
+        Args:
+        row: Row that has changed. If None, all rows have changed.
+
+        Returns:
+        Pixel storage object
+        """
+        if row is None:
+            self._runs.clear()
+            self._masks.clear()
+        else:
+            self._runs.pop(row, None)
+            self._masks.pop(row, None)
+        return self
+
+    def row(self, row: int) -> list[tuple[int, int, int]]:
+        """Pixels in a row. The returned list may be the storage itself, so must not be modified."""
+        return self.row_slice(row, 0, self.xcols)
+
+    def rows(self) -> list[list[tuple[int, int, int]]]:
+        """The rows of pixels. These are created from the storage, so changing them does not change the image."""
+        return self.to_rows()
+
+    def to_rows(self) -> list[list[tuple[int, int, int]]]:
+        """Copy of the rows of pixels"""
+        return [list(self.row(i)) for i in range(self.yrows)]
+
+    def pixels(self) -> list[tuple[int, int, int]]:
+        """One-dimensional list of the pixels, starting from the top row"""
+        return [pixel for i in range(self.yrows) for pixel in self.row(i)]
+
+    def opaque_runs(self, row: int) -> list[tuple[int, int]]:
+        """Runs of opaque pixels in a row, as a list of (start column, end column) tuples. The result is cached."""
+        runs = self._runs.get(row, None)
+        if runs is None:
+            runs = self._find_runs(row)
+            self._runs[row] = runs
+        return runs
+
+    def mask_row(self, row: int) -> int:
+        """Opacity bitmask of a row, as an integer where bit n is set if the pixel in column n is opaque. The result is cached."""
+        mask = self._masks.get(row, None)
+        if mask is None:
+            mask = self._find_mask(row)
+            self._masks[row] = mask
+        return mask
+
+    def cache_opacity(self) -> "cckkPixelStore":
+        """Work out the opaque runs and opacity bitmask of every row in advance, so that they are ready when needed"""
+        for i in range(self.yrows):
+            self.opaque_runs(i)
+            self.mask_row(i)
+        return self
+
+    def mask_slice(self, row: int, start: int, end: int) -> int:
+        """Opacity bitmask of part of a row, where bit n is set if the pixel in column start + n is opaque"""
+        return (self.mask_row(row) >> start) & ((1 << (end - start)) - 1)
+
+    def region(self, col: int, row: int, xcols: int, yrows: int) -> tuple["cckkPixelStore", int, int]:
+        """Pixel storage to read a rectangular area from, and the column and row of the area in it.
+        This is the storage itself, except for storage that keeps its pixels in parts, such as cckkPixelChunks."""
+        return self, col, row
+
+    def _find_mask(self, row: int) -> int:
+        mask = 0
+        for start, end in self.opaque_runs(row):
+            mask |= ((1 << (end - start)) - 1) << start
+        return mask
+
+    def _find_runs(self, row: int) -> list[tuple[int, int]]:
+        runs = []
+        start = None
+        for col, pixel in enumerate(self.row(row)):
+            if pixel is None:
+                if start is not None:
+                    runs.append((start, col))
+                    start = None
+            elif start is None:
+                start = col
+        if start is not None:
+            runs.append((start, self.xcols))
+        return runs
+
+    def count_overlap(self, other: "cckkPixelStore") -> int:
+        """Count the positions where both this storage and another storage of the same size are opaque"""
+        count = 0
+        for i in range(self.yrows):
+            for pixel, other_pixel in zip(self.row(i), other.row(i)):
+                if pixel is not None and other_pixel is not None:
+                    count += 1
+        return count
+
+    def paint(self, col: int, row: int, src: "cckkPixelStore", src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelStore":
+        """Paint the opaque pixels of an area of another pixel storage onto this storage.
+        Transparent pixels of the source leave this storage unchanged. Subclasses copy whole runs of pixels at a time.
+
+        Args:
+        col: Column of this storage to paint to
+        row: Row of this storage to paint to
+        src: Pixel storage to paint from
+        src_col: First column of the area to paint from
+        src_row: First row of the area to paint from
+        xcols: Number of columns to paint (defaults to the width of the source)
+        yrows: Number of rows to paint (defaults to the height of the source)
+
+        Returns:
+        Pixel storage object
+        """
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        src_end = src_col + xcols
+        for i in range(yrows):
+            for start, end in src.opaque_runs(src_row + i):
+                for src_c in range(max(start, src_col), min(end, src_end)):
+                    self.set(col + src_c - src_col, row + i, src.get(src_c, src_row + i))
+        return self
+
+
+class cckkPixelView(cckkPixelStore):
+    # Copy-on-write window onto part of another pixel storage (the parent).
+    # Until either of them is changed, the view reads the parent's pixels and cached run and mask information.
+    # The parent makes the view copy its area before the parent is changed, and the view copies its area
+    # before it is changed itself.
+    ##############################################################################################
+
+    """Copy-on-write window onto another pixel storage"""
+
+    def __init__(self, parent: cckkPixelStore, col: int, row: int, xcols: int, yrows: int):
+        super().__init__()
+        self._parent = parent  # Pixel storage that the pixels are shared with, until copied
+        self._col = col  # Column of the parent at the left edge of the view
+        self._row = row  # Row of the parent at the top of the view
+        self._xcols = xcols
+        self._yrows = yrows
+        self._own = None  # Pixel storage holding the view's own copy of the pixels, once copied
+        parent._add_view(self)
+
+    def _detach(self) -> cckkPixelStore:
+        # Take a copy of the shared pixels, if not already done
+        if self._own is None:
+            self._own = self._parent.crop(self._col, self._row, self._xcols, self._yrows)
+            self._parent = None
+        return self._own
+
+    @property
+    def backend(self) -> str:
+        return (self._own if self._own is not None else self._parent).backend
+
+    @property
+    def shared(self) -> bool:
+        """True if the view still shares the pixels of its parent"""
+        return self._own is None
+
+    @property
+    def xcols(self) -> int:
+        return self._xcols
+
+    @property
+    def yrows(self) -> int:
+        return self._yrows
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        if self._own is not None:
+            return self._own.get(col, row)
+        return self._parent.get(self._col + col, self._row + row)
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row"""
+        if self._own is not None:
+            return self._own.row_slice(row, start, end)
+        return self._parent.row_slice(self._row + row, self._col + start, self._col + end)
+
+    def opaque_runs(self, row: int) -> list[tuple[int, int]]:
+        """Runs of opaque pixels in a row, taken from the parent's cached runs.
+        The result is cached until the pixels are copied, as the shared pixels cannot change before then."""
+        if self._own is not None:
+            return self._own.opaque_runs(row)
+        runs = self._runs.get(row, None)
+        if runs is None:
+            col, end = self._col, self._col + self._xcols
+            runs = [(max(start, col) - col, min(stop, end) - col)
+                    for start, stop in self._parent.opaque_runs(self._row + row) if start < end and stop > col]
+            self._runs[row] = runs
+        return runs
+
+    def mask_row(self, row: int) -> int:
+        """Opacity bitmask of a row, taken from the parent's cached bitmask. The result is cached like opaque_runs()."""
+        if self._own is not None:
+            return self._own.mask_row(row)
+        mask = self._masks.get(row, None)
+        if mask is None:
+            mask = (self._parent.mask_row(self._row + row) >> self._col) & ((1 << self._xcols) - 1)
+            self._masks[row] = mask
+        return mask
+
+    def view(self, col: int, row: int, xcols: int, yrows: int) -> cckkPixelStore:
+        if self._own is not None:
+            return self._own.view(col, row, xcols, yrows)
+        if col < 0 or row < 0 or col + xcols > self._xcols or row + yrows > self._yrows:
+            return self.crop(col, row, xcols, yrows)
+        return cckkPixelView(self._parent, self._col + col, self._row + row, xcols, yrows)
+
+    def copy(self) -> cckkPixelStore:
+        if self._own is not None:
+            return self._own.copy()
+        return self._parent.crop(self._col, self._row, self._xcols, self._yrows)
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> cckkPixelStore:
+        """Copy of a rectangular area. Pixels outside the view are transparent, even where the parent has pixels."""
+        if self._own is not None:
+            return self._own.crop(col, row, xcols, yrows)
+        if col >= 0 and row >= 0 and col + xcols <= self._xcols and row + yrows <= self._yrows:
+            return self._parent.crop(self._col + col, self._row + row, xcols, yrows)
+        cropped = type(self._parent).blank(xcols, yrows)
+        col_start, col_end = max(col, 0), min(col + xcols, self._xcols)
+        row_start, row_end = max(row, 0), min(row + yrows, self._yrows)
+        if col_start < col_end and row_start < row_end:
+            cropped.paint(col_start - col, row_start - row, self, col_start, row_start, col_end - col_start, row_end - row_start)
+        return cropped
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelView":
+        self._detach().set(col, row, pixel)
+        return self
+
+    def rows(self) -> list[list[tuple[int, int, int]]]:
+        """The rows of pixels. Rows returned by a list backend are the view's own copy, so they may be changed."""
+        return self._detach().rows()
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelView":
+        self._detach().roll(dx, dy)
+        return self
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelView":
+        self._detach().fill(col, row, xcols, yrows, pixel)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelView":
+        self._detach().paint(col, row, src, src_col, src_row, xcols, yrows)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelView":
+        self._detach().fill_transparent(under)
+        return self
+
+    def __len__(self) -> int:
+        return self._yrows
+
+    def __getitem__(self, row: int) -> tuple[tuple[int, int, int]]:
+        if isinstance(row, slice):
+            return [self[i] for i in range(self._yrows)[row]]
+        if row < 0:
+            row += self._yrows
+        if not 0 <= row < self._yrows:
+            raise IndexError("cckkPixelView row out of range")
+        return tuple(self.row(row))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, cckkPixelStore):
+            other = other.to_rows()
+        return self.to_rows() == [list(row) for row in other]
+
+    __hash__ = None
+
+
+class cckkPixelList(cckkPixelStore):
+    # Pixel storage as a list of rows, each a list of pixels
+    ##############################################################################################
+
+    """Pixel storage as a list of rows of (R, G, B) tuples"""
+    backend = "list"
+
+    def __init__(self, rows: list[list[tuple[int, int, int]]] = None):
+        super().__init__()
+        self._rows = rows if rows is not None else []
+
+    def from_rows(rows: list[list[tuple[int, int, int]]]) -> "cckkPixelList":
+        """Create the pixel storage from a list of rows. The rows are used as is, not copied."""
+        return cckkPixelList(rows)
+
+    def blank(xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelList":
+        """Create pixel storage of the specified size, filled with a pixel (transparent by default)"""
+        return cckkPixelList([[pixel] * xcols for _ in range(yrows)])
+
+    @property
+    def xcols(self) -> int:
+        return len(self._rows[0]) if len(self._rows) > 0 else 0
+
+    @property
+    def yrows(self) -> int:
+        return len(self._rows)
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        return self._rows[row][col]
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelList":
+        self._before_write()
+        self._rows[row][col] = pixel
+        self.invalidate(row % len(self._rows))
+        return self
+
+    def row(self, row: int) -> list[tuple[int, int, int]]:
+        """Pixels in a row. The returned list is the storage itself, so must not be modified."""
+        return self._rows[row]
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row"""
+        return self._rows[row][start:end]
+
+    def rows(self) -> list[list[tuple[int, int, int]]]:
+        """The rows of pixels, as stored. The caller may change them, so cached information is discarded."""
+        self._before_write()
+        self.invalidate()
+        return self._rows
+
+    def pixels(self) -> list[tuple[int, int, int]]:
+        """One-dimensional list of the pixels, starting from the top row"""
+        return [pixel for row in self._rows for pixel in row]
+
+    def copy(self) -> "cckkPixelList":
+        return cckkPixelList(self.to_rows())
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelList":
+        """Roll the pixels dx columns to the right and dy rows down, wrapping around the edges"""
+        self._before_write()
+        if self.yrows > 0 and self.xcols > 0:
+            dx %= self.xcols
+            dy %= self.yrows
+            rows = self._rows[-dy:] + self._rows[:-dy] if dy != 0 else self._rows
+            self._rows = [row[-dx:] + row[:-dx] for row in rows]
+            self.invalidate()
+        return self
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> "cckkPixelList":
+        """Copy of a rectangular area. Pixels outside the storage are transparent."""
+        col_start = max(col, 0)
+        col_end = min(col + xcols, self.xcols)
+        rows = []
+        for src_row in range(row, row + yrows):
+            if 0 <= src_row < self.yrows and col_start < col_end:
+                rows.append([None] * (col_start - col) + self._rows[src_row][col_start:col_end] + [None] * (col + xcols - col_end))
+            else:
+                rows.append([None] * xcols)
+        return cckkPixelList(rows)
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelList":
+        """Set every pixel in a rectangular area"""
+        self._before_write()
+        fill_pixels = [pixel] * xcols
+        for i in range(row, row + yrows):
+            self._rows[i][col:col + xcols] = fill_pixels
+            self.invalidate(i)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelList":
+        """Paint the opaque pixels of an area of another pixel storage, copying each run with a single slice assignment"""
+        self._before_write()
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        src_end = src_col + xcols
+        offset = col - src_col
+        for i in range(yrows):
+            dst_pixels = self._rows[row + i]
+            for start, end in src.opaque_runs(src_row + i):
+                start = start if start > src_col else src_col
+                end = end if end < src_end else src_end
+                if start < end:
+                    dst_pixels[start + offset:end + offset] = src.row_slice(src_row + i, start, end)
+            self.invalidate(row + i)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelList":
+        """Replace transparent pixels with the pixels of another storage of the same size"""
+        self._before_write()
+        self._rows = [[pixel if pixel is not None else under_pixel for pixel, under_pixel in zip(row, under.row(i))]
+                      for i, row in enumerate(self._rows)]
+        self.invalidate()
+        return self
+
+
+class cckkPixelArray(cckkPixelStore):
+    # Pixel storage as numpy arrays.
+    # The colours are held in a rows x columns x 3 array of uint8, and a rows x columns boolean array marks the opaque pixels.
+    ##############################################################################################
+
+    """Pixel storage as a numpy colour plane and opacity mask"""
+    backend = "numpy"
+
+    def __init__(self, rgb, opaque):
+        super().__init__()
+        self._rgb = rgb  # Colour plane, shape (yrows, xcols, 3), dtype uint8
+        self._opaque = opaque  # Opacity mask, shape (yrows, xcols), dtype bool
+
+    def from_rows(rows: list[list[tuple[int, int, int]]]) -> "cckkPixelArray":
+        """Create the pixel storage from a list of rows. The width is taken from the first row,
+        and other rows are padded with transparent pixels or truncated to match.
+
+        Raises:
+        Exception: If numpy is not installed
+        """
+        if np is None:
+            raise Exception("numpy module not found. Please install numpy to use this feature.")
+
+        yrows = len(rows)
+        xcols = len(rows[0]) if yrows > 0 else 0
+        if any(len(row) != xcols for row in rows):
+            rows = [(list(row) + [None] * xcols)[:xcols] for row in rows]
+        opaque = np.array([[pixel is not None for pixel in row] for row in rows], dtype=bool).reshape(yrows, xcols)
+        rgb = np.array([[pixel if pixel is not None else (0, 0, 0) for pixel in row] for row in rows],
+                       dtype=np.uint8).reshape(yrows, xcols, 3)
+        return cckkPixelArray(rgb, opaque)
+
+    def blank(xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelArray":
+        """Create pixel storage of the specified size, filled with a pixel (transparent by default)
+
+        Raises:
+        Exception: If numpy is not installed
+        """
+        if np is None:
+            raise Exception("numpy module not found. Please install numpy to use this feature.")
+        store = cckkPixelArray(np.zeros((yrows, xcols, 3), dtype=np.uint8), np.zeros((yrows, xcols), dtype=bool))
+        if pixel is not None:
+            store.fill(0, 0, xcols, yrows, pixel)
+        return store
+
+    @property
+    def xcols(self) -> int:
+        return self._opaque.shape[1]
+
+    @property
+    def yrows(self) -> int:
+        return self._opaque.shape[0]
+
+    @property
+    def rgb(self):
+        """Colour plane as a numpy array"""
+        return self._rgb
+
+    @property
+    def opaque(self):
+        """Opacity mask as a numpy array"""
+        return self._opaque
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        if not self._opaque[row, col]:
+            return None
+        return tuple(self._rgb[row, col].tolist())
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelArray":
+        self._before_write()
+        if pixel is None:
+            self._rgb[row, col] = 0
+            self._opaque[row, col] = False
+        else:
+            self._rgb[row, col] = pixel
+            self._opaque[row, col] = True
+        self.invalidate(row % self.yrows)
+        return self
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row"""
+        return [tuple(pixel) if opaque else None
+                for pixel, opaque in zip(self._rgb[row, start:end].tolist(), self._opaque[row, start:end].tolist())]
+
+    def pixels(self) -> list[tuple[int, int, int]]:
+        """One-dimensional list of the pixels, starting from the top row"""
+        return [tuple(pixel) if opaque else None
+                for pixel, opaque in zip(self._rgb.reshape(-1, 3).tolist(), self._opaque.reshape(-1).tolist())]
+
+    def _find_runs(self, row: int) -> list[tuple[int, int]]:
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], self._opaque[row], [False])).astype(np.int8)))
+        return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+
+    def _find_mask(self, row: int) -> int:
+        return int.from_bytes(np.packbits(self._opaque[row], bitorder="little").tobytes(), "little")
+
+    def copy(self) -> "cckkPixelArray":
+        return cckkPixelArray(self._rgb.copy(), self._opaque.copy())
+
+    def copy_from(self, other: "cckkPixelArray") -> "cckkPixelArray":
+        """Copy the pixels of another storage of the same size into this storage, without allocating new arrays"""
+        self._before_write()
+        np.copyto(self._rgb, other._rgb)
+        np.copyto(self._opaque, other._opaque)
+        self.invalidate()
+        return self
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelArray":
+        """Roll the pixels dx columns to the right and dy rows down, wrapping around the edges"""
+        self._before_write()
+        self._rgb = np.roll(self._rgb, (dy, dx), axis=(0, 1))
+        self._opaque = np.roll(self._opaque, (dy, dx), axis=(0, 1))
+        self.invalidate()
+        return self
+
+    def _clip(self, col: int, row: int, xcols: int, yrows: int):
+        # Part of a rectangular area that is inside the storage, as (col_start, col_end, row_start, row_end)
+        return (max(col, 0), min(col + xcols, self.xcols), max(row, 0), min(row + yrows, self.yrows))
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> "cckkPixelArray":
+        """Copy of a rectangular area. Pixels outside the storage are transparent."""
+        cropped = cckkPixelArray.blank(xcols, yrows)
+        col_start, col_end, row_start, row_end = self._clip(col, row, xcols, yrows)
+        if col_start < col_end and row_start < row_end:
+            dst = (slice(row_start - row, row_end - row), slice(col_start - col, col_end - col))
+            cropped._rgb[dst] = self._rgb[row_start:row_end, col_start:col_end]
+            cropped._opaque[dst] = self._opaque[row_start:row_end, col_start:col_end]
+        return cropped
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelArray":
+        """Set every pixel in a rectangular area"""
+        self._before_write()
+        area = (slice(row, row + yrows), slice(col, col + xcols))
+        self._rgb[area] = pixel if pixel is not None else 0
+        self._opaque[area] = pixel is not None
+        for i in range(row, row + yrows):
+            self.invalidate(i)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelArray":
+        """Paint the opaque pixels of an area of another pixel storage with a single masked assignment"""
+        self._before_write()
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        if isinstance(src, cckkPixelView) and src.shared and isinstance(src._parent, cckkPixelArray):
+            # Paint straight from the arrays that the view shares
+            src_col, src_row, src = src_col + src._col, src_row + src._row, src._parent
+        if not isinstance(src, cckkPixelArray):
+            src = cckkPixelArray.from_rows([src.row_slice(src_row + i, src_col, src_col + xcols) for i in range(yrows)])
+            src_col = src_row = 0
+
+        src_area = (slice(src_row, src_row + yrows), slice(src_col, src_col + xcols))
+        mask = src._opaque[src_area]
+        dst_rgb = self._rgb[row:row + yrows, col:col + xcols]
+        dst_rgb[mask] = src._rgb[src_area][mask]
+        self._opaque[row:row + yrows, col:col + xcols] |= mask
+        for i in range(row, row + yrows):
+            self.invalidate(i)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelArray":
+        """Replace transparent pixels with the pixels of another storage of the same size"""
+        self._before_write()
+        if not isinstance(under, cckkPixelArray):
+            under = cckkPixelArray.from_rows(under.to_rows())
+        self._rgb = np.where(self._opaque[:, :, None], self._rgb, under._rgb)
+        self._opaque = self._opaque | under._opaque
+        self.invalidate()
+        return self
+
+    def count_overlap(self, other: cckkPixelStore) -> int:
+        """Count the positions where both this storage and another storage of the same size are opaque"""
+        if not isinstance(other, cckkPixelArray):
+            other = cckkPixelArray.from_rows(other.to_rows())
+        return int(np.count_nonzero(self._opaque & other._opaque))
+
+
+class cckkFrameBuffer(cckkPixelStore):
+    # Pixel storage as a single flat list of pixels, starting from the top row.
+    # Used by cckkViewer to render views, as the list is already in the format the SenseHat expects.
+    ##############################################################################################
+
+    """Pixel storage as a flat list of pixels"""
+    backend = "list"
+
+    def __init__(self, xcols: int = 0, yrows: int = 0, pixel: tuple[int, int, int] = None):
+        super().__init__()
+        self._xcols = xcols
+        self._yrows = yrows
+        self._pixels = [pixel] * (xcols * yrows)
+
+    def from_rows(rows: list[list[tuple[int, int, int]]]) -> "cckkFrameBuffer":
+        """Create the pixel storage from a list of rows of the same length"""
+        buffer = cckkFrameBuffer(len(rows[0]) if len(rows) > 0 else 0, len(rows))
+        buffer._pixels = [pixel for row in rows for pixel in row]
+        return buffer
+
+    def blank(xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkFrameBuffer":
+        """Create pixel storage of the specified size, filled with a pixel (transparent by default)"""
+        return cckkFrameBuffer(xcols, yrows, pixel)
+
+    @property
+    def xcols(self) -> int:
+        return self._xcols
+
+    @property
+    def yrows(self) -> int:
+        return self._yrows
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        return self._pixels[row * self._xcols + col]
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkFrameBuffer":
+        self._before_write()
+        self._pixels[row * self._xcols + col] = pixel
+        self.invalidate(row)
+        return self
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row"""
+        row_start = row * self._xcols
+        return self._pixels[row_start + start:row_start + end]
+
+    def pixels(self) -> list[tuple[int, int, int]]:
+        """One-dimensional list of the pixels, starting from the top row.
+        The returned list is the buffer itself, so must not be modified."""
+        return self._pixels
+
+    def copy(self) -> "cckkFrameBuffer":
+        buffer = cckkFrameBuffer(self._xcols, self._yrows)
+        buffer._pixels[:] = self._pixels
+        return buffer
+
+    def copy_from(self, other: "cckkFrameBuffer") -> "cckkFrameBuffer":
+        """Copy the pixels of another buffer of the same size into this buffer, without allocating a new buffer"""
+        self._before_write()
+        self._pixels[:] = other._pixels
+        self.invalidate()
+        return self
+
+    def roll(self, dx: int, dy: int) -> "cckkFrameBuffer":
+        """Roll the pixels dx columns to the right and dy rows down, wrapping around the edges"""
+        self._before_write()
+        rows = cckkPixelList(self.to_rows()).roll(dx, dy).rows()
+        self._pixels[:] = [pixel for row in rows for pixel in row]
+        self.invalidate()
+        return self
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> "cckkFrameBuffer":
+        """Copy of a rectangular area. Pixels outside the storage are transparent."""
+        cropped = cckkFrameBuffer(xcols, yrows)
+        col_start = max(col, 0)
+        col_end = min(col + xcols, self._xcols)
+        if col_start < col_end:
+            for i in range(max(row, 0), min(row + yrows, self._yrows)):
+                cropped_start = (i - row) * xcols + col_start - col
+                cropped._pixels[cropped_start:cropped_start + col_end - col_start] = self.row_slice(i, col_start, col_end)
+        return cropped
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkFrameBuffer":
+        """Set every pixel in a rectangular area"""
+        self._before_write()
+        fill_pixels = [pixel] * xcols
+        for i in range(row, row + yrows):
+            row_start = i * self._xcols + col
+            self._pixels[row_start:row_start + xcols] = fill_pixels
+            self.invalidate(i)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkFrameBuffer":
+        """Paint the opaque pixels of an area of another pixel storage, copying each run with a single slice assignment"""
+        self._before_write()
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        src_end = src_col + xcols
+        pixels = self._pixels
+        for i in range(yrows):
+            offset = (row + i) * self._xcols + col - src_col
+            for start, end in src.opaque_runs(src_row + i):
+                start = start if start > src_col else src_col
+                end = end if end < src_end else src_end
+                if start < end:
+                    pixels[start + offset:end + offset] = src.row_slice(src_row + i, start, end)
+            self.invalidate(row + i)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkFrameBuffer":
+        """Replace transparent pixels with the pixels of another storage of the same size"""
+        self._before_write()
+        under_pixels = under.pixels()
+        self._pixels[:] = [pixel if pixel is not None else under_pixel for pixel, under_pixel in zip(self._pixels, under_pixels)]
+        self.invalidate()
+        return self
+
+
+class cckkPixelPalette(cckkPixelStore):
+    # Pixel storage as rows of palette indices, one byte (uint8) per pixel.
+    # Index 0 is transparent, and the palette maps the other indices to (R, G, B) tuples.
+    # Images created from strings use the palette of their cckkColourDict, so copying, painting and exporting
+    # work on the indices, and the pixels are only expanded to (R, G, B) tuples when read.
+    # A palette may be shared by many storage objects, so it is never changed. Adding a colour replaces it with a longer copy.
+    ##############################################################################################
+
+    """Pixel storage as rows of palette indices"""
+    backend = "palette"
+    max_colours = 256  # Number of palette entries, including transparent
+    max_remaps = 16  # No. of translations from other palettes to keep. The least recently used are discarded first.
+    _opaque_run = re.compile(rb"[^\x00]+")  # Run of opaque pixels in a row of indices
+    _mask_digits = bytes([ord("0")] + [ord("1")] * 255)  # Translation of indices to opacity bits
+
+    def __init__(self, rows: list[bytearray] = None, palette: list[tuple[int, int, int]] = None):
+        super().__init__()
+        self._rows = rows if rows is not None else []  # Rows of indices
+        self._palette = palette if palette is not None else [None]  # Pixel for each index
+        self._index = None  # Index of each pixel in the palette, created when first needed
+        self._remaps = collections.OrderedDict()  # Translation of the indices of other palettes to this palette, by id of the other palette. Least recently used first.
+
+    def from_rows(rows: list[list[tuple[int, int, int]]], palette: list[tuple[int, int, int]] = None) -> "cckkPixelPalette":
+        """Create the pixel storage from a list of rows. The width is taken from the first row,
+        and other rows are padded with transparent pixels or truncated to match.
+
+        Args:
+        rows: Rows of pixels
+        palette: Palette to start from. Colours that are not in it are added.
+
+        Raises:
+        Exception: If there are too many colours for a palette
+        """
+        store = cckkPixelPalette([], palette)
+        xcols = len(rows[0]) if len(rows) > 0 else 0
+        index = store._colour_index
+        store._rows = [(bytearray(index(pixel) for pixel in row) + bytearray(xcols))[:xcols] for row in rows]
+        return store
+
+    def from_string(lines: list[str], colour_dict: "cckkColourDict") -> "cckkPixelPalette":
+        """Create the pixel storage from lines of colour characters, using the palette of a colour dictionary.
+        Each line is translated to indices in one pass. The width is taken from the first line.
+
+        Args:
+        lines: Lines of the image, with one character per pixel
+        colour_dict: Colour dictionary to map the characters to colours
+
+        Returns:
+        cckkPixelPalette object
+
+        Raises:
+        Exception: If a line contains a character that is not in the colour dictionary
+        """
+        table = colour_dict.index_table
+        chars = frozenset(colour_dict.dict)
+        xcols = len(lines[0]) if len(lines) > 0 else 0
+        rows = []
+        for line in lines:
+            if not chars.issuperset(line):
+                ch = next(ch for ch in line if ch not in chars)
+                raise Exception("Invalid colour character '" + ch + "' in image string")
+            rows.append((bytearray(line.translate(table), "latin-1") + bytearray(xcols))[:xcols])
+        return cckkPixelPalette(rows, colour_dict.palette)
+
+    def blank(xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelPalette":
+        """Create pixel storage of the specified size, filled with a pixel (transparent by default)"""
+        store = cckkPixelPalette()
+        store._rows = [bytearray([store._colour_index(pixel)]) * xcols for _ in range(yrows)]
+        return store
+
+    @property
+    def palette(self) -> list[tuple[int, int, int]]:
+        """Pixel for each index. Index 0 is transparent (None). The list must not be modified."""
+        return self._palette
+
+    def _colour_index(self, pixel: tuple[int, int, int]) -> int:
+        # Index of a pixel in the palette, adding it to a copy of the palette if necessary
+        if pixel is None:
+            return 0
+        if self._index is None:
+            self._index = {colour: i for i, colour in reversed(list(enumerate(self._palette)))}
+        index = self._index.get(pixel, None)
+        if index is None:
+            if len(self._palette) >= cckkPixelPalette.max_colours:
+                raise Exception("Too many colours for a palette image (maximum " + str(cckkPixelPalette.max_colours - 1) + ")")
+            index = len(self._palette)
+            self._palette = self._palette + [tuple(pixel)]
+            self._index[tuple(pixel)] = index
+        return index
+
+    def _remap(self, palette: list[tuple[int, int, int]]) -> bytes:
+        # Translation table from the indices of another palette to the indices of this palette, or None if they are the same
+        if palette is self._palette:
+            return None
+        remaps = self._remaps
+        remap = remaps.get(id(palette), None)
+        if remap is None or remap[0] is not palette:
+            remap = (palette, bytes(self._colour_index(pixel) for pixel in palette).ljust(256, b"\x00"))
+            remaps[id(palette)] = remap
+            if len(remaps) > cckkPixelPalette.max_remaps:
+                remaps.popitem(last=False)
+        else:
+            remaps.move_to_end(id(palette))
+        return remap[1]
+
+    def _indices(self, src: cckkPixelStore, src_col: int, src_row: int, xcols: int, yrows: int) -> list[bytes]:
+        # Rows of indices of this palette for an area of another pixel storage
+        if isinstance(src, cckkPixelView):
+            if src.shared:
+                src_col, src_row, src = src_col + src._col, src_row + src._row, src._parent
+            else:
+                src = src._own
+        if isinstance(src, cckkPixelPalette):
+            remap = self._remap(src._palette)
+            rows = [src._rows[i][src_col:src_col + xcols] for i in range(src_row, src_row + yrows)]
+            return rows if remap is None else [row.translate(remap) for row in rows]
+        index = self._colour_index
+        return [bytes(index(pixel) for pixel in src.row_slice(i, src_col, src_col + xcols)) for i in range(src_row, src_row + yrows)]
+
+    @property
+    def xcols(self) -> int:
+        return len(self._rows[0]) if len(self._rows) > 0 else 0
+
+    @property
+    def yrows(self) -> int:
+        return len(self._rows)
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        return self._palette[self._rows[row][col]]
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelPalette":
+        self._before_write()
+        self._rows[row][col] = self._colour_index(pixel)
+        self.invalidate(row % len(self._rows))
+        return self
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row"""
+        palette = self._palette
+        return [palette[index] for index in self._rows[row][start:end]]
+
+    def rows(self) -> list[list[tuple[int, int, int]]]:
+        """The rows of pixels. These are created from the storage, so changing them does not change the image."""
+        return self.to_rows()
+
+    def _find_runs(self, row: int) -> list[tuple[int, int]]:
+        return [match.span() for match in cckkPixelPalette._opaque_run.finditer(self._rows[row])]
+
+    def _find_mask(self, row: int) -> int:
+        digits = self._rows[row].translate(cckkPixelPalette._mask_digits)
+        return int(digits[::-1], 2) if len(digits) > 0 else 0
+
+    def to_string(self, colour_dict: "cckkColourDict") -> str:
+        """The rows as lines of colour characters, translating each row in one pass.
+        Colours that are not in the colour dictionary are exported as "?".
+
+        Args:
+        colour_dict: Colour dictionary to map the colours to characters
+
+        Returns:
+        Lines of the image, separated by newlines
+        """
+        table = {index: colour_dict.get_rgb(pixel) for index, pixel in enumerate(self._palette)}
+        return "\n".join(row.decode("latin-1").translate(table) for row in self._rows)
+
+    def copy(self) -> "cckkPixelPalette":
+        return cckkPixelPalette([bytearray(row) for row in self._rows], self._palette)
+
+    def copy_from(self, other: "cckkPixelPalette") -> "cckkPixelPalette":
+        """Copy the pixels of another storage of the same size into this storage, without allocating new rows"""
+        self._before_write()
+        for row, other_row in zip(self._rows, self._indices(other, 0, 0, other.xcols, other.yrows)):
+            row[:] = other_row
+        self.invalidate()
+        return self
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelPalette":
+        """Roll the pixels dx columns to the right and dy rows down, wrapping around the edges"""
+        self._before_write()
+        if self.yrows > 0 and self.xcols > 0:
+            dx %= self.xcols
+            dy %= self.yrows
+            rows = self._rows[-dy:] + self._rows[:-dy] if dy != 0 else self._rows
+            self._rows = [row[-dx:] + row[:-dx] for row in rows]
+            self.invalidate()
+        return self
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> "cckkPixelPalette":
+        """Copy of a rectangular area. Pixels outside the storage are transparent."""
+        col_start = max(col, 0)
+        col_end = min(col + xcols, self.xcols)
+        rows = []
+        for src_row in range(row, row + yrows):
+            cropped = bytearray(xcols)
+            if 0 <= src_row < self.yrows and col_start < col_end:
+                cropped[col_start - col:col_end - col] = self._rows[src_row][col_start:col_end]
+            rows.append(cropped)
+        return cckkPixelPalette(rows, self._palette)
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelPalette":
+        """Set every pixel in a rectangular area"""
+        self._before_write()
+        fill_indices = bytes([self._colour_index(pixel)]) * xcols
+        for i in range(row, row + yrows):
+            self._rows[i][col:col + xcols] = fill_indices
+            self.invalidate(i)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelPalette":
+        """Paint the opaque pixels of an area of another pixel storage, copying each run as indices with a single slice assignment"""
+        self._before_write()
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        src_end = src_col + xcols
+        offset = col - src_col
+        for i in range(yrows):
+            dst_indices = self._rows[row + i]
+            for start, end in src.opaque_runs(src_row + i):
+                start = start if start > src_col else src_col
+                end = end if end < src_end else src_end
+                if start < end:
+                    dst_indices[start + offset:end + offset] = self._indices(src, start, src_row + i, end - start, 1)[0]
+            self.invalidate(row + i)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelPalette":
+        """Replace transparent pixels with the pixels of another storage of the same size"""
+        self._before_write()
+        under_rows = self._indices(under, 0, 0, under.xcols, under.yrows)
+        self._rows = [bytearray(index or under_index for index, under_index in zip(row, under_row))
+                      for row, under_row in zip(self._rows, under_rows)]
+        self.invalidate()
+        return self
+
+    def count_overlap(self, other: cckkPixelStore) -> int:
+        """Count the positions where both this storage and another storage of the same size are opaque"""
+        return sum((self.mask_row(i) & other.mask_row(i)).bit_count() for i in range(self.yrows))
+
+
+class cckkPixelRuns(cckkPixelStore):
+    # Sparse pixel storage that only holds the runs of opaque pixels in each row.
+    # Each row is a list of (start column, end column, pixels) tuples, in order, with no two runs touching.
+    # Reading, painting and testing work run by run, so transparent pixels cost nothing. This suits layers that
+    # are mostly transparent, such as a score display or scattered pickups.
+    # The lists of pixels in the runs are never changed in place, so runs can be shared between rows and copies.
+    ##############################################################################################
+
+    """Pixel storage as runs of opaque pixels"""
+    backend = "runs"
+
+    def __init__(self, xcols: int = 0, yrows: int = 0):
+        super().__init__()
+        self._xcols = xcols
+        self._yrows = yrows
+        self._rows = [[] for _ in range(yrows)]  # Runs in each row
+
+    def from_rows(rows: list[list[tuple[int, int, int]]]) -> "cckkPixelRuns":
+        """Create the pixel storage from a list of rows. The width is taken from the first row,
+        and other rows are padded with transparent pixels or truncated to match."""
+        store = cckkPixelRuns(len(rows[0]) if len(rows) > 0 else 0, len(rows))
+        store._rows = [cckkPixelRuns._find_pixel_runs(row[:store._xcols]) for row in rows]
+        return store
+
+    def blank(xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelRuns":
+        """Create pixel storage of the specified size, filled with a pixel (transparent by default)"""
+        store = cckkPixelRuns(xcols, yrows)
+        if pixel is not None and xcols > 0:
+            pixels = [pixel] * xcols
+            store._rows = [[(0, xcols, pixels)] for _ in range(yrows)]
+        return store
+
+    def _find_pixel_runs(pixels: list[tuple[int, int, int]]) -> list[tuple]:
+        # Runs of opaque pixels in a list of pixels
+        runs = []
+        start = None
+        for col, pixel in enumerate(pixels):
+            if pixel is None:
+                if start is not None:
+                    runs.append((start, col, pixels[start:col]))
+                    start = None
+            elif start is None:
+                start = col
+        if start is not None:
+            runs.append((start, len(pixels), pixels[start:]))
+        return runs
+
+    def _join(runs: list[tuple]) -> list[tuple]:
+        # Sort runs that do not overlap, and join the ones that touch
+        joined = []
+        for run in sorted(runs, key=lambda run: run[0]):
+            if len(joined) > 0 and joined[-1][1] == run[0]:
+                joined[-1] = (joined[-1][0], run[1], joined[-1][2] + run[2])
+            else:
+                joined.append(run)
+        return joined
+
+    def _cut(runs: list[tuple], start: int, end: int) -> list[tuple]:
+        # Runs with the columns from start to end removed
+        kept = []
+        for run_start, run_end, pixels in runs:
+            if run_end <= start or run_start >= end:
+                kept.append((run_start, run_end, pixels))
+            else:
+                if run_start < start:
+                    kept.append((run_start, start, pixels[:start - run_start]))
+                if run_end > end:
+                    kept.append((end, run_end, pixels[end - run_start:]))
+        return kept
+
+    def _overwrite(self, row: int, spans: list[tuple]):
+        # Replace the pixels of a row in each (start column, end column, pixels) span. Pixels is None for a transparent span.
+        runs = self._rows[row]
+        for start, end, _ in spans:
+            runs = cckkPixelRuns._cut(runs, start, end)
+        self._rows[row] = cckkPixelRuns._join(runs + [span for span in spans if span[2] is not None])
+        self.invalidate(row)
+
+    @property
+    def xcols(self) -> int:
+        return self._xcols
+
+    @property
+    def yrows(self) -> int:
+        return self._yrows
+
+    @property
+    def run_count(self) -> int:
+        """Number of runs of opaque pixels held"""
+        return sum(len(runs) for runs in self._rows)
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        runs = self._rows[row]
+        i = bisect.bisect_right(runs, col, key=lambda run: run[0]) - 1
+        if i >= 0 and col < runs[i][1]:
+            return runs[i][2][col - runs[i][0]]
+        return None
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelRuns":
+        self._before_write()
+        self._overwrite(row, [(col, col + 1, [pixel] if pixel is not None else None)])
+        return self
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row, transparent apart from the runs"""
+        pixels = [None] * (end - start)
+        for run_start, run_end, run_pixels in self._rows[row]:
+            if run_end > start and run_start < end:
+                first, last = max(run_start, start), min(run_end, end)
+                pixels[first - start:last - start] = run_pixels[first - run_start:last - run_start]
+        return pixels
+
+    def opaque_runs(self, row: int) -> list[tuple[int, int]]:
+        """Runs of opaque pixels in a row, as held. The result is cached."""
+        runs = self._runs.get(row, None)
+        if runs is None:
+            runs = [(start, end) for start, end, _ in self._rows[row]]
+            self._runs[row] = runs
+        return runs
+
+    def copy(self) -> "cckkPixelRuns":
+        copied = cckkPixelRuns(self._xcols, self._yrows)
+        copied._rows = [list(runs) for runs in self._rows]
+        return copied
+
+    def copy_from(self, other: "cckkPixelRuns") -> "cckkPixelRuns":
+        """Copy the pixels of another storage of the same size into this storage"""
+        self._before_write()
+        self._rows[:] = [list(runs) for runs in other._rows]
+        self.invalidate()
+        return self
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelRuns":
+        """Roll the pixels dx columns to the right and dy rows down, wrapping around the edges"""
+        self._before_write()
+        if self._yrows > 0 and self._xcols > 0:
+            xcols = self._xcols
+            dx %= xcols
+            dy %= self._yrows
+            rows = self._rows[-dy:] + self._rows[:-dy] if dy != 0 else self._rows
+            self._rows = []
+            for runs in rows:
+                rolled = []
+                for start, end, pixels in runs:
+                    start, end = start + dx, end + dx
+                    if end <= xcols:
+                        rolled.append((start, end, pixels))
+                    elif start >= xcols:
+                        rolled.append((start - xcols, end - xcols, pixels))
+                    else:
+                        rolled += [(start, xcols, pixels[:xcols - start]), (0, end - xcols, pixels[xcols - start:])]
+                self._rows.append(cckkPixelRuns._join(rolled))
+            self.invalidate()
+        return self
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> "cckkPixelRuns":
+        """Copy of a rectangular area. Pixels outside the storage are transparent."""
+        cropped = cckkPixelRuns(xcols, yrows)
+        for i in range(max(row, 0), min(row + yrows, self._yrows)):
+            cropped._rows[i - row] = [(max(start, col) - col, min(end, col + xcols) - col,
+                                       pixels[max(start, col) - start:min(end, col + xcols) - start])
+                                      for start, end, pixels in self._rows[i] if end > col and start < col + xcols]
+        return cropped
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelRuns":
+        """Set every pixel in a rectangular area"""
+        self._before_write()
+        if xcols > 0:
+            span = (col, col + xcols, [pixel] * xcols if pixel is not None else None)
+            for i in range(row, row + yrows):
+                self._overwrite(i, [span])
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelRuns":
+        """Paint the opaque pixels of an area of another pixel storage, adding each row's opaque runs in one pass"""
+        self._before_write()
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        src_end = src_col + xcols
+        offset = col - src_col
+        for i in range(yrows):
+            spans = []
+            for start, end in src.opaque_runs(src_row + i):
+                start = start if start > src_col else src_col
+                end = end if end < src_end else src_end
+                if start < end:
+                    spans.append((start + offset, end + offset, src.row_slice(src_row + i, start, end)))
+            if len(spans) > 0:
+                self._overwrite(row + i, spans)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelRuns":
+        """Replace transparent pixels with the pixels of another storage of the same size"""
+        self._before_write()
+        for i in range(self._yrows):
+            gaps, gap_start = [], 0  # Transparent parts of the row
+            for start, end, _ in self._rows[i]:
+                if start > gap_start:
+                    gaps.append((gap_start, start))
+                gap_start = end
+            if gap_start < self._xcols:
+                gaps.append((gap_start, self._xcols))
+            spans = [(max(start, gap_start), min(end, gap_end), under.row_slice(i, max(start, gap_start), min(end, gap_end)))
+                     for gap_start, gap_end in gaps for start, end in under.opaque_runs(i) if end > gap_start and start < gap_end]
+            if len(spans) > 0:
+                self._overwrite(i, spans)
+        return self
+
+    def count_overlap(self, other: cckkPixelStore) -> int:
+        """Count the positions where both this storage and another storage of the same size are opaque"""
+        return sum((self.mask_row(i) & other.mask_row(i)).bit_count() for i in range(self._yrows))
 
-    def __init__(
-        self,
-        colour_dict: dict[str, tuple[int, int, int]] = None,
-        update_dict: dict[str, tuple[int, int, int]] = None,
-    ):
-        self._colour_dict = (colour_dict if colour_dict is not None else cckkColourDict.def_colour_dict.copy())
-        if update_dict is not None:
-            self._colour_dict.update(update_dict)
 
-        self._reverse_colour_dict = {v: k for k, v in self._colour_dict.items()}
+class cckkPixelWrap(cckkPixelStore):
+    # Pixel storage that shows another storage rolled by an offset, wrapping around the edges.
+    # roll() only changes the offset. Reads apply the offset, so scrolling does not move any pixels.
+    # Changes to single pixels are made to the other storage at the offset position. Changes to areas
+    # apply the offset to the other storage first (flatten()), unless it cannot be rolled in place. Then the area
+    # is split where it wraps around, and each part is changed at its offset position.
+    ##############################################################################################
+
+    """Pixel storage rolled by a virtual offset"""
+
+    def __init__(self, store: cckkPixelStore, dx: int = 0, dy: int = 0):
+        super().__init__()
+        self._store = store  # Pixel storage holding the pixels before they are rolled
+        self._dx = 0  # Columns the pixels are rolled to the right
+        self._dy = 0  # Rows the pixels are rolled down
+        self.roll(dx, dy)
 
     @property
-    def dict(self) -> dict[str, tuple[int, int, int]]:
-        return self._colour_dict
+    def backend(self) -> str:
+        return self._store.backend
 
     @property
-    def reverse_dict(self) -> dict:
-        return self._reverse_colour_dict
+    def offset(self) -> tuple[int, int]:
+        """Columns and rows that the pixels are rolled by"""
+        return (self._dx, self._dy)
 
-    def get(self, colour_string: str) -> tuple:
-        """Convert a string to its pixel (RGB) equivalent
+    @property
+    def xcols(self) -> int:
+        return self._store.xcols
 
-        Args:
-        colour_string Pixel value as a character
+    @property
+    def yrows(self) -> int:
+        return self._store.yrows
+
+    def flatten(self) -> cckkPixelStore:
+        """Roll the pixels of the other storage by the offset, and set the offset back to zero
 
         Returns:
-        Pixel value as a list containing [R, G, B] (red, green, blue)
+        The other pixel storage, which now holds the pixels as shown
+
+        Raises:
+        Exception: If the other storage cannot be rolled in place
         """
-        return self.dict.get(colour_string, None)
+        if (self._dx != 0 or self._dy != 0) and not self._store.rolls_in_place:
+            raise Exception("Pixel storage cannot be rolled in place")
+        if self._dx != 0 or self._dy != 0:
+            self._store.roll(self._dx, self._dy)
+            self._dx = self._dy = 0
+        return self._store
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        return self._store.get((col - self._dx) % self.xcols, (row - self._dy) % self.yrows)
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelWrap":
+        self._before_write()
+        self._store.set((col - self._dx) % self.xcols, (row - self._dy) % self.yrows, pixel)
+        return self
 
-    def get_rgb(self, pixel: tuple[int, int, int]) -> str:
-        """Convert a pixel to its string equivalent
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row"""
+        xcols = self.xcols
+        src_row = (row - self._dy) % self.yrows
+        src_start = (start - self._dx) % xcols
+        length = end - start
+        if src_start + length <= xcols:
+            return self._store.row_slice(src_row, src_start, src_start + length)
+        return self._store.row_slice(src_row, src_start, xcols) + self._store.row_slice(src_row, 0, src_start + length - xcols)
+
+    def opaque_runs(self, row: int) -> list[tuple[int, int]]:
+        """Runs of opaque pixels in a row, rotated from the other storage's cached runs"""
+        xcols = self.xcols
+        runs = []
+        for start, end in self._store.opaque_runs((row - self._dy) % self.yrows):
+            start, end = (start + self._dx) % xcols, (start + self._dx) % xcols + end - start
+            if end <= xcols:
+                runs.append((start, end))
+            else:
+                runs.extend(((start, xcols), (0, end - xcols)))
+        runs.sort()
+        merged = []
+        for start, end in runs:
+            if len(merged) > 0 and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    def mask_row(self, row: int) -> int:
+        """Opacity bitmask of a row, rotated from the other storage's cached bitmask"""
+        xcols = self.xcols
+        mask = self._store.mask_row((row - self._dy) % self.yrows)
+        return ((mask << self._dx) | (mask >> (xcols - self._dx))) & ((1 << xcols) - 1)
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelWrap":
+        """Roll the pixels dx columns to the right and dy rows down, by changing the offset only"""
+        if self.yrows > 0 and self.xcols > 0:
+            self._before_write()
+            self._dx = (self._dx + dx) % self.xcols
+            self._dy = (self._dy + dy) % self.yrows
+        return self
+
+    def copy(self) -> cckkPixelStore:
+        if not self._store.rolls_in_place:
+            return cckkPixelWrap(self._store.copy(), self._dx, self._dy)
+        return self._store.copy().roll(self._dx, self._dy)
+
+    def _parts(self, col: int, row: int, xcols: int, yrows: int):
+        # For each part of an area, split where it wraps around the edges, the column and row of the part in
+        # the other storage, its size, and where it starts within the area
+        col_parts = cckkPixelWrap._split((col - self._dx) % self.xcols, xcols, self.xcols)
+        row_parts = cckkPixelWrap._split((row - self._dy) % self.yrows, yrows, self.yrows)
+        for part_row, part_rows, row_offset in row_parts:
+            for part_col, part_cols, col_offset in col_parts:
+                yield part_col, part_row, part_cols, part_rows, col_offset, row_offset
+
+    def _split(start: int, length: int, size: int) -> list[tuple[int, int, int]]:
+        # Range of a given length from start, split at size into (start, length, offset) parts
+        if start + length <= size:
+            return [(start, length, 0)]
+        return [(start, size - start, 0), (0, length - (size - start), size - start)]
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> cckkPixelStore:
+        """Copy of a rectangular area. Pixels outside the storage are transparent."""
+        cropped = cckkImage.backends[self._store.backend].blank(xcols, yrows)
+        col_start, col_end = max(col, 0), min(col + xcols, self.xcols)
+        row_start, row_end = max(row, 0), min(row + yrows, self.yrows)
+        if col_start < col_end and row_start < row_end:
+            cropped.paint(col_start - col, row_start - row, self, col_start, row_start, col_end - col_start, row_end - row_start)
+        return cropped
+
+    def rows(self) -> list[list[tuple[int, int, int]]]:
+        if not self._store.rolls_in_place:
+            return self.to_rows()
+        self._before_write()
+        return self.flatten().rows()
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelWrap":
+        self._before_write()
+        if not self._store.rolls_in_place:
+            for part_col, part_row, part_cols, part_rows, _, _ in self._parts(col, row, xcols, yrows):
+                self._store.fill(part_col, part_row, part_cols, part_rows, pixel)
+            return self
+        self.flatten().fill(col, row, xcols, yrows, pixel)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelWrap":
+        self._before_write()
+        if not self._store.rolls_in_place:
+            xcols = src.xcols if xcols is None else xcols
+            yrows = src.yrows if yrows is None else yrows
+            for part_col, part_row, part_cols, part_rows, col_offset, row_offset in self._parts(col, row, xcols, yrows):
+                self._store.paint(part_col, part_row, src, src_col + col_offset, src_row + row_offset, part_cols, part_rows)
+            return self
+        self.flatten().paint(col, row, src, src_col, src_row, xcols, yrows)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelWrap":
+        self._before_write()
+        if not self._store.rolls_in_place:
+            self._store.fill_transparent(cckkPixelWrap(under, -self._dx, -self._dy))
+            return self
+        self.flatten().fill_transparent(under)
+        return self
+
+
+class cckkPixelChunks(cckkPixelStore):
+    # Pixel storage for images much larger than the viewer, such as the map of a world, split into chunks of a fixed size.
+    # Each chunk has its own pixel storage object. It is loaded when first read, or created when first changed.
+    # Only the chunks under an area are read, so the cost of drawing or testing an area does not depend on the size of the image.
+    # opaque_runs() and mask_row() read whole rows, so they read every chunk in the row.
+    # Once there are more than max_chunks, the least recently used chunks are discarded. A changed chunk is
+    # passed to the saver first. Without a saver, it is kept.
+    ##############################################################################################
+
+    """Pixel storage split into chunks of a fixed size"""
+    rolls_in_place = False
+
+    def __init__(
+        self,
+        xcols: int,
+        yrows: int,
+        chunk_cols: int = 16,
+        chunk_rows: int = 16,
+        loader=None,
+        saver=None,
+        max_chunks: int = None,
+        backend: str = "list",
+    ):
+        """Contructs a cckkPixelChunks object
 
         Args:
-        pixel: Pixel value as a list containing [R, G, B] (red, green, blue)
+        xcols: Number of columns
+        yrows: Number of rows
+        chunk_cols: Number of columns in each chunk
+        chunk_rows: Number of rows in each chunk
+        loader: Function called as loader(chunk_col, chunk_row) the first time a chunk is needed. It returns a pixel storage
+                object or a list of rows the size of the chunk, or None if the chunk is transparent. Chunks are numbered
+                from 0, starting at the top-left corner.
+        saver: Function called as saver(chunk_col, chunk_row, store) before a changed chunk is discarded
+        max_chunks: Number of chunks to keep. If None, chunks are never discarded.
+        backend: Pixel storage to use for the chunks
 
         Returns:
-        Pixel value as a character
+        cckkPixelChunks object
+
+        Raises:
+        Exception: If invalid backend specified
         """
-        return self.reverse_dict.get(pixel, "?")
+        super().__init__()
+        if backend not in cckkImage.backends:
+            raise Exception("Invalid image backend '" + str(backend) + "'")
+        self._xcols = xcols
+        self._yrows = yrows
+        self._chunk_cols = chunk_cols
+        self._chunk_rows = chunk_rows
+        self._loader = loader
+        self._saver = saver
+        self.max_chunks = max_chunks
+        self._backend = backend  # Name of the pixel storage backend of the chunks
+        self._chunks = collections.OrderedDict()  # Storage of each chunk that has been read, by (chunk column, chunk row). Least recently used first. None if transparent.
+        self._changed = set()  # Chunks changed since they were loaded
+
+    def from_rows(rows: list[list[tuple[int, int, int]]], chunk_cols: int = 16, chunk_rows: int = 16, backend: str = "list") -> "cckkPixelChunks":
+        """Create the pixel storage from a list of rows of the same length"""
+        store = cckkPixelChunks(len(rows[0]) if len(rows) > 0 else 0, len(rows), chunk_cols, chunk_rows, backend=backend)
+        return store.paint(0, 0, cckkPixelList(rows))
+
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    @property
+    def xcols(self) -> int:
+        return self._xcols
+
+    @property
+    def yrows(self) -> int:
+        return self._yrows
+
+    @property
+    def chunk_count(self) -> int:
+        """Number of chunks held"""
+        return len(self._chunks)
+
+    def _spans(start: int, end: int, size: int):
+        # For each chunk covering the range start to end along one axis, the chunk number, the start and end within
+        # the chunk, and where the chunk's part starts within the range
+        for chunk in range(start // size, (end - 1) // size + 1):
+            first = max(start, chunk * size)
+            last = min(end, chunk * size + size)
+            yield chunk, first - chunk * size, last - chunk * size, first - start
+
+    def _chunk(self, chunk_col: int, chunk_row: int, create: bool = False) -> cckkPixelStore:
+        # Storage of a chunk, loading it if necessary. If create is True, a transparent chunk is created and marked as changed.
+        key = (chunk_col, chunk_row)
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+            store = self._chunks[key]
+        else:
+            store = self._loader(chunk_col, chunk_row) if self._loader is not None else None
+            if isinstance(store, list):
+                store = cckkImage.backends[self._backend].from_rows(store)
+            self._chunks[key] = store
+            self._discard()
+        if create:
+            if store is None:
+                store = cckkImage.backends[self._backend].blank(min(self._chunk_cols, self._xcols - chunk_col * self._chunk_cols),
+                                                                min(self._chunk_rows, self._yrows - chunk_row * self._chunk_rows))
+                self._chunks[key] = store
+            self._changed.add(key)
+        return store
+
+    def _discard(self):
+        # Discard the least recently used chunks above max_chunks, apart from the most recently used one
+        excess = len(self._chunks) - self.max_chunks if self.max_chunks is not None else 0
+        if excess > 0:
+            for key in list(itertools.islice(self._chunks, len(self._chunks) - 1)):
+                if key in self._changed:
+                    if self._saver is None:
+                        continue
+                    self._saver(key[0], key[1], self._chunks[key])
+                    self._changed.discard(key)
+                del self._chunks[key]
+                excess -= 1
+                if excess == 0:
+                    break
+
+    def get(self, col: int, row: int) -> tuple[int, int, int]:
+        store = self._chunk(col // self._chunk_cols, row // self._chunk_rows)
+        return store.get(col % self._chunk_cols, row % self._chunk_rows) if store is not None else None
+
+    def set(self, col: int, row: int, pixel: tuple[int, int, int] = None) -> "cckkPixelChunks":
+        self._chunk(col // self._chunk_cols, row // self._chunk_rows, create=True).set(col % self._chunk_cols, row % self._chunk_rows, pixel)
+        return self
+
+    def row_slice(self, row: int, start: int, end: int) -> list[tuple[int, int, int]]:
+        """New list of the pixels in part of a row, read from the chunks it covers"""
+        chunk_row, chunk_row_row = divmod(row, self._chunk_rows)
+        pixels = []
+        if start < end:
+            for chunk_col, first, last, _ in cckkPixelChunks._spans(start, end, self._chunk_cols):
+                store = self._chunk(chunk_col, chunk_row)
+                pixels += store.row_slice(chunk_row_row, first, last) if store is not None else [None] * (last - first)
+        return pixels
+
+    def opaque_runs(self, row: int) -> list[tuple[int, int]]:
+        """Runs of opaque pixels in a row, joined from the cached runs of the chunks. Reads every chunk in the row."""
+        chunk_row, chunk_row_row = divmod(row, self._chunk_rows)
+        runs = []
+        for chunk_col, _, _, offset in cckkPixelChunks._spans(0, self._xcols, self._chunk_cols):
+            store = self._chunk(chunk_col, chunk_row)
+            for start, end in store.opaque_runs(chunk_row_row) if store is not None else []:
+                if len(runs) > 0 and runs[-1][1] == start + offset:
+                    runs[-1] = (runs[-1][0], end + offset)  # Run continues from the previous chunk
+                else:
+                    runs.append((start + offset, end + offset))
+        return runs
+
+    def mask_row(self, row: int) -> int:
+        """Opacity bitmask of a row. Reads every chunk in the row."""
+        return self.mask_slice(row, 0, self._xcols)
+
+    def mask_slice(self, row: int, start: int, end: int) -> int:
+        """Opacity bitmask of part of a row, joined from the cached bitmasks of the chunks it covers"""
+        chunk_row, chunk_row_row = divmod(row, self._chunk_rows)
+        mask = 0
+        if start < end:
+            for chunk_col, first, last, offset in cckkPixelChunks._spans(start, end, self._chunk_cols):
+                store = self._chunk(chunk_col, chunk_row)
+                if store is not None:
+                    mask |= ((store.mask_row(chunk_row_row) >> first) & ((1 << (last - first)) - 1)) << offset
+        return mask
+
+    def _areas(self, col: int, row: int, xcols: int, yrows: int):
+        # For each chunk covering a rectangular area, the chunk column and row, the area within the chunk,
+        # and where the chunk's part starts within the area
+        for chunk_row, row_first, row_last, row_offset in cckkPixelChunks._spans(row, row + yrows, self._chunk_rows):
+            for chunk_col, col_first, col_last, col_offset in cckkPixelChunks._spans(col, col + xcols, self._chunk_cols):
+                yield chunk_col, chunk_row, col_first, row_first, col_last - col_first, row_last - row_first, col_offset, row_offset
+
+    def crop(self, col: int, row: int, xcols: int, yrows: int) -> cckkPixelStore:
+        """Copy of a rectangular area, using the backend of the chunks. Only the chunks under the area are read."""
+        cropped = cckkImage.backends[self._backend].blank(xcols, yrows)
+        col_start, col_end = max(col, 0), min(col + xcols, self._xcols)
+        row_start, row_end = max(row, 0), min(row + yrows, self._yrows)
+        if col_start < col_end and row_start < row_end:
+            for chunk_col, chunk_row, chunk_col_col, chunk_row_row, area_cols, area_rows, col_offset, row_offset in \
+                    self._areas(col_start, row_start, col_end - col_start, row_end - row_start):
+                store = self._chunk(chunk_col, chunk_row)
+                if store is not None:
+                    cropped.paint(col_start - col + col_offset, row_start - row + row_offset, store,
+                                  chunk_col_col, chunk_row_row, area_cols, area_rows)
+        return cropped
+
+    def view(self, col: int, row: int, xcols: int, yrows: int) -> cckkPixelStore:
+        """Copy of a rectangular area. The chunks are not shared, as they may be discarded."""
+        return self.crop(col, row, xcols, yrows)
+
+    def region(self, col: int, row: int, xcols: int, yrows: int) -> tuple[cckkPixelStore, int, int]:
+        """Copy of an area to read from, made from just the chunks under it, and (0, 0) as its position in the copy"""
+        return self.crop(col, row, xcols, yrows), 0, 0
+
+    def copy(self) -> "cckkPixelChunks":
+        """Copy of the chunks held. The copy loads other chunks with the same loader, and has no saver."""
+        copied = cckkPixelChunks(self._xcols, self._yrows, self._chunk_cols, self._chunk_rows,
+                                 self._loader, None, self.max_chunks, self._backend)
+        copied._chunks = collections.OrderedDict((key, store.copy() if store is not None else None) for key, store in self._chunks.items())
+        copied._changed = set(self._changed)
+        return copied
+
+    def roll(self, dx: int, dy: int) -> "cckkPixelChunks":
+        """Chunked storage cannot be rolled in place. cckkImage.roll() keeps it wrapped in a cckkPixelWrap instead,
+        which applies the offset as the pixels are read and changed.
+
+        Raises:
+        Exception: Always
+        """
+        raise Exception("Chunked pixel storage cannot be rolled in place")
+
+    def fill(self, col: int, row: int, xcols: int, yrows: int, pixel: tuple[int, int, int] = None) -> "cckkPixelChunks":
+        """Set every pixel in a rectangular area. Filling with transparent pixels does not create chunks."""
+        for chunk_col, chunk_row, chunk_col_col, chunk_row_row, area_cols, area_rows, _, _ in self._areas(col, row, xcols, yrows):
+            store = self._chunk(chunk_col, chunk_row, create=pixel is not None)
+            if store is not None:
+                self._changed.add((chunk_col, chunk_row))
+                store.fill(chunk_col_col, chunk_row_row, area_cols, area_rows, pixel)
+        return self
+
+    def paint(self, col: int, row: int, src: cckkPixelStore, src_col: int = 0, src_row: int = 0,
+              xcols: int = None, yrows: int = None) -> "cckkPixelChunks":
+        """Paint the opaque pixels of an area of another pixel storage onto the chunks under the area"""
+        xcols = src.xcols if xcols is None else xcols
+        yrows = src.yrows if yrows is None else yrows
+        for chunk_col, chunk_row, chunk_col_col, chunk_row_row, area_cols, area_rows, col_offset, row_offset in \
+                self._areas(col, row, xcols, yrows):
+            self._chunk(chunk_col, chunk_row, create=True).paint(chunk_col_col, chunk_row_row, src, src_col + col_offset,
+                                                                 src_row + row_offset, area_cols, area_rows)
+        return self
+
+    def fill_transparent(self, under: cckkPixelStore) -> "cckkPixelChunks":
+        """Replace transparent pixels with the pixels of another storage of the same size. Reads every chunk."""
+        for chunk_col, chunk_row, chunk_col_col, chunk_row_row, area_cols, area_rows, col_offset, row_offset in \
+                self._areas(0, 0, self._xcols, self._yrows):
+            self._chunk(chunk_col, chunk_row, create=True).fill_transparent(under.crop(col_offset, row_offset, area_cols, area_rows))
+        return self
 
 
 class cckkImage(cckkShape):
     # Class representation of an image
     # The base class cckkShape is used to represent the image size and position.
+    # The pixels are held in a pixel storage object (cckkPixelList, cckkPixelArray, cckkPixelPalette or cckkPixelRuns), selected by the backend.
     ##############################################################################################
 
     """Class representation of an image"""
+    backends = {
+        "list": cckkPixelList,
+        "numpy": cckkPixelArray,
+        "palette": cckkPixelPalette,
+        "runs": cckkPixelRuns,
+    }
+    _file_cache = collections.OrderedDict()  # Decoded image files, by (path, backend), each with the (modification time, size) of the file. Least recently used first.
+    max_cached_files = 64  # No. of decoded image files to keep. The least recently used are discarded first.
+
     def __init__(
         self,
         imgA: list[tuple[int, int, int]] = None,
@@ -990,6 +3729,7 @@ class cckkImage(cckkShape):
         pos: tuple[int, int] = None,
         name: str = None,
         colour_dict: cckkColourDict = None,
+        backend: str = "list",
     ):
         """Contructs a cckkImage object
 
@@ -1002,22 +3742,25 @@ class cckkImage(cckkShape):
         pos: Tuple containing the position of the image (x,y)
         name: Name of the image
         colour_dict: Dictionary to map the image to/from strings
+        backend: Pixel storage to use: "list" (list of rows), "numpy" (numpy colour plane and opacity mask), "palette" (palette indices) or "runs" (runs of opaque pixels)
 
         Returns:
         cckkImage object
 
         Raises:
-        Exception: If invalid image specified
+        Exception: If invalid image or backend specified
         """
         super().__init__(name=name)  # Initialize cckkShape base class
-        self._imgAA = None  # Two-dimensional array of image pixels
+        if backend not in cckkImage.backends:
+            raise Exception("Invalid image backend '" + str(backend) + "'")
+        self._backend = backend  # Name of the pixel storage backend
+        self._store = None  # Pixel storage object
         self._colour_dict = colour_dict  # Colour dictionary
 
         if imgA is not None:
             self.create_from_array(imgA, img_cols)
         elif imgAA is not None:
             self._imgAA = imgAA
-            self.update_size()
         elif imgStr is not None:
             self.create_from_string(imgStr)
         elif imgFile is not None:
@@ -1033,14 +3776,69 @@ class cckkImage(cckkShape):
 
         return self._colour_dict
 
+    @property
+    def backend(self) -> str:
+        """Name of the pixel storage backend"""
+        return self._backend
+
+    def use_backend(self, backend: str) -> "cckkImage":
+        """Convert the image to use another pixel storage backend
+
+        Args:
+        backend: "list", "numpy", "palette" or "runs"
+
+        Returns:
+        cckkImage object
+
+        Raises:
+        Exception: If invalid backend specified
+        """
+        if backend not in cckkImage.backends:
+            raise Exception("Invalid image backend '" + str(backend) + "'")
+        if backend != self._backend:
+            self._backend = backend
+            if self._store is not None:
+                self._store = cckkImage.backends[backend].from_rows(self._store.to_rows())
+        return self
+
+    @property
+    def store(self):
+        """Pixel storage object"""
+        return self._store
+
+    @property
+    def _imgAA(self) -> list[list[tuple[int, int, int]]]:
+        # Copy of the two-dimensional array of image pixels. Reading it leaves the storage and its cached information alone.
+        # Use store.rows() for rows that can be changed in place.
+        return self._store.to_rows() if self._store is not None else None
+
+    @_imgAA.setter
+    def _imgAA(self, value: list[list[tuple[int, int, int]]]):
+        self._store = cckkImage.backends[self._backend].from_rows(value) if value is not None else None
+        if value is not None:
+            self.update_size()
+        self.changed()
+
+    def create_from_store(self, store) -> "cckkImage":
+        """Set the image from a pixel storage object. The storage is used as is, not copied.
+
+        Args:
+        store: Pixel storage object, such as cckkPixelList or cckkPixelArray
+
+        Returns:
+        cckkImage object
+        """
+        self._store = store
+        self._backend = store.backend
+        self.update_size()
+        return self.changed()
+
     def create_from_array(self, imgA, img_cols=8):
         self._imgAA = [imgA[i: i + img_cols]
                        for i in range(0, len(imgA), img_cols)]
-        self.update_size()
         return self
 
     def create_from_string(self, imgStr):
-        self._imgAA = []
         img_lines = imgStr.splitlines()
 
         # Remove leading/trailing blank lines
@@ -1049,25 +3847,21 @@ class cckkImage(cckkShape):
         if img_lines[-1].strip() == "":
             img_lines = img_lines[:-1]
 
-        for img_line in img_lines:
-            line_pixels = []
-            for ch in img_line.strip():
-                if ch in self.colour_dict.dict:
-                    line_pixels.append(self.colour_dict.get(ch))
-                else:
-                    raise Exception(
-                        "Invalid colour character '" + ch + "' in image string"
-                    )
-            self._imgAA.append(line_pixels)
+        if self._backend == "palette":
+            self.create_from_store(cckkPixelPalette.from_string([img_line.strip() for img_line in img_lines], self.colour_dict))
+            return self
 
-        self.update_size()
+        self._imgAA = self.colour_dict.decode([img_line.strip() for img_line in img_lines])
         return self
 
-    def create_from_image_file(self, img_filename):
-        """Set the image from an image file
+    def create_from_image_file(self, img_filename, cache: bool = True):
+        """Set the image from an image file.
+        Each file is only decoded once while it is unchanged, unless more than cckkImage.max_cached_files files
+        have been used since. Images from the same file share the decoded pixels until they are changed.
 
         Args:
         img_filename: Path to the image file
+        cache: If False, the file is decoded again and not cached
 
         Returns:
         cckkImage object
@@ -1082,18 +3876,149 @@ class cckkImage(cckkShape):
                 "PIL module not found. Please install Pillow to use this feature."
             )
 
-        img = Image.open(img_filename)
-        img = img.convert("RGBA")  # Ensure image is in RGB format
-        imgA = list(img.getdata())
+        if not cache or not isinstance(img_filename, (str, os.PathLike)):
+            return self.create_from_store(cckkImage._decode_image_file(Image, img_filename, self._backend))
+
+        # Decoded images are cached by path, and used again while the file's modification time and size are unchanged
+        path = os.path.abspath(img_filename)
+        stat = os.stat(path)
+        file_cache = cckkImage._file_cache
+        key = (path, self._backend)
+        cached = file_cache.get(key, None)
+        if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+            cached = ((stat.st_mtime_ns, stat.st_size), cckkImage._decode_image_file(Image, path, self._backend))
+            file_cache[key] = cached
+        file_cache.move_to_end(key)
+        while len(file_cache) > cckkImage.max_cached_files:
+            file_cache.popitem(last=False)
+        store = cached[1]
+        return self.create_from_store(store.view(0, 0, store.xcols, store.yrows))
+
+    def _decode_image_file(Image, img_filename, backend: str):
+        # Read an image file into pixel storage for a backend, working on the whole RGBA buffer at once
+        with Image.open(img_filename) as img:
+            img = img.convert("RGBA")
         img_cols, img_rows = img.size
-        for i in range(len(imgA)):
-            r, g, b, a = imgA[i]
-            if a == 0:
-                imgA[i] = None
+        if np is not None and backend != "list":
+            rgba = np.asarray(img, dtype=np.uint8).reshape(img_rows, img_cols, 4)
+            store = cckkPixelArray(rgba[:, :, :3].copy(), rgba[:, :, 3] != 0)
+            return store if backend == "numpy" else cckkImage.backends[backend].from_rows(store.to_rows())
+
+        data = img.tobytes()
+        pixels = list(zip(data[0::4], data[1::4], data[2::4]))
+        alpha = data[3::4]
+        if alpha.count(0) > 0:
+            pixels = [pixel if a != 0 else None for pixel, a in zip(pixels, alpha)]
+        rows = [pixels[i:i + img_cols] for i in range(0, len(pixels), img_cols)]
+        return cckkImage.backends[backend].from_rows(rows)
+
+    def load_atlas(
+        imgFile: str = None,
+        txtFile: str = None,
+        imgStr: str = None,
+        frame_size: tuple[int, int] = None,
+        frames: dict[str, cckkRect] = None,
+        names: list[str] = None,
+        colour_dict: cckkColourDict = None,
+        backend: str = "list",
+    ) -> dict[str, "cckkImage"]:
+        """Load a sprite sheet (atlas) and slice it into named frames.
+        The atlas is an image file, or text with one character per pixel. Text may hold several images,
+        each after a line containing its name in square brackets, such as "[ship]". These are stacked into one atlas.
+        Each frame is an image whose pixels are a view of the atlas, so no pixels are copied until a frame is changed.
+        The opaque runs and bitmask of every row of each frame are worked out when the atlas is loaded.
+
+        Args:
+        imgFile: Image file containing the atlas
+        txtFile: Text file containing the atlas
+        imgStr: Atlas as a string
+        frame_size: Tuple containing the size of each frame (xcols, yrows), for an atlas that is a grid of frames.
+                    Frames are taken left to right, starting from the top row of the grid.
+        frames: Dictionary of the area of each frame in the atlas, by name. Areas are cckkRect objects with the atlas at (0, 0).
+        names: Names of the frames in a grid, in order. If None, frames are keyed by the name of the file, followed by "_"
+               and their number. These keys are not registered, so the same atlas can be loaded more than once.
+        colour_dict: Dictionary to map the text to colours
+        backend: Pixel storage to use for the atlas
+
+        Returns:
+        Dictionary of cckkImage objects, by name
+
+        Raises:
+        Exception: If no atlas, or no frames, are specified, a frame is not inside the atlas,
+        the names do not match the frames in the grid, or the text has a malformed or repeated image name
+        """
+        prefix = "frame"
+        if txtFile is not None:
+            with open(txtFile) as f:
+                imgStr = f.read()
+            prefix = os.path.splitext(os.path.basename(txtFile))[0]
+
+        if imgFile is not None:
+            atlas = cckkImage(imgFile=imgFile, colour_dict=colour_dict, backend=backend)
+            prefix = os.path.splitext(os.path.basename(imgFile))[0]
+        elif imgStr is not None:
+            img_lines = [img_line.strip() for img_line in imgStr.splitlines() if img_line.strip() != ""]
+            if len(img_lines) > 0 and img_lines[0].startswith("["):
+                atlas, frames = cckkImage._stack_frames(img_lines, colour_dict, backend)
             else:
-                imgA[i] = (r, g, b)
-        self.create_from_array(imgA, img_cols)
-        return self
+                atlas = cckkImage(imgStr=imgStr, colour_dict=colour_dict, backend=backend)
+        else:
+            raise Exception("No atlas specified")
+
+        registered = True  # False if the frames are only keyed by default names
+        if frames is None:
+            if frame_size is None:
+                raise Exception("No frames specified for the atlas")
+            frame_cols, frame_rows = frame_size
+            grid = [cckkRect(frame_cols, frame_rows, col, ypos)
+                    for ypos in range(atlas.yrows - frame_rows, -1, -frame_rows)
+                    for col in range(0, atlas.xcols - frame_cols + 1, frame_cols)]
+            registered = names is not None
+            names = names if names is not None else [prefix + "_" + str(i) for i in range(len(grid))]
+            if len(names) != len(grid):
+                raise Exception(str(len(names)) + " names given for the " + str(len(grid)) + " frames in the atlas")
+            frames = dict(zip(names, grid))
+
+        images = {}
+        for name, rect in frames.items():
+            if rect.xpos < 0 or rect.ypos < 0 or rect.xpos + rect.xcols > atlas.xcols or rect.ypos + rect.yrows > atlas.yrows:
+                raise Exception("Frame '" + str(name) + "' is not inside the atlas")
+            col, row = atlas._store_origin(rect)
+            store = atlas.store.view(col, row, rect.xcols, rect.yrows).cache_opacity()
+            images[name] = cckkImage(name=name if registered else None, colour_dict=atlas._colour_dict).create_from_store(store)
+        return images
+
+    def _stack_frames(img_lines: list[str], colour_dict: cckkColourDict, backend: str):
+        # Stack the images in lines of text below each other, returning the atlas and the area of each image in it
+        colour_dict = colour_dict if colour_dict is not None else cckkColourDict()
+        sections = {}
+        lines = None
+        for img_line in img_lines:
+            if img_line.startswith("["):
+                if not img_line.endswith("]"):
+                    raise Exception("Atlas image name '" + img_line + "' is missing a ']'")
+                if img_line[1:-1] in sections:
+                    raise Exception("Atlas contains more than one image named '" + img_line[1:-1] + "'")
+                lines = sections[img_line[1:-1]] = []
+            elif lines is None:
+                raise Exception("Atlas image is missing a name in square brackets")
+            else:
+                lines.append(img_line)
+
+        if any(len(lines) == 0 for lines in sections.values()):
+            raise Exception("Atlas contains an empty image")
+
+        xcols = max(len(img_line) for lines in sections.values() for img_line in lines)
+        yrows = sum(len(lines) for lines in sections.values())
+        rows, frames = [], {}
+        for name, lines in sections.items():
+            frames[name] = cckkRect(max(len(img_line) for img_line in lines), len(lines), 0, yrows - len(rows) - len(lines))
+            rows += [row + [None] * (xcols - len(row)) for row in colour_dict.decode(lines)]
+        return cckkImage(imgAA=rows, colour_dict=colour_dict, backend=backend), frames
+
+    def clear_file_cache():
+        """Discard the images cached by create_from_image_file()"""
+        cckkImage._file_cache.clear()
 
     def create_from_pixel(self, xcols, yrows, pixel=None):
         """Create an image of the specified size and pixel colour
@@ -1107,7 +4032,6 @@ class cckkImage(cckkShape):
         cckkImage object
         """
         self._imgAA = [[pixel for _ in range(xcols)] for _ in range(yrows)]
-        self.update_size()
         return self
 
     def export_as_string(self):
@@ -1119,31 +4043,33 @@ class cckkImage(cckkShape):
         Returns:
         String representation of the image
         """
-        img_str = ""
-        for row in self._imgAA:
-            for pixel in row:
-                img_str += self.colour_dict.get_rgb(pixel)
-            img_str += "\n"
-        return img_str.strip()
+        if isinstance(self._store, cckkPixelPalette):
+            return self._store.to_string(self.colour_dict).strip()
+
+        store = self._store
+        return self.colour_dict.encode(store.row(i) for i in range(store.yrows)).strip()
 
     def update_size(self):
         """Update the image size"""
-        self.xcols = len(self._imgAA[0])
-        self.yrows = len(self._imgAA)
+        self.xcols = self._store.xcols
+        self.yrows = self._store.yrows
 
     @property
     def image(self):
-        """Copy of the full image"""
-        return copy.deepcopy(self._imgAA)
+        """Read-only snapshot of the full image, as a sequence of rows. Each row is a tuple of pixels.
+        The pixels are only copied if the image is changed while the snapshot is still in use.
+
+        Returns:
+        cckkPixelView object of tuple rows, or None if the image has no pixels. This is not a list of lists, so it cannot
+        be changed in place. Use [list(row) for row in img.image] for a copy that can be changed.
+        """
+        if self._store is not None:
+            return self._store.view(0, 0, self._store.xcols, self._store.yrows)
 
     @property
     def pixels(self):
         """One-dimensional array of image pixels"""
-        imgA = []
-        for row in self._imgAA:
-            for pixel in row:
-                imgA.append(pixel)
-        return imgA
+        return self._store.pixels()
 
     def get_pixel(self, x, y):
         """Get the pixel at the specified position
@@ -1155,7 +4081,7 @@ class cckkImage(cckkShape):
         Returns:
         Pixel value as a list containing [R, G, B] (red, green, blue)
         """
-        return self._imgAA[self.yrows-y-1][x]  # Access from bottom-left (0,0)
+        return self._store.get(x, self.yrows-y-1)  # Access from bottom-left (0,0)
 
     def set_pixel(self, x, y, pixel=None):
         """Set the pixel at the specified position
@@ -1168,7 +4094,9 @@ class cckkImage(cckkShape):
         Returns:
         cckkImage object
         """
-        self._imgAA[self.yrows-y-1][x] = pixel  # Access from bottom-left (0,0)
+        self._store.set(x, self.yrows-y-1, pixel)  # Access from bottom-left (0,0)
+        if self._observers:
+            self.changed(cckkRect(1, 1, self.xpos + x, self.ypos + y))
         return self
 
     def pixel_as_string(self, x, y, colour_dict=None):
@@ -1184,42 +4112,52 @@ class cckkImage(cckkShape):
         """
         return self.colour_dict.get_rgb(self.get_pixel(x, y))
 
+    def _crop(self, rect):
+        # Copy of the pixel storage covered by a rectangle
+        col, row = self._store_origin(rect)
+        return self._store.crop(col, row, rect.xcols, rect.yrows)
+
+    def _create_image(self, store, pos: tuple[int, int]) -> "cckkImage":
+        # New image from a pixel storage object, used for the results of the sub-image and overlap functions
+        img = cckkImage().create_from_store(store)
+        img.xpos, img.ypos = pos
+        return img
+
     def get_sub_image(self, sub_rect):
         """Get a sub-image from the image
 
         Args:
-        sub_rect: cckkShape object representing the sub-image area
+        sub_rect: cckkShape or cckkRect object representing the sub-image area
 
         Returns:
-        cckkImage object representing the sub-image
+        cckkImage object representing the sub-image. Where the area is inside the image, the sub-image shares
+        its pixels until either of them is changed.
         """
-        sub_imgAA = []
-        for yrow in reversed(range(sub_rect.yrows)):
-            row_pixels = []
-            for xcol in range(sub_rect.xcols):
-                x_img = sub_rect.xpos + xcol - self.xpos
-                y_img = sub_rect.ypos + yrow - self.ypos
-                if 0 <= x_img < self.xcols and 0 <= y_img < self.yrows:
-                    row_pixels.append(self.get_pixel(x_img, y_img))
-                else:
-                    # Transparent pixel if out of bounds
-                    row_pixels.append(None)
-            sub_imgAA.append(row_pixels)
-        sub_img = cckkImage(imgAA=sub_imgAA)
-        sub_img.xpos = sub_rect.xpos
-        sub_img.ypos = sub_rect.ypos
-        return sub_img
+        col, row = self._store_origin(sub_rect)
+        return self._create_image(self._store.view(col, row, sub_rect.xcols, sub_rect.yrows), sub_rect.pos)
 
     def roll(self, dx, dy):
-        result = []
-        for r in range(self.yrows):
-            new_r = (r - dy + self.yrows) % self.yrows
-            new_row = []
-            for c in range(self.xcols):
-                new_c = (c - dx + self.xcols) % self.xcols
-                new_row.append(self._imgAA[new_r][new_c])
-            result.append(new_row)
-        self._imgAA = result
+        """Roll the pixels dx columns to the right and dy rows down, wrapping around the edges.
+        Only the offset of a cckkPixelWrap is changed, so no pixels are moved. Use materialise() to move them.
+
+        Returns:
+        cckkImage object
+        """
+        if not isinstance(self._store, cckkPixelWrap):
+            self._store = cckkPixelWrap(self._store)
+        self._store.roll(dx, dy)
+        return self.changed()
+
+    def materialise(self) -> "cckkImage":
+        """Move the pixels by any roll that has only been applied as an offset, so that the pixel storage
+        is a plain cckkPixelList or cckkPixelArray again. Storage that cannot be rolled in place, such as
+        cckkPixelChunks, is left wrapped.
+
+        Returns:
+        cckkImage object
+        """
+        if isinstance(self._store, cckkPixelWrap) and self._store._store.rolls_in_place:
+            self._store = self._store.flatten()
         return self
 
     def overlap(self, other_img, top_only=False):
@@ -1234,45 +4172,41 @@ class cckkImage(cckkShape):
         """
         inter_rect = super().overlap(other_img)
         if inter_rect is not None:
-            inter_imgAA = []
-            for yrow in reversed(range(inter_rect.yrows)):
-                row_pixels = []
-                for xcol in range(inter_rect.xcols):
-                    x_self = inter_rect.xpos + xcol - self.xpos
-                    y_self = inter_rect.ypos + yrow - self.ypos
-                    x_other = inter_rect.xpos + xcol - other_img.xpos
-                    y_other = inter_rect.ypos + yrow - other_img.ypos
-                    if (
-                        0 <= x_self < self.xcols
-                        and 0 <= y_self < self.yrows
-                        and 0 <= x_other < other_img.xcols
-                        and 0 <= y_other < other_img.yrows
-                    ):
-                        pixel_self = self.get_pixel(x_self, y_self)
-                        if top_only:
-                            # Take the pixel from this image
-                            row_pixels.append(pixel_self)
-                        else:
-                            pixel_other = other_img.get_pixel(x_other, y_other)
-                            if pixel_self is not None:
-                                # Take the pixel from this image
-                                row_pixels.append(pixel_self)
-                            else:
-                                # Take the pixel from the other image
-                                row_pixels.append(pixel_other)
-                    else:
-                        raise Exception(
-                            "Pixel incorrectly out of bounds during intersection calculation")
-                inter_imgAA.append(row_pixels)
-            inter_img = cckkImage(imgAA=inter_imgAA)
-            inter_img.xpos = inter_rect.xpos
-            inter_img.ypos = inter_rect.ypos
-            return inter_img
+            if top_only:
+                col, row = self._store_origin(inter_rect)
+                inter_store = self._store.view(col, row, inter_rect.xcols, inter_rect.yrows)
+            else:
+                # Take the pixel from this image, or from the other image where this image is transparent
+                inter_store = self._crop(inter_rect).fill_transparent(other_img._crop(inter_rect))
+            return self._create_image(inter_store, inter_rect.pos)
         else:
             return None
 
+    def mask_at(self, ypos: int, xpos: int, xcols: int, pos: tuple[int, int] = None) -> int:
+        """Opacity bitmask of part of a row of the image, using the same coordinates as the image position
+
+        Args:
+        ypos: Y-position of the row
+        xpos: X-position of the first pixel, which is returned as bit 0
+        xcols: Number of pixels
+        pos: Position of the image to use, instead of its current position
+
+        Returns:
+        Integer where bit n is set if the pixel at (xpos + n, ypos) is opaque
+        """
+        img_xpos, img_ypos = pos if pos is not None else (self.xpos, self.ypos)
+        row = self.yrows - 1 - (ypos - img_ypos)
+        if row < 0 or row >= self.yrows:
+            return 0
+        shift = xpos - img_xpos
+        start, end = max(shift, 0), min(shift + xcols, self.xcols)
+        if start >= end:
+            return 0
+        return self._store.mask_slice(row, start, end) << (start - shift)
+
     def overlap_count(self, other_img):
-        """Count the number of pixels that overlap with another image, ignoring transparent pixels
+        """Count the number of pixels that overlap with another image, ignoring transparent pixels.
+        Each row is compared as a pair of cached opacity bitmasks.
 
         Args:
         other_img: cckkImage object representing the other image
@@ -1280,25 +4214,14 @@ class cckkImage(cckkShape):
         Returns:
         Number of pixels that overlap between the two images
         """
-        pixel_count = 0
         overlap_rect = super().overlap(other_img)
-        if overlap_rect is not None:
-            for yrow in reversed(range(overlap_rect.yrows)):
-                for xcol in range(overlap_rect.xcols):
-                    x_self = overlap_rect.xpos + xcol - self.xpos
-                    y_self = overlap_rect.ypos + yrow - self.ypos
-                    x_other = overlap_rect.xpos + xcol - other_img.xpos
-                    y_other = overlap_rect.ypos + yrow - other_img.ypos
-                    if (
-                        0 <= x_self < self.xcols
-                        and 0 <= y_self < self.yrows
-                        and 0 <= x_other < other_img.xcols
-                        and 0 <= y_other < other_img.yrows
-                    ):
-                        pixel_self = self.get_pixel(x_self, y_self)
-                        pixel_other = other_img.get_pixel(x_other, y_other)
-                        if pixel_self is not None and pixel_other is not None:
-                            pixel_count += 1
+        if overlap_rect is None:
+            return 0
+
+        pixel_count = 0
+        xpos, xcols = overlap_rect.xpos, overlap_rect.xcols
+        for ypos in range(overlap_rect.ypos, overlap_rect.ypos + overlap_rect.yrows):
+            pixel_count += (self.mask_at(ypos, xpos, xcols) & other_img.mask_at(ypos, xpos, xcols)).bit_count()
         return pixel_count
 
     def overlap_string(self, other_img):
@@ -1316,6 +4239,25 @@ class cckkImage(cckkShape):
         else:
             return img.export_as_string()
 
+    def _overlap_layers(self, overlap_rect, other_imgs):
+        # Pixel storage for the area of this image covered by a stack of other images, and the
+        # pixel storage for the stack itself. The first image in the stack is on top.
+        store_type = cckkImage.backends[self._store.backend]
+        top = store_type.blank(overlap_rect.xcols, overlap_rect.yrows)
+        under = store_type.blank(overlap_rect.xcols, overlap_rect.yrows)
+        self_col, self_row = self._store_origin(overlap_rect)
+        self_store, self_col, self_row = self._store.region(self_col, self_row, overlap_rect.xcols, overlap_rect.yrows)
+        for other_img in reversed(other_imgs):
+            other_rect = cckkRect.overlap(overlap_rect, other_img)
+            if other_rect is not None:
+                col = other_rect.xpos - overlap_rect.xpos
+                row = overlap_rect.yrows - (other_rect.ypos - overlap_rect.ypos) - other_rect.yrows
+                other_col, other_row = other_img._store_origin(other_rect)
+                other_store, other_col, other_row = other_img._store.region(other_col, other_row, other_rect.xcols, other_rect.yrows)
+                under.paint(col, row, other_store, other_col, other_row, other_rect.xcols, other_rect.yrows)
+                top.paint(col, row, self_store, self_col + col, self_row + row, other_rect.xcols, other_rect.yrows)
+        return top, under
+
     def overlap_multi(self, other_imgs):
         """Calculate the intersection of this image with a stack of other images
 
@@ -1328,101 +4270,291 @@ class cckkImage(cckkShape):
         other_mer = cckkShape.calculate_mer(other_imgs)
         overlap_rect = super().overlap(other_mer)
         if overlap_rect is not None:
-            inter_imgAA = []
-            for yrow in reversed(range(overlap_rect.yrows)):
-                row_pixels = []
-                for xcol in range(overlap_rect.xcols):
-                    overlap_found = False
-                    for other_img in other_imgs:
-                        x_self = overlap_rect.xpos + xcol - self.xpos
-                        y_self = overlap_rect.ypos + yrow - self.ypos
-                        x_other = overlap_rect.xpos + xcol - other_img.xpos
-                        y_other = overlap_rect.ypos + yrow - other_img.ypos
-                        if (
-                            0 <= x_self < self.xcols
-                            and 0 <= y_self < self.yrows
-                            and 0 <= x_other < other_img.xcols
-                            and 0 <= y_other < other_img.yrows
-                            and not overlap_found
-                        ):
-                            pixel_self = self.get_pixel(x_self, y_self)
-                            pixel_other = other_img.get_pixel(x_other, y_other)
-                            if pixel_self is not None:
-                                # Take the pixel from this image
-                                row_pixels.append(pixel_self)
-                                overlap_found = True
-                            elif pixel_other is not None:
-                                # Take the pixel from the other image
-                                row_pixels.append(pixel_other)
-                                overlap_found = True
-                        else:
-                            pass # Multiple images so some may have no overlap
-
-                    if not overlap_found:
-                        row_pixels.append(None)
-
-                inter_imgAA.append(row_pixels)
-
-            inter_img = cckkImage(imgAA=inter_imgAA)
-            inter_img.xpos = overlap_rect.xpos
-            inter_img.ypos = overlap_rect.ypos
-            return inter_img
+            top, under = self._overlap_layers(overlap_rect, other_imgs)
+            # Take the pixel from this image, or from the first other image with a pixel where this image is transparent
+            return self._create_image(top.fill_transparent(under), overlap_rect.pos)
         else:
             return None
 
-    def overlap_multi_count(self, other_imgs):
-        """Count the number of pixels that overlap with a stack of other images, ignoring transparent pixels
+    def overlap_multi_count(self, other_imgs, pos: tuple[int, int] = None):
+        """Count the number of pixels that overlap with a stack of other images, ignoring transparent pixels.
+        For each row, the opacity bitmasks of the other images are combined and compared with this image's bitmask.
 
         Args:
         other_imgs: Stack (list) of cckkImage objects
+        pos: Position to test this image at, instead of its current position. The image is not moved.
 
         Returns:
         Number of pixels in this image that overlap with any pixel in the other images
         """
-        pixel_count = 0
+        self_rect = self.rect if pos is None else cckkRect(self.xcols, self.yrows, pos[0], pos[1])
+        other_imgs = cckkShape.overlapping(self_rect, other_imgs)
         other_mer = cckkShape.calculate_mer(other_imgs)
-        overlap_rect = super().overlap(other_mer)
-        if overlap_rect is not None:
-            inter_imgAA = []
-            for yrow in reversed(range(overlap_rect.yrows)):
-                for xcol in range(overlap_rect.xcols):
-                    overlap_found = False
-                    for other_img in other_imgs:
-                        x_self = overlap_rect.xpos + xcol - self.xpos
-                        y_self = overlap_rect.ypos + yrow - self.ypos
-                        x_other = overlap_rect.xpos + xcol - other_img.xpos
-                        y_other = overlap_rect.ypos + yrow - other_img.ypos
-                        if (
-                            0 <= x_self < self.xcols
-                            and 0 <= y_self < self.yrows
-                            and 0 <= x_other < other_img.xcols
-                            and 0 <= y_other < other_img.yrows
-                            and not overlap_found
-                        ):
-                            pixel_self = self.get_pixel(x_self, y_self)
-                            pixel_other = other_img.get_pixel(x_other, y_other)
-
-                            if pixel_self is not None and pixel_other is not None:
-                                overlap_found = True
-                        else:
-                            pass # Multiple images so some may have no overlap
-
-                    if overlap_found:
-                        pixel_count += 1
+        overlap_rect = cckkRect.overlap(self_rect, other_mer)
+        if overlap_rect is None:
+            return 0
 
+        pixel_count = 0
+        xpos, xcols = overlap_rect.xpos, overlap_rect.xcols
+        for ypos in range(overlap_rect.ypos, overlap_rect.ypos + overlap_rect.yrows):
+            self_mask = self.mask_at(ypos, xpos, xcols, pos)
+            if self_mask != 0:
+                other_mask = 0
+                for other_img in other_imgs:
+                    other_mask |= other_img.mask_at(ypos, xpos, xcols)
+                pixel_count += (self_mask & other_mask).bit_count()
         return pixel_count
 
+    def _free_steps(self, path: list[tuple[int, int]], unless_shapes: list["cckkImage"], only_if_shapes: list["cckkImage"]) -> int:
+        """No. of positions at the start of a path where the image meets the overlap conditions.
+        The opacity bitmasks of the other images are combined, row by row, once for the whole area swept by the image.
+        Each step then only shifts this image's row bitmasks against them.
+
+        Args:
+        path: List of (xpos, ypos) positions, one step apart
+        unless_shapes: Images this image must not overlap, or None
+        only_if_shapes: Images this image must overlap, or None
+
+        Returns:
+        No. of positions, from 0 to len(path)
+        """
+        if len(path) == 0 or (unless_shapes is None and only_if_shapes is None):
+            return len(path)
+
+        swept_rect = cckkShape.calculate_mer([self.rect] + [cckkRect(self.xcols, self.yrows, xpos, ypos) for xpos, ypos in (path[0], path[-1])])
+        xpos, xcols = swept_rect.xpos, swept_rect.xcols
+
+        def row_masks(shapes):
+            # Combined bitmask of the shapes for each row of the swept area
+            shapes = cckkShape.overlapping(swept_rect, shapes)
+            masks = {}
+            for ypos in range(swept_rect.ypos, swept_rect.ypos + swept_rect.yrows):
+                mask = 0
+                for shape in shapes:
+                    mask |= shape.mask_at(ypos, xpos, xcols)
+                masks[ypos] = mask
+            return masks
+
+        unless_masks = row_masks(unless_shapes) if unless_shapes is not None else None
+        only_if_masks = row_masks(only_if_shapes) if only_if_shapes is not None else None
+        self_masks = [(self.yrows - 1 - row, self._store.mask_row(row)) for row in range(self.yrows)]
+        self_masks = [(yoffset, mask) for yoffset, mask in self_masks if mask != 0]
+
+        for i, (step_xpos, step_ypos) in enumerate(path):
+            shift = step_xpos - xpos
+            touching = False
+            for yoffset, mask in self_masks:
+                mask <<= shift
+                if unless_masks is not None and mask & unless_masks[step_ypos + yoffset]:
+                    return i
+                if only_if_masks is not None and mask & only_if_masks[step_ypos + yoffset]:
+                    touching = True
+            if only_if_masks is not None and not touching:
+                return i
+        return len(path)
+
     def str(self):
         as_str = "cckkImage:\n"
         as_str = "  Name: \"" + self.name + "\"\n"
         as_str += "  " + super().str() + "\n"
-        for row in self._imgAA:
-            for pixel in row:
+        for i in range(self.yrows):
+            for pixel in self._store.row(i):
                 as_str += str(pixel) + " "
             as_str += "\n"
         return as_str
 
 
+class cckkAnimatedImage(cckkImage):
+    # Image that shows one of a sequence of frames at a time
+    # Each frame is a pixel storage object, with the opaque runs and bitmask of every row worked out when it is added.
+    # Changing frame only swaps the storage object that the image uses, and tells the observers that the image has changed.
+    ##############################################################################################
+
+    """Image with a sequence of animation frames"""
+
+    def __init__(
+        self,
+        frames: list = None,
+        pos: tuple[int, int] = None,
+        name: str = None,
+        colour_dict: cckkColourDict = None,
+        backend: str = "list",
+    ):
+        """Contructs a cckkAnimatedImage object
+
+        Args:
+        frames: List of frames. Each frame is a cckkImage object, a pixel storage object or an image string.
+        pos: Tuple containing the position of the image (x,y)
+        name: Name of the image
+        colour_dict: Dictionary to map image strings to colours
+        backend: Pixel storage to use for frames that are image strings
+
+        Returns:
+        cckkAnimatedImage object
+        """
+        super().__init__(pos=pos, name=name, colour_dict=colour_dict, backend=backend)
+        self._frames = []  # Pixel storage object of each frame
+        self._frame = 0  # Index of the frame being shown
+        for frame in frames if frames is not None else []:
+            self.add_frame(frame)
+
+    @property
+    def frames(self) -> list:
+        """Pixel storage objects of the frames"""
+        return list(self._frames)
+
+    @property
+    def frame_count(self) -> int:
+        return len(self._frames)
+
+    @property
+    def frame(self) -> int:
+        """Index of the frame being shown"""
+        return self._frame
+
+    @frame.setter
+    def frame(self, value: int):
+        self.set_frame(value)
+
+    def add_frame(self, frame) -> "cckkAnimatedImage":
+        """Add a frame to the end of the sequence. The first frame added is shown.
+        The pixels of a cckkImage are shared with the frame until either of them is changed.
+
+        Args:
+        frame: cckkImage object, pixel storage object or image string
+
+        Returns:
+        cckkAnimatedImage object
+        """
+        if isinstance(frame, str):
+            frame = cckkImage(imgStr=frame, colour_dict=self._colour_dict, backend=self._backend).store
+        elif isinstance(frame, cckkImage):
+            frame = frame.store.view(0, 0, frame.store.xcols, frame.store.yrows)
+        self._frames.append(frame.cache_opacity())
+        if len(self._frames) == 1:
+            self._show(frame)
+        return self
+
+    def set_frame(self, index: int) -> "cckkAnimatedImage":
+        """Show a frame. The index wraps around the number of frames.
+
+        Returns:
+        cckkAnimatedImage object
+
+        Raises:
+        Exception: If there are no frames
+        """
+        if len(self._frames) == 0:
+            raise Exception("No frames in animated image")
+        index %= len(self._frames)
+        if index != self._frame or self._store is not self._frames[index]:
+            self._frame = index
+            self._show(self._frames[index])
+        return self
+
+    def next_frame(self, step: int = 1) -> "cckkAnimatedImage":
+        """Show the frame step frames after the current one, wrapping around at the end of the sequence
+
+        Returns:
+        cckkAnimatedImage object
+        """
+        return self.set_frame(self._frame + step)
+
+    def _show(self, store):
+        # Swap in the pixel storage of a frame. A change of size tells the observers about the old and new area.
+        self.create_from_store(store)
+
+    def roll(self, dx, dy):
+        """Roll the pixels of every frame dx columns to the right and dy rows down, wrapping around the edges.
+        Only the offset of a cckkPixelWrap around each frame is changed, so no pixels are moved.
+
+        Returns:
+        cckkAnimatedImage object
+        """
+        for i, frame in enumerate(self._frames):
+            if not isinstance(frame, cckkPixelWrap):
+                frame = self._frames[i] = cckkPixelWrap(frame)
+            frame.roll(dx, dy)
+        if len(self._frames) > 0:
+            self._store = self._frames[self._frame]
+        return self.changed()
+
+    def materialise(self) -> "cckkAnimatedImage":
+        """Move the pixels of every frame by any roll that has only been applied as an offset
+
+        Returns:
+        cckkAnimatedImage object
+        """
+        for i, frame in enumerate(self._frames):
+            if isinstance(frame, cckkPixelWrap) and frame._store.rolls_in_place:
+                self._frames[i] = frame.flatten()
+        if len(self._frames) > 0:
+            self._store = self._frames[self._frame]
+        return self
+
+    def str(self):
+        return super().str() + "  Frame: " + str(self._frame) + " of " + str(len(self._frames)) + "\n"
+
+
+class cckkWorldImage(cckkImage):
+    # Image for a world much larger than the viewer, with its pixels held in chunks (cckkPixelChunks).
+    # Chunks are loaded or created as they are needed, and the least recently used ones can be discarded,
+    # so memory and the cost of each frame depend on the area on screen rather than the size of the world.
+    # Drawing, overlap tests and mask_at() only read the chunks under the area involved. Anything that reads whole
+    # rows of the world, such as a cckkCombinedMask or sweep() of the world itself, count_overlap() or export_as_string(),
+    # reads every chunk in those rows. With a small max_chunks, that discards (and saves) chunks over and over.
+    ##############################################################################################
+
+    """Image held in chunks, for large worlds"""
+
+    def __init__(
+        self,
+        xcols: int = 0,
+        yrows: int = 0,
+        chunk_size: tuple[int, int] = (16, 16),
+        loader=None,
+        saver=None,
+        max_chunks: int = None,
+        imgStr: str = None,
+        pos: tuple[int, int] = None,
+        name: str = None,
+        colour_dict: cckkColourDict = None,
+        backend: str = "list",
+    ):
+        """Contructs a cckkWorldImage object
+
+        Args:
+        xcols: Number of columns in the world
+        yrows: Number of rows in the world
+        chunk_size: Tuple containing the size of each chunk (xcols, yrows)
+        loader: Function called as loader(chunk_col, chunk_row) to load a chunk. See cckkPixelChunks.
+        saver: Function called as saver(chunk_col, chunk_row, store) before a changed chunk is discarded
+        max_chunks: Number of chunks to keep. If None, chunks are never discarded.
+        imgStr: World as a string, mapped using the colour dictionary. Sets the size of the world.
+        pos: Tuple containing the position of the image (x,y)
+        name: Name of the image
+        colour_dict: Dictionary to map the image to/from strings
+        backend: Pixel storage to use for the chunks
+
+        Returns:
+        cckkWorldImage object
+        """
+        super().__init__(pos=pos, name=name, colour_dict=colour_dict, backend=backend)
+        chunk_cols, chunk_rows = chunk_size
+        if imgStr is not None:
+            rows = cckkImage(imgStr=imgStr, colour_dict=self._colour_dict).store.rows()
+            xcols, yrows = (len(rows[0]) if len(rows) > 0 else 0), len(rows)
+        store = cckkPixelChunks(xcols, yrows, chunk_cols, chunk_rows, loader, saver, max_chunks, backend)
+        if imgStr is not None:
+            store.paint(0, 0, cckkPixelList(rows))
+        self.create_from_store(store)
+
+    @property
+    def chunk_count(self) -> int:
+        """Number of chunks held"""
+        return self._store.chunk_count
+
+
 class cckkSenseHat(cckkViewer):
     """Class wrapper for SenseHat class"""
 
@@ -1430,6 +4562,7 @@ class cckkSenseHat(cckkViewer):
         """Contructs a cckkSenseHat object"""
         super().__init__(xcols=8, yrows=8, xpos=0, ypos=0, fill=(0, 0, 0), images=images, horiz=None, vert=None)
         self._sense = None
+        self._pixels_sent = False  # True if the LED matrix shows the current frame
 
     @property
     def sense(self):
@@ -1457,15 +4590,26 @@ class cckkSenseHat(cckkViewer):
             raise Exception("A SenseHat object must be provided")
 
         self._sense = sense_hat
+        self._pixels_sent = False
 
     def clear_pixels(self):
         """Clear the SenseHat LED matrix"""
         self._sense.clear()
+        self._pixels_sent = False
 
-    def update_pixels(self):
-        """Update the SenseHat LED matrix from a cckkViewer object"""
-        self.clear_pixels()
-        self._sense.set_pixels(self.pixels)
+    def update_pixels(self, only_if_changed: bool = False):
+        """Update the SenseHat LED matrix from a cckkViewer object.
+        The LED matrix is only cleared first if the view has changed, so an unchanged frame does not flicker.
+
+        Args:
+        only_if_changed: If True, nothing is sent if the view has not changed since the last update
+        """
+        changed = self.refresh() or not self._pixels_sent
+        if changed or not only_if_changed:
+            if changed:
+                self.clear_pixels()
+            self._sense.set_pixels(self.pixels)
+            self._pixels_sent = True
 
     def show_message(self, text_string:str, scroll_speed:float=0.1, text_colour:list=[255, 255, 255], back_colour:list=[0, 0, 0]):
         self._sense.show_message(text_string, scroll_speed=scroll_speed, text_colour=text_colour, back_colour=back_colour)
@@ -1643,16 +4787,12 @@ class cckkSenseHatEmu:
     def clear(self):
         self._pixels = [(0, 0, 0)] * 64
 
+    _colour_dict = cckkColourDict(update_dict={ " ": (0,0,0) })
+
     def set_pixels(self, pixel_list):
         self._pixels = pixel_list
-        img_str = ""
-        _colour_dict = cckkColourDict(update_dict={ " ": (0,0,0) })
-        for i in range(8):
-            for j in range(8):
-                pixel = self._pixels[i * 8 + j]
-                img_str += _colour_dict.get_rgb(pixel)
-            img_str += "\n"
-        print(img_str+"\n")
+        img_str = cckkSenseHatEmu._colour_dict.encode(self._pixels[i:i + 8] for i in range(0, 64, 8))
+        print(img_str+"\n\n")
 
     def get_humidity(self):
         return 50.0
@@ -38,6 +38,27 @@ class test_cckkColourDict(unittest.TestCase):
         self.assertEqual(col_dict.get_rgb((22,33,44)), "*")
         self.assertEqual(col_dict.get_rgb((1, 2, 3)), "?")
 
+    def test_cckkColourDict_codec(self):
+        col_dict = cckkColourDict(update_dict={"*": (22, 33, 44)})
+        rows = col_dict.decode(["r.*", "xwb"])
+        self.assertEqual(rows, [[(255, 0, 0), None, (22, 33, 44)], [(0, 0, 0), (255, 255, 255), (0, 0, 255)]])
+        self.assertEqual(col_dict.encode(rows), "r.*\nxwb")
+        self.assertEqual(col_dict.encode([[(1, 2, 3), None]]), "?.")
+        with self.assertRaises(Exception):
+            col_dict.decode(["rr", "rq"])
+
+    def test_cckkColourDict_palette(self):
+        col_dict1 = cckkColourDict()
+        col_dict2 = cckkColourDict()
+        self.assertTrue(col_dict1.palette is col_dict2.palette)  # Shared by equal dictionaries
+        self.assertEqual(col_dict1.palette[:2], [None, (0, 0, 0)])
+
+        col_dict1.dict["*"] = (22, 33, 44)  # Changing one dictionary leaves the other alone
+        self.assertEqual(col_dict1.palette[-1], (22, 33, 44))
+        self.assertEqual("r*".translate(col_dict1.index_table), "\x03" + chr(len(col_dict1.palette) - 1))
+        self.assertFalse((22, 33, 44) in col_dict2.palette)
+        self.assertEqual(col_dict2.get("*"), None)
+
 
 if __name__ == "__main__":
     unittest.main()
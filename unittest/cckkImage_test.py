@@ -1,5 +1,7 @@
+import os
+import tempfile
 import unittest
-from cckk import cckkImage, cckkShape
+from cckk import cckkImage, cckkAnimatedImage, cckkWorldImage, cckkShape, cckkPixelArray, cckkPixelView, cckkPixelWrap, cckkPixelList, cckkViewer, np
 
 
 class test_cckkImage(unittest.TestCase):
@@ -132,6 +134,312 @@ class test_cckkImage(unittest.TestCase):
         img1_tv = img1.overlap_multi([imgt, imgv])
         self.assertEqual(img1_tv.export_as_string(), img1_tv_str)
 
+    def test_cckkImage_mask(self):
+        img = cckkImage(imgStr="r.g\n...\n.bb")
+        self.assertEqual(img.store.mask_row(0), 0b101)
+        self.assertEqual(img.store.mask_row(2), 0b110)
+        self.assertEqual(img.mask_at(2, 0, 3), 0b101)
+        self.assertEqual(img.mask_at(2, 1, 3), 0b10)
+        self.assertEqual(img.mask_at(0, -1, 4), 0b1100)
+        self.assertEqual(img.mask_at(3, 0, 3), 0)
+
+        img.set_pixel(1, 1, (255, 255, 255))  # Cached bitmasks are discarded when pixels change
+        self.assertEqual(img.mask_at(1, 0, 3), 0b10)
+        img.roll(1, 0)
+        self.assertEqual(img.mask_at(2, 0, 3), 0b011)
+
+    def test_cckkImage_overlap_count(self):
+        img1 = cckkImage(imgStr="rr.\n.r.\nrrr")
+        img2 = cckkImage(imgStr="bb\nbb", pos=(1, 0))
+        self.assertEqual(img1.overlap_count(img2), 3)
+        img3 = cckkImage(imgStr="g", pos=(0, 2))
+        img4 = cckkImage(imgStr="ggggg", pos=(-1, 7))  # No overlap
+        self.assertEqual(img1.overlap_multi_count([img2, img3, img4]), 4)
+        img2.move(-2, 0)
+        self.assertEqual(img1.overlap_count(img2), 1)
+
+    def test_cckkImage_roll_offset(self):
+        img = cckkImage(imgStr="rg..\n..bb")
+        store = img.store
+        img.roll(1, 0)
+        self.assertTrue(isinstance(img.store, cckkPixelWrap))
+        self.assertEqual(img.store.offset, (1, 0))
+        self.assertEqual(store.to_rows(), cckkImage(imgStr="rg..\n..bb").image)  # No pixels moved
+        self.assertEqual(img.export_as_string(), ".rg.\nb..b")
+        self.assertEqual(img.store.opaque_runs(1), [(0, 1), (3, 4)])
+        self.assertEqual(img.store.mask_row(1), 0b1001)
+
+        img.roll(-1, 1)
+        self.assertEqual(img.export_as_string(), "..bb\nrg..")
+        img.set_pixel(0, 1, (255, 255, 255))
+        self.assertEqual(img.get_pixel(0, 1), (255, 255, 255))
+        self.assertEqual(cckkViewer(images=[img], xcols=4, yrows=2).view().export_as_string(), "wxbb\nrgxx")
+
+        img.materialise()
+        self.assertTrue(isinstance(img.store, cckkPixelList))
+        self.assertEqual(img.export_as_string(), "w.bb\nrg..")
+
+    def test_cckkImage_views(self):
+        for backend in ["list", "numpy"] if np is not None else ["list"]:
+            world = cckkImage(imgStr="rgb.\ncymw\nxw.b", backend=backend)
+            sub = world.get_sub_image(cckkShape(2, 2, 1, 0))
+            self.assertTrue(isinstance(sub.store, cckkPixelView) and sub.store.shared)
+            self.assertEqual(sub.export_as_string(), "ym\nw.")
+            self.assertEqual(sub.store.mask_row(1), 0b01)
+            self.assertEqual(cckkViewer(images=[sub], xcols=2, yrows=2, xpos=1).view().export_as_string(), "ym\nwx")
+
+            snapshot = world.image
+            self.assertEqual(len(snapshot), 3)
+            self.assertEqual(snapshot[0], ((255, 0, 0), (0, 255, 0), (0, 0, 255), None))
+            world.set_pixel(1, 0, (255, 0, 0))  # The views take their own copy before the image changes
+            self.assertFalse(sub.store.shared)
+            self.assertEqual(sub.export_as_string(), "ym\nw.")
+            self.assertEqual(snapshot, cckkImage(imgStr="rgb.\ncymw\nxw.b").image)
+
+            sub.set_pixel(0, 0, (0, 0, 255))  # Changing a view leaves the image alone
+            self.assertEqual(sub.export_as_string(), "ym\nb.")
+            self.assertEqual(world.export_as_string(), "rgb.\ncymw\nxr.b")
+
+            self.assertEqual(world.get_sub_image(cckkShape(2, 2, 3, -1)).export_as_string(), "b.\n..")  # Partly outside
+
+        self.assertEqual(cckkImage().image, None)  # No pixels to share
+
+    def test_cckkImage_palette(self):
+        img = cckkImage(imgStr="rgb\nc..\nxw.", backend="palette")
+        self.assertEqual(img.backend, "palette")
+        self.assertTrue(img.store.palette is img.colour_dict.palette)  # Shared until a new colour is added
+        other = cckkImage(imgStr="bb\nww", backend="palette")
+        self.assertTrue(other.store.palette is img.store.palette)  # Equal colour dictionaries share a palette
+        self.assertFalse(other.colour_dict is img.colour_dict)
+        self.assertEqual(img.export_as_string(), "rgb\nc..\nxw.")
+        self.assertEqual(img.get_pixel(0, 2), (255, 0, 0))
+        self.assertEqual(img.store.opaque_runs(1), [(0, 1)])
+        self.assertEqual(img.store.mask_row(0), 0b111)
+        with self.assertRaises(Exception):
+            cckkImage(imgStr="rq", backend="palette")
+
+        img2 = cckkImage(imgStr="rgb\ncym\nxw.", pos=(-1, -1))  # Backends can be mixed
+        self.assertEqual(img.overlap(img2).export_as_string(), "cb\nxw")
+        self.assertEqual(img.overlap_count(img2), 3)
+        self.assertEqual(img.overlap_multi([cckkImage(imgStr="vvv")]).export_as_string(), "xwv")
+
+        img.set_pixel(2, 2, pixel=(1, 2, 3))
+        self.assertEqual(img.get_pixel(2, 2), (1, 2, 3))
+        self.assertFalse(img.store.palette is img.colour_dict.palette)
+        self.assertEqual(img.export_as_string(), "rg?\nc..\nxw.")
+        img.use_backend("list")
+        self.assertEqual(img.get_pixel(2, 2), (1, 2, 3))
+
+    def test_cckkImage_load_atlas(self):
+        atlas = cckkImage.load_atlas(imgStr="""
+            [atlas_ship]
+            .r.
+            rrr
+            [atlas_rock]
+            ww
+            w.
+            """)
+        ship, rock = atlas["atlas_ship"], atlas["atlas_rock"]
+        self.assertEqual(ship.export_as_string(), ".r.\nrrr")
+        self.assertEqual(rock.export_as_string(), "ww\nw.")
+        self.assertTrue(cckkImage.find(name="atlas_rock") is rock)
+        self.assertTrue(ship.store.shared and rock.store.shared)  # Views of one atlas
+        self.assertEqual([ship.store.mask_row(row) for row in range(2)], [0b010, 0b111])
+
+        rock.set_pixel(1, 0, (255, 0, 0))
+        self.assertEqual(rock.export_as_string(), "ww\nwr")
+        self.assertEqual(ship.export_as_string(), ".r.\nrrr")
+
+        grid = cckkImage.load_atlas(imgStr="rg.\nbwy", frame_size=(1, 1),
+                                    names=["atlas_r", "atlas_g", "atlas_dot", "atlas_b", "atlas_w", "atlas_y"])
+        self.assertEqual([img.export_as_string() for img in grid.values()], ["r", "g", ".", "b", "w", "y"])
+        with self.assertRaises(Exception):
+            cckkImage.load_atlas(imgStr="rg", frames={"outside": cckkShape(2, 2, 0, 0)})
+        sheet1 = cckkImage.load_atlas(imgStr="rrgg\nrrgg", frame_size=(2, 2))
+        sheet2 = cckkImage.load_atlas(imgStr="rrgg\nrrgg", frame_size=(2, 2))  # Default names are not registered
+        self.assertEqual(list(sheet1), ["frame_0", "frame_1"])
+        self.assertEqual(sheet2["frame_1"].export_as_string(), "gg\ngg")
+        self.assertFalse(sheet1["frame_0"].name == sheet2["frame_0"].name)
+        with self.assertRaises(Exception):
+            cckkImage.load_atlas(imgStr="rg.\nbwy", frame_size=(1, 1), names=["atlas_short"])  # Frames would be dropped
+        with self.assertRaises(Exception):
+            cckkImage.load_atlas(imgStr="[atlas_bad\nrr")
+        with self.assertRaises(Exception):
+            cckkImage.load_atlas(imgStr="[atlas_twice]\nrr\n[atlas_twice]\nbb")
+
+    def test_cckkAnimatedImage(self):
+        still = cckkImage(imgStr=".g\ng.")
+        anim = cckkAnimatedImage(frames=["r.\n.r", still, "bbb"], pos=(1, 1))
+        self.assertEqual((anim.frame, anim.frame_count), (0, 3))
+        self.assertEqual(anim.export_as_string(), "r.\n.r")
+        self.assertTrue(anim.frames[1].shared)  # Shares the pixels of the still image
+        self.assertEqual([anim.frames[0].mask_row(row) for row in range(2)], [0b01, 0b10])
+
+        viewer = cckkViewer(images=[anim])
+        viewer.refresh()
+        anim.next_frame()
+        self.assertTrue(anim.store is anim.frames[1])
+        self.assertTrue(viewer.refresh())
+        self.assertEqual(viewer.export_as_string().splitlines()[-3:], ["xxgxxxxx", "xgxxxxxx", "xxxxxxxx"])
+
+        viewer.refresh()
+        anim.frame = 2  # Frames of a different size change the size of the image
+        self.assertEqual(anim.rect, (3, 1, 1, 1))
+        self.assertEqual(viewer.export_as_string().splitlines()[-3:], ["xxxxxxxx", "xbbbxxxx", "xxxxxxxx"])
+        anim.next_frame(2)
+        self.assertEqual(anim.frame, 1)
+        anim.set_pixel(0, 0, (255, 0, 0))
+        self.assertEqual(still.export_as_string(), ".g\ng.")
+        with self.assertRaises(Exception):
+            cckkAnimatedImage().next_frame()
+
+        anim.roll(1, 0)  # Every frame is rolled
+        self.assertEqual(anim.export_as_string(), "g.\n.r")
+        anim.frame = 0
+        self.assertEqual(anim.export_as_string(), ".r\nr.")
+        anim.materialise()
+        anim.next_frame()
+        self.assertEqual(anim.export_as_string(), "g.\n.r")
+        self.assertEqual(still.export_as_string(), ".g\ng.")
+
+        numpy_frames = cckkAnimatedImage(frames=["r", cckkImage(imgStr="g", backend="palette")])
+        numpy_frames.next_frame()
+        self.assertEqual(numpy_frames.backend, "palette")  # Backend of the frame shown
+
+    def test_cckkWorldImage(self):
+        loaded, saved = [], {}
+
+        def loader(chunk_col, chunk_row):
+            loaded.append((chunk_col, chunk_row))
+            if (chunk_col, chunk_row) in saved:
+                return saved[(chunk_col, chunk_row)]
+            return [[(255, 0, 0) if chunk_col == chunk_row else None] * 4 for _ in range(4)]
+
+        def saver(chunk_col, chunk_row, store):
+            saved[(chunk_col, chunk_row)] = store
+
+        world = cckkWorldImage(4000, 4000, chunk_size=(4, 4), loader=loader, saver=saver, max_chunks=4)
+        viewer = cckkViewer(images=[world])
+        viewer.pos = (0, 3992)  # Top-left corner of the world
+        self.assertEqual(viewer.export_as_string().splitlines()[:2], ["rrrrxxxx", "rrrrxxxx"])
+        self.assertEqual(sorted(loaded), [(0, 0), (0, 1), (1, 0), (1, 1)])  # Only the chunks under the viewer
+
+        sprite = cckkImage(imgStr="gg\ngg", pos=(3, 3994))
+        self.assertEqual(world.overlap_count(sprite), 2)
+        world.set_pixel(3, 3995, (0, 255, 0))
+        self.assertEqual(world.mask_at(3995, 0, 8), 0b11111000)
+        self.assertEqual(world.chunk_count, 4)
+
+        viewer.pos = (4000 - 8, 0)  # Other chunks are loaded, and the changed chunk is saved before it is discarded
+        self.assertEqual(viewer.export_as_string().splitlines()[-1], "xxxxrrrr")
+        self.assertEqual(world.chunk_count, 4)
+        self.assertEqual(list(saved), [(0, 1)])
+        self.assertEqual(world.get_pixel(3, 3995), (0, 255, 0))
+
+        small = cckkWorldImage(imgStr="r..\n.g.\n..b", chunk_size=(2, 2))
+        self.assertEqual((small.xcols, small.yrows), (3, 3))
+        self.assertEqual(small.export_as_string(), "r..\n.g.\n..b")
+
+        small.roll(1, 1).materialise()  # Chunks cannot be rolled in place, so the offset is kept
+        self.assertEqual(small.export_as_string(), "b..\n.r.\n..g")
+        self.assertEqual(small.get_pixel(1, 1), (255, 0, 0))
+        small.store.fill(2, 1, 1, 2, (255, 255, 255))  # Areas that wrap around are split
+        self.assertEqual(small.export_as_string(), "b..\n.rw\n..w")
+
+    def test_cckkImage_runs(self):
+        hud = cckkImage(imgStr="r......b\n........\n..gg....", backend="runs", pos=(0, 5))
+        self.assertEqual(hud.store.run_count, 3)  # Only the opaque runs are held
+        self.assertEqual(hud.store.opaque_runs(2), [(2, 4)])
+        self.assertEqual(hud.export_as_string(), "r......b\n........\n..gg....")
+
+        hud.set_pixel(4, 0, (0, 255, 0))  # Joins the run to its left
+        self.assertEqual(hud.store.run_count, 3)
+        hud.set_pixel(2, 0, None)
+        self.assertEqual(hud.export_as_string(), "r......b\n........\n...gg...")
+
+        background = cckkImage(imgStr="\n".join(["wwwwwwww"] * 8))
+        viewer = cckkViewer(images=[hud, background], backend="runs")
+        self.assertEqual(viewer.export_as_string().splitlines()[:3], ["rwwwwwwb", "wwwwwwww", "wwwggwww"])
+        self.assertEqual(hud.overlap_count(background), 4)
+        self.assertEqual(hud.overlap_multi([background]).export_as_string(), "rwwwwwwb\nwwwwwwww\nwwwggwww")
+        hud.roll(1, 0)
+        hud.materialise()
+        self.assertEqual(hud.export_as_string(), "br......\n........\n....gg..")
+
+@unittest.skipIf(np is None, "numpy not installed")
+class test_cckkImage_numpy(unittest.TestCase):
+
+    def test_cckkImage_numpy_create_export(self):
+        img_str = "rg.\n.cy\nxw."
+        img = cckkImage(imgStr=img_str, backend="numpy")
+        self.assertTrue(isinstance(img.store, cckkPixelArray))
+        self.assertEqual(img.store.rgb.shape, (3, 3, 3))
+        self.assertEqual(img.export_as_string(), img_str)
+        self.assertEqual(img.pixels, cckkImage(imgStr=img_str).pixels)
+        self.assertEqual(img.image, cckkImage(imgStr=img_str).image)
+
+    def test_cckkImage_numpy_pixels(self):
+        img = cckkImage(backend="numpy")
+        img.create_from_pixel(4, 3)
+        img.set_pixel(0, 0, pixel=(255, 0, 0))
+        img.set_pixel(2, 1, pixel=(0, 0, 255))
+        self.assertEqual(img.get_pixel(0, 0), (255, 0, 0))
+        self.assertEqual(img.get_pixel(1, 0), None)
+        self.assertEqual(img.export_as_string(), "....\n..b.\nr...")
+        img.roll(1, 1)
+        self.assertEqual(img.export_as_string(), ".r..\n....\n...b")
+        self.assertEqual(cckkImage(imgStr="....\n..b.\nr...").roll(1, 1).export_as_string(), ".r..\n....\n...b")
+        img.set_pixel(2, 1, pixel=None)
+        self.assertEqual(img.get_pixel(2, 1), None)
+
+    def test_cckkImage_numpy_use_backend(self):
+        img = cckkImage(imgStr="rgb\ncym\nxw.")
+        self.assertEqual(img.backend, "list")
+        img.use_backend("numpy")
+        self.assertEqual(img.backend, "numpy")
+        self.assertEqual(img.get_sub_image(cckkShape(2, 2, 1, 1)).export_as_string(), "gb\nym")
+        img.use_backend("list")
+        self.assertEqual(img.export_as_string(), "rgb\ncym\nxw.")
+        with self.assertRaises(Exception):
+            img.use_backend("bitmap")
+
+    def test_cckkImage_numpy_overlap(self):
+        img1 = cckkImage(imgStr="rgb\nc..\nxw.", backend="numpy")
+        img2 = cckkImage(imgStr="rgb\ncym\nxw.", backend="numpy", pos=(-1, -1))
+        self.assertEqual(img1.overlap(img2).export_as_string(), "cb\nxw")
+        self.assertEqual(img2.overlap(img1).export_as_string(), "gb\nym")
+        self.assertEqual(img1.overlap_count(img2), 3)
+
+        imgt = cckkImage(imgStr="tt\ntt\ntt", backend="numpy")
+        imgv = cckkImage(imgStr="vvv")  # Backends can be mixed
+        self.assertEqual(img1.overlap_multi([imgt, imgv]).export_as_string(), "rg.\nct.\nxwv")
+        self.assertEqual(img1.overlap_multi_count([imgt, imgv]), 5)
+
+    def test_cckkImage_image_file_cache(self):
+        from PIL import Image
+        self.addCleanup(cckkImage.clear_file_cache)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "sprite.png")
+            png = Image.new("RGBA", (3, 2), (0, 0, 0, 0))
+            png.putpixel((0, 0), (255, 0, 0, 255))
+            png.putpixel((2, 1), (0, 0, 255, 128))
+            png.save(filename)
+
+            for backend in cckkImage.backends:
+                if backend == "numpy" and np is None:
+                    continue
+                img1 = cckkImage(imgFile=filename, backend=backend)
+                self.assertEqual(img1.export_as_string(), "r..\n..b")
+                img2 = cckkImage(imgFile=filename, backend=backend)
+                self.assertTrue(img1.store.shared and img2.store.shared)  # Decoded once
+                img2.set_pixel(0, 0, (0, 255, 0))
+                self.assertEqual(img1.export_as_string(), "r..\n..b")
+
+            png.putpixel((1, 0), (255, 255, 255, 255))
+            png.save(filename)
+            os.utime(filename, ns=(0, 0))  # Make sure the modification time changes
+            self.assertEqual(cckkImage(imgFile=filename).export_as_string(), "rw.\n..b")
+
 
 if __name__ == "__main__":
     unittest.main()
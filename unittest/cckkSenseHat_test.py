@@ -1,5 +1,21 @@
 import unittest
-from cckk import cckkSenseHat, cckkSenseHatEmu
+from cckk import cckkSenseHat, cckkSenseHatEmu, cckkImage
+
+
+class count_SenseHat(cckkSenseHatEmu):
+    # SenseHat emulator that counts the updates instead of printing them
+    def __init__(self):
+        super().__init__()
+        self.set_count = 0
+        self.clear_count = 0
+
+    def clear(self):
+        super().clear()
+        self.clear_count += 1
+
+    def set_pixels(self, pixel_list):
+        self.last_pixels = pixel_list
+        self.set_count += 1
 
 
 class test_cckkSenseHat(unittest.TestCase):
@@ -18,6 +34,28 @@ class test_cckkSenseHat(unittest.TestCase):
             hat._set_sensehat(hat_emu)
         except Exception:
             self.fail("setSenseHat() raised Exception unexpectedly!")
+
+    def test_cckkSenseHat_update_pixels(self):
+        img = cckkImage(imgStr="r", name="update_pixels_red")
+        hat = cckkSenseHat(images=[img])
+        hat.sense = count_SenseHat()
+        hat.update_pixels()
+        hat.update_pixels()
+        self.assertEqual(hat.sense.set_count, 2)
+        self.assertEqual(hat.sense.clear_count, 1)  # Unchanged frame is sent again without clearing first
+        hat.update_pixels(only_if_changed=True)
+        self.assertEqual(hat.sense.set_count, 2)  # Unchanged frame is not sent again
+
+        hat.move_to_img("update_pixels_red", 1, 0)
+        hat.update_pixels(only_if_changed=True)
+        self.assertEqual(hat.sense.set_count, 3)
+        self.assertEqual(hat.sense.last_pixels[56:58], [(0, 0, 0), (255, 0, 0)])
+
+        sent = hat.sense.last_pixels
+        for xpos in range(2, 5):  # Render into both buffers more than once
+            hat.move_to_img("update_pixels_red", xpos, 0)
+            hat.refresh()
+        self.assertEqual(sent[56:58], [(0, 0, 0), (255, 0, 0)])  # The pixels sent are not changed
         
 
 if __name__ == "__main__":
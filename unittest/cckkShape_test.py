@@ -1,5 +1,7 @@
+import gc
 import unittest
-from cckk import cckkShape, cckkViewer, cckkImage
+import weakref
+from cckk import cckkShape, cckkRect, cckkViewer, cckkImage, np
 
 class test_cckkShape(unittest.TestCase):
     def test_cckkImage_properties(self):
@@ -18,12 +20,127 @@ class test_cckkShape(unittest.TestCase):
         r1 = cckkShape(xcols=3, yrows=3, xpos=0, ypos=0)
         r2 = cckkShape(xcols=3, yrows=3, xpos=1, ypos=1)
         inter = r1.overlap(r2)
-        self.assertTrue(isinstance(inter, cckkShape))
+        self.assertTrue(isinstance(inter, cckkRect))
         self.assertTrue(inter.xpos == 1)
         self.assertTrue(inter.ypos == 1)
         self.assertTrue(inter.xcols == 2)
         self.assertTrue(inter.yrows == 2)
         self.assertTrue(r1.overlap(r2) == r2.overlap(r1))
 
+    def test_cckkRect(self):
+        rect = cckkRect(xcols=3, yrows=2, xpos=1, ypos=4)
+        self.assertEqual((rect.xcols, rect.yrows, rect.xpos, rect.ypos), (3, 2, 1, 4))
+        self.assertEqual(rect.pos, (1, 4))
+        with self.assertRaises(AttributeError):
+            rect.xpos = 5
+
+        shape = cckkShape(xcols=3, yrows=2, xpos=1, ypos=4)
+        self.assertTrue(shape == rect)
+        self.assertTrue(rect == shape)
+        self.assertEqual(shape.rect, rect)
+        self.assertEqual(rect.overlap(cckkRect(2, 2, 3, 5)), cckkRect(1, 1, 3, 5))
+
+        promoted = rect.to_shape(name="promoted_rect")
+        self.assertTrue(isinstance(promoted, cckkShape))
+        self.assertTrue(cckkShape.find(name="promoted_rect") is promoted)
+        self.assertTrue(promoted == rect)
+
+    def test_cckkShape_calculate_mer_keep_within(self):
+        mer = cckkShape.calculate_mer([cckkRect(2, 2, 1, 1), cckkShape(3, 1, 4, 0), cckkRect(1, 4, 0, 3)])
+        self.assertEqual(mer, cckkRect(7, 7, 0, 0))
+        self.assertEqual(cckkShape.calculate_mer([]), cckkRect())
+
+        inner = cckkShape(xcols=3, yrows=3, xpos=9, ypos=-2)
+        inner.keep_within(cckkRect(10, 10, 0, 0))
+        self.assertEqual(inner.pos, (7, 0))
+
+    def test_cckkShape_mer(self):
+        s1 = cckkImage(imgStr="rr\nrr", name="mer_one")
+        s2 = cckkImage(imgStr="bb\nbb", name="mer_two", pos=(4, 4))
+        outer = cckkViewer(images=[s1, s2])
+        self.assertEqual(outer.mer, cckkRect(6, 6, 0, 0))
+
+        s2.move_to(8, 1)  # Moving out expands the MER
+        self.assertEqual(outer.mer, cckkRect(10, 3, 0, 0))
+        s2.move_to(2, 1)  # Moving in from an edge shrinks it again
+        self.assertEqual(outer.mer, cckkRect(4, 3, 0, 0))
+        s1.pos = (1, 1)
+        self.assertEqual(outer.mer, cckkRect(3, 2, 1, 1))
+
+        s3 = cckkImage(imgStr="g", name="mer_three", pos=(9, 0))
+        outer.add_images([s3, s2])  # Added images expand the MER, and the same image can be added twice
+        self.assertEqual(outer.mer, cckkRect(9, 3, 1, 0))
+        outer.hide_image("mer_three")  # Hidden images are still part of the MER
+        s2.move_to(3, 5)
+        self.assertEqual(outer.mer, cckkRect(9, 7, 1, 0))
+
+    def test_cckkShape_registry_weak(self):
+        r1 = cckkShape(xcols=3, yrows=3, xpos=0, ypos=0, name="registry_weak_one")
+        r2 = cckkShape(xcols=3, yrows=3, xpos=1, ypos=1)
+        r2_id = r2.id
+        for i in range(100):
+            r1.overlap(r2)
+            cckkShape.calculate_mer([r1, r2])
+        self.assertTrue(cckkShape.find(name="registry_weak_one") is r1)
+        del r1, r2
+        gc.collect()
+        self.assertTrue(cckkShape.find(name="registry_weak_one") is None)  # Unused shapes leave the registry
+        self.assertTrue(cckkShape.find(id=r2_id) is None)
+
+        img = cckkImage(imgStr="r", name="registry_weak")
+        viewer = cckkViewer(images=[img])
+        del img
+        gc.collect()
+        self.assertTrue(viewer.find_image("registry_weak") is not None)  # Kept alive by the viewer
+        self.assertTrue(cckkShape.find(name="registry_weak") is not None)
+
+    def test_cckkShape_unregister(self):
+        r1 = cckkShape(name="unregister_me")
+        self.assertTrue(r1.registered)
+        self.assertTrue(cckkShape.find(name="unregister_me") is r1)
+        r1.unregister()
+        self.assertFalse(r1.registered)
+        self.assertTrue(cckkShape.find(name="unregister_me") is None)
+        r1.register()
+        self.assertTrue(cckkShape.find(id=r1.id) is r1)
+
+        with cckkShape.scope():
+            r2 = cckkShape(name="scoped")
+            self.assertTrue(cckkShape.find(name="scoped") is r2)
+        self.assertTrue(cckkShape.find(name="scoped") is None)
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test_cckkShape_columns(self):
+        before = cckkShape(2, 2, 40, 40, name="columns_before")
+        columns = cckkShape.use_columns(capacity=2)
+        try:
+            shapes = [cckkShape(1, 1, i, i % 3) for i in range(20)] + [before]
+            self.assertEqual(cckkShape.calculate_mer(shapes), cckkRect(42, 42, 0, 0))
+            before.move_to(10, 1)  # Positions are written through to the columns
+            shapes[0].xcols = 5
+            self.assertEqual(cckkShape.calculate_mer(shapes), cckkRect(20, 3, 0, 0))
+            self.assertEqual(cckkShape.overlapping(cckkRect(2, 1, 3, 0), shapes), [shapes[0], shapes[3]])
+            self.assertEqual(cckkShape.overlapping(cckkRect(2, 1, 3, 0), shapes + [cckkRect(1, 1, 4, 0)]),
+                             [shapes[0], shapes[3], cckkRect(1, 1, 4, 0)])
+            count = len(columns)
+            del shapes
+            self.assertEqual(len(columns), count - 20)  # Slots are freed with the shapes
+
+            images = [cckkImage(imgStr="m", pos=(i, 0)) for i in range(10)]
+            viewer = cckkViewer(images=images)  # The viewer keeps the slots of its images
+            self.assertEqual(viewer.mer, cckkRect(10, 1, 0, 0))
+            images[9].move_to(3, 5)
+            self.assertEqual(viewer.layers_touching(cckkRect(1, 1, 3, 5)), [images[9].name])
+
+            old_columns = weakref.ref(columns)
+            del columns
+            cckkShape.use_columns(capacity=2)  # The shapes let go of the old columns
+            self.assertTrue(old_columns() is None)
+            images[0].move_to(0, 7)
+            self.assertEqual(viewer.mer, cckkRect(9, 8, 0, 0))
+        finally:
+            cckkShape.use_columns(None)
+        self.assertEqual(cckkShape.calculate_mer([before]), cckkRect(2, 2, 10, 1))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,5 @@
 import unittest
-from cckk import cckkImage, cckkViewer, cckkAction, cckkCondition, cckkColourDict
+from cckk import cckkImage, cckkShape, cckkViewer, cckkAction, cckkCondition, cckkColourDict, cckkPixelList, cckkFrameBuffer, np
 
 
 class test_cckkViewer(unittest.TestCase):
@@ -36,6 +36,41 @@ class test_cckkViewer(unittest.TestCase):
         self.assertEqual(viewer.pos, (4,6))
         viewer.undo()
         self.assertEqual(viewer.pos, (1,2))
+        viewer.undo()
+        self.assertEqual(viewer.pos, (0,0))
+        self.assertFalse(viewer.undo())
+
+    def test_cckkViewer_history(self):
+        img = cckkImage(imgStr="rgb\ncym\nxw", name="image_history")
+        viewer = cckkViewer(images=[img], xcols=20, yrows=20)
+        viewer.set_history(max_actions=3)
+        for i in range(10):
+            viewer.move(1, 0)
+        self.assertEqual(viewer.pos, (10,0))
+        for i in range(4):
+            viewer.undo()
+        self.assertEqual(viewer.pos, (7,0))  # Only the last three moves are kept
+
+        viewer.set_history(max_actions=3, coalesce_moves=True)
+        viewer.move_to_img("image_history", 5, 5)
+        viewer.move_to_img("image_history", 6, 6)
+        viewer.move_to_img("image_history", 7, 7)
+        self.assertEqual(img.pos, (7,7))
+        viewer.undo()  # Undo all three moves of the image at once
+        self.assertEqual(img.pos, (0,0))
+        self.assertEqual(viewer.pos, (7,0))
+
+        max_actions = cckkShape.max_actions
+        cckkShape.max_actions = 2
+        try:
+            viewer.set_history()  # Back to the default depth
+            for i in range(5):
+                viewer.move(0, 1)
+            for i in range(3):
+                viewer.undo()
+            self.assertEqual(viewer.pos, (7,3))
+        finally:
+            cckkShape.max_actions = max_actions
 
     def test_cckkViewer_properties(self):
         viewer0 = cckkViewer()
@@ -92,6 +127,72 @@ rgbcymxw"""
         view_str = "rgg\nrgg\nrgg"
         self.assertEqual(img_view.export_as_string(), view_str)
 
+    def test_cckkViewer_render_partial(self):
+        imgr = cckkImage(imgStr="rrrr\nrrrr\nrrrr\nrrrr", pos=(-2, 2))
+        imgg = cckkImage(imgStr="g.g\n.g.", pos=(1, -1))
+        viewer = cckkViewer(images=[imgg, imgr], xcols=4, yrows=4, fill=cckkColourDict.def_colour_dict["v"])
+        view_str = "rrvv\nrrvv\nvvvv\nvgvg"
+        self.assertEqual(viewer.view().export_as_string(), view_str)
+
+        store = cckkPixelList.blank(4, 4, (0, 0, 0))
+        viewer.render_into(store, rect=imgg)
+        self.assertEqual(cckkImage().create_from_store(store).export_as_string(), "xxxx\nxxxx\nxxxx\nxgvg")
+
+        if np is not None:
+            viewer_np = cckkViewer(images=[imgg, imgr], xcols=4, yrows=4, fill=cckkColourDict.def_colour_dict["v"], backend="numpy")
+            self.assertEqual(viewer_np.view().export_as_string(), view_str)
+            imgr.use_backend("numpy")
+            self.assertEqual(viewer.view().export_as_string(), view_str)
+
+    def test_cckkViewer_refresh(self):
+        img_back = cckkImage(imgStr="gggg\ng..g\ng..g\ngggg", name="back_refresh")
+        img_dot = cckkImage(imgStr="r", name="dot_refresh", pos=(1, 1))
+        viewer = cckkViewer(images=[img_dot, img_back], xcols=4, yrows=4)
+        self.assertTrue(viewer.refresh())
+        self.assertFalse(viewer.refresh())  # Nothing changed
+        self.assertEqual(viewer.view().export_as_string(), "gggg\ngxxg\ngrxg\ngggg")
+
+        viewer.move_img("dot_refresh", 1, 1)
+        self.assertTrue(viewer.refresh())  # Old and new areas of the image are rendered again
+        self.assertFalse(viewer.refresh())
+        self.assertEqual(viewer.view().export_as_string(), "gggg\ngxrg\ngxxg\ngggg")
+
+        img_back.set_pixel(0, 0, (0, 0, 255))
+        viewer.hide_image("dot_refresh")
+        self.assertEqual(viewer.view().export_as_string(), "gggg\ngxxg\ngxxg\nbggg")
+        viewer.show_image("dot_refresh")
+        viewer.move(1, 0)
+        self.assertEqual(viewer.view().export_as_string(), "gggx\nxrgx\nxxgx\ngggx")
+        self.assertEqual(viewer.view().export_as_string(),
+                         cckkViewer(images=[img_dot, img_back], xcols=4, yrows=4, xpos=1).view().export_as_string())
+
+    def test_cckkViewer_double_buffer(self):
+        img_dot = cckkImage(imgStr="r", name="dot_buffer")
+        viewer = cckkViewer(images=[img_dot], xcols=2, yrows=1)
+        front = viewer.borrow_pixels()
+        self.assertEqual(front, [(255, 0, 0), (0, 0, 0)])
+        self.assertTrue(viewer.borrow_pixels() is front)  # Unchanged frame is not rendered again
+        self.assertFalse(viewer.pixels is front)  # A copy
+
+        viewer.move_to_img("dot_buffer", 1, 0)
+        back = viewer.borrow_pixels()
+        self.assertFalse(back is front)
+        self.assertEqual(front, [(255, 0, 0), (0, 0, 0)])  # Previous frame is left alone
+        self.assertEqual(back, [(0, 0, 0), (255, 0, 0)])
+
+        pixels = viewer.pixels
+        viewer.move_to_img("dot_buffer", 0, 0)
+        self.assertTrue(viewer.borrow_pixels() is front)  # Buffers are swapped, not reallocated
+        self.assertEqual(front, [(255, 0, 0), (0, 0, 0)])
+        viewer.hide_image("dot_buffer")
+        self.assertEqual(viewer.borrow_pixels(), [(0, 0, 0), (0, 0, 0)])
+        self.assertEqual(pixels, [(0, 0, 0), (255, 0, 0)])  # Copies are not reused for later frames
+        viewer.show_image("dot_buffer")
+
+        buffer = cckkFrameBuffer(2, 1)
+        self.assertTrue(viewer.render_into(buffer) is buffer)
+        self.assertEqual(buffer.pixels(), [(255, 0, 0), (0, 0, 0)])
+
     def test_cckkViewer_pixels(self):
         img_str = "rg.\n.cy\nxw."
         img = cckkImage(imgStr=img_str)
@@ -162,6 +263,68 @@ rgbcymxw"""
         self.assertEqual(viewer.overlap_with("turquoise_with"), "violet_with")
         self.assertEqual(viewer.overlap_with("violet_with"), None)
 
+    def test_cckkViewer_spatial_index(self):
+        img1 = cckkImage(imgStr="rgb\nc..\nxw.", name="one_index")
+        imgt = cckkImage(imgStr="tt\ntt\ntt", name="turquoise_index")
+        imgv = cckkImage(imgStr="vvv", name="violet_index")
+        sprites = [cckkImage(imgStr="m", name=f"sprite_index_{i}", pos=(10 + i, 20)) for i in range(50)]
+        viewer = cckkViewer(images=[img1, imgt] + sprites + [imgv], xcols=3, yrows=3)
+        viewer.use_spatial_index(cell_size=4)
+
+        self.assertEqual(viewer.layers_touching(img1), ["one_index", "turquoise_index", "violet_index"])
+        self.assertEqual(viewer.layers_touching(cckkShape(2, 1, 12, 20)), ["sprite_index_2", "sprite_index_3"])
+        self.assertEqual(viewer.overlap_with("one_index"), "turquoise_index")
+        self.assertEqual(viewer.overlap_with("turquoise_index"), "violet_index")
+        self.assertEqual(viewer.overlap_multi("one_index").export_as_string(), "rg.\nct.\nxwv")
+        self.assertEqual(viewer.overlap_multi_count_img("one_index", ["violet_index"]), 2)
+
+        imgv.move_to(10, 21)  # Index follows the image as it moves
+        self.assertEqual(viewer.overlap_with("turquoise_index"), None)
+        self.assertEqual(viewer.layers_touching(cckkShape(1, 1, 10, 21)), ["violet_index"])
+        self.assertEqual(viewer.overlap_with("sprite_index_0"), None)
+        sprites[0].move(0, 1)
+        self.assertEqual(viewer.overlap_with("sprite_index_0"), "violet_index")
+
+    def test_cckkViewer_spatial_index_condition(self):
+        img_back = cckkImage(imgStr="........\n" * 7 + "........", name="back_index_cond")
+        img_wall = cckkImage(imgStr="b\n" * 7 + "b", name="wall_index_cond", pos=(6, 0))
+        far_walls = [cckkImage(imgStr="b", name=f"far_index_cond_{i}", pos=(40 + i, 40)) for i in range(20)]
+        img_ball = cckkImage(imgStr="r", name="ball_index_cond", pos=(0, 1))
+        viewer = cckkViewer(images=[img_ball, img_wall] + far_walls + [img_back])
+        viewer.use_spatial_index(cell_size=4)
+
+        cond = cckkCondition(unless_overlap=["wall_index_cond"] + [wall.name for wall in far_walls])
+        self.assertFalse(img_ball.can_move_to(6, 1, condition=cond))
+        self.assertTrue(img_ball.can_move_to(5, 1, condition=cond))
+        viewer.sweep_img("ball_index_cond", 20, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (5, 1))
+        self.assertFalse(viewer.move_many([("ball_index_cond", 1, 0)], condition=cond))
+        self.assertTrue(viewer.move_many([("ball_index_cond", -1, 1)], condition=cond))
+        self.assertEqual(img_ball.pos, (4, 2))
+
+        far_walls[0].move_to(3, 2)  # Index follows the wall, so it is found
+        self.assertFalse(img_ball.can_move_to(3, 2, condition=cond))
+        viewer.sweep_img("ball_index_cond", -4, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (4, 2))
+
+    def test_cckkViewer_layer_order(self):
+        img1 = cckkImage(imgStr="rr\nrr", name="one_layer")
+        img2 = cckkImage(imgStr="gg\ngg", name="two_layer")
+        img3 = cckkImage(imgStr="bb\nbb", name="three_layer")
+        viewer = cckkViewer(images=[img1, img2, img3], xcols=2, yrows=2)
+
+        self.assertEqual(viewer.get_assoc_names(), ["one_layer", "two_layer", "three_layer"])
+        self.assertEqual(viewer.get_assoc_names(below_name="one_layer"), ["two_layer", "three_layer"])
+        self.assertEqual(viewer.get_assoc_ids(below_id=img2.id), [img3.id])
+        self.assertEqual(viewer.get_assoc_names(below_name="no_layer"), [])
+        self.assertEqual(viewer.overlap_with("two_layer"), "three_layer")
+
+        self.assertEqual(viewer.assoc_values, [img1, img2, img3])
+        viewer.assoc_values.clear()  # A copy, so the viewer is unchanged
+        self.assertEqual(viewer.view().export_as_string(), "rr\nrr")
+        viewer.hide_image("one_layer")
+        self.assertEqual(viewer.view().export_as_string(), "gg\ngg")
+
     def test_cckkViewer_move_condition(self):
         img_green = cckkImage(imgA = [(0,255,0)], name="green_cond", pos = (0,6))
         img_blue = cckkImage(imgA = [(0,0,255)]*4, name="blue_cond", pos=(0,5))
@@ -186,6 +349,103 @@ rgbcymxw"""
         viewer.move_img("green_cond", -1, 0, condition=cond2)
         self.assertEqual(img_green.pos, (2,5))
 
+    def test_cckkViewer_move_many(self):
+        img_back = cckkImage(imgStr="........\n" * 7 + "........", name="back_many")
+        img_wall = cckkImage(imgStr="b", name="wall_many", pos=(4, 0))
+        img_red = cckkImage(imgStr="r", name="red_many", pos=(0, 0))
+        img_green = cckkImage(imgStr="g", name="green_many", pos=(2, 0))
+        viewer = cckkViewer(images=[img_red, img_green, img_wall, img_back])
+
+        cond = cckkCondition(unless_overlap=["wall_many"])
+        self.assertTrue(viewer.move_many([("red_many", 1, 0), ("green_many", 1, 1)], condition=cond))
+        self.assertEqual((img_red.pos, img_green.pos), ((1, 0), (3, 1)))
+
+        # Green would hit the wall, so neither image moves
+        self.assertFalse(viewer.move_many([("red_many", 1, 0), ("green_many", 1, -1)], condition=cond))
+        self.assertEqual((img_red.pos, img_green.pos), ((1, 0), (3, 1)))
+
+        # Images are kept within the MER of the images
+        self.assertTrue(viewer.move_many([("red_many", -5, 0), ("green_many", 0, 10)]))
+        self.assertEqual((img_red.pos, img_green.pos), ((0, 0), (3, 7)))
+
+        viewer.undo()  # Both images move back
+        self.assertEqual((img_red.pos, img_green.pos), ((1, 0), (3, 1)))
+        with self.assertRaises(Exception):
+            viewer.move_many([("pink_many", 1, 0)])
+
+        # Green would be kept within the MER at (4, 0), on the wall, so neither image moves
+        self.assertFalse(viewer.move_many([("red_many", 1, 0), ("green_many", 1, -5)], condition=cond))
+        self.assertEqual((img_red.pos, img_green.pos), ((1, 0), (3, 1)))
+
+        outside = cckkCondition(keep_rect=cckkShape(20, 20, 0, 0))
+        self.assertTrue(viewer.move_many([("red_many", 9, 0)], condition=outside))
+        self.assertEqual(img_red.pos, (10, 0))
+        viewer.undo()
+        inside = cckkCondition(keep_rect=cckkShape(20, 20, 0, 0), keep_within_assoc=True)
+        self.assertTrue(viewer.move_many([("red_many", 9, 0)], condition=inside))
+        self.assertEqual(img_red.pos, (7, 0))  # Also kept within the MER of the images
+
+    def test_cckkViewer_sweep(self):
+        img_back = cckkImage(imgStr="........\n" * 7 + "........", name="back_sweep")
+        img_wall = cckkImage(imgStr="b\nb\nb", name="wall_sweep", pos=(6, 0))
+        img_ball = cckkImage(imgStr="r", name="ball_sweep", pos=(0, 1))
+        viewer = cckkViewer(images=[img_ball, img_wall, img_back])
+
+        cond = cckkCondition(unless_overlap=["wall_sweep"])
+        viewer.sweep_img("ball_sweep", 20, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (5, 1))  # Stops next to the wall
+        viewer.sweep_img("ball_sweep", 2, 6, condition=cond)
+        self.assertEqual(img_ball.pos, (7, 7))  # Passes the end of the wall
+        viewer.undo()
+        self.assertEqual(img_ball.pos, (5, 1))
+        viewer.sweep_img("ball_sweep", -9, 0)
+        self.assertEqual(img_ball.pos, (0, 1))  # Kept within the MER of the images
+
+        cond2 = cckkCondition(only_if_overlap=["wall_sweep"])
+        img_ball.move_to(6, 0)
+        img_ball.sweep(0, 5, condition=cond2)
+        self.assertEqual(img_ball.pos, (6, 2))  # Stays on the wall
+
+    def test_cckkViewer_compiled_condition(self):
+        img_back = cckkImage(imgStr="........\n" * 7 + "........", name="back_compiled")
+        img_wall = cckkImage(imgStr="b.\n.b", name="wall_compiled", pos=(3, 0))
+        img_ball = cckkImage(imgStr="r", name="ball_compiled", pos=(0, 0))
+        viewer = cckkViewer(images=[img_ball, img_wall, img_back])
+
+        cond = cckkCondition(unless_overlap=["wall_compiled"]).compile()
+        self.assertEqual(cond.unless_mask.rect, (2, 2, 3, 0))
+        self.assertEqual(cond.unless_mask.mask_at(1, 2, 4), 0b0010)
+        img_wall.unregister()  # No more name lookups
+        viewer.sweep_img("ball_compiled", 8, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (3, 0))
+        viewer.move_img("ball_compiled", 1, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (3, 0))
+
+        img_wall.move_to(0, 0)  # Mask follows the wall
+        img_wall.set_pixel(1, 0, (0, 0, 255))
+        viewer.move_img("ball_compiled", 1, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (4, 0))
+        viewer.move_to_img("ball_compiled", 1, 0, condition=cond)
+        self.assertEqual(img_ball.pos, (4, 0))
+        img_wall.register()
+
+    def test_cckkViewer_can_move_to(self):
+        img_green = cckkImage(imgA = [(0,255,0)], name="green_can", pos = (0,6))
+        img_blue = cckkImage(imgA = [(0,0,255)]*4, name="blue_can", pos=(0,5))
+        viewer = cckkViewer(images=[img_green,img_blue])
+
+        cond = cckkCondition(unless_overlap=["blue_can"])
+        self.assertFalse(img_green.can_move_to(2, 5, condition=cond))
+        self.assertTrue(img_green.can_move_to((0, 4), condition=cond))
+        self.assertTrue(img_green.can_move_to(2, 5))
+        self.assertEqual(img_green.overlap_multi_count([img_blue], (3, 5)), 1)
+        self.assertEqual(img_green.pos, (0,6))
+
+        last_id = img_green.last_action_id
+        img_green.move_to(2, 5, condition=cond)  # Rejected without moving or recording an action
+        self.assertEqual(img_green.pos, (0,6))
+        self.assertEqual(img_green.last_action_id, last_id)
+
     def test_cckkViewer_align(self):
         img_str = "rr\nrr"
         img = cckkImage(imgStr=img_str, name="red")